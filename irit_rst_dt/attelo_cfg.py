@@ -54,3 +54,41 @@ def _attelo_fold_args(lconf, fold):
     else:
         return ["--fold", str(fold),
                 "--fold-file", lconf.fold_file]
+
+
+class LazyList(object):
+    """
+    A read-only list which is only built on first use
+
+    Our configuration (learners, decoders, evaluations) needs
+    sklearn and most of attelo to build, which are slow to import.
+    Wrapping it in a `LazyList` means that commands which never
+    look at it do not pay for it.
+    """
+    def __init__(self, builder):
+        self._builder = builder
+        self._items = None
+
+    def _force(self):
+        "the actual list (building it if need be)"
+        if self._items is None:
+            self._items = list(self._builder())
+        return self._items
+
+    def __iter__(self):
+        return iter(self._force())
+
+    def __len__(self):
+        return len(self._force())
+
+    def __getitem__(self, idx):
+        return self._force()[idx]
+
+    def __contains__(self, item):
+        return item in self._force()
+
+    def __add__(self, other):
+        return self._force() + list(other)
+
+    def __repr__(self):
+        return repr(self._force())
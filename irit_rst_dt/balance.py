@@ -0,0 +1,244 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Balancing compute cost across folds and cluster jobs
+
+The cost of a document grows faster than its size: the number of
+candidate pairs is quadratic in the number of EDUs, and some decoders
+(eg. mst) and structured learners do worse than that. We estimate the
+cost of a document as `edus ** exponent`. The exponent is fitted to
+the decoding times of a past evaluation of the same corpus, if we have
+one (see `irit_rst_dt.telemetry`); otherwise it defaults to 2.
+
+Folds are drawn by a randomised longest-processing-time-first
+assignment: documents are taken from the most to the least costly
+(with some random jitter on the costs, so that different seeds give
+different folds), each going to the fold with the least total cost
+so far.
+
+Past telemetry also gives us per-learner and per-evaluation rates
+(seconds per unit of cost), from which we predict how long each
+(fold, learner) unit of work will take, and group those units into
+cluster jobs of roughly equal length.
+"""
+
+from __future__ import print_function
+from collections import (defaultdict, namedtuple)
+from os import path as fp
+import glob
+import heapq
+
+from attelo.io import (load_fold_dict)
+from attelo.table import (UNRELATED)
+
+from .sample import (pack_profiles)
+from .telemetry import (load_telemetry)
+
+# pylint: disable=too-few-public-methods
+
+DEFAULT_EXPONENT = 2.
+"Cost exponent if we have no past telemetry to fit one from"
+
+EXPONENTS = [1., 1.5, 2., 2.5, 3.]
+"Cost exponents we try fitting"
+
+JITTER = 0.25
+"Relative random jitter on document costs when drawing folds"
+
+_MIN_FIT_FOLDS = 3
+"Fewest folds with decoding times we fit an exponent on"
+
+# pylint: disable=pointless-string-statement
+Unit = namedtuple('Unit', ['fold', 'learner', 'cost'])
+"""
+A unit of cluster work: learning and decoding everything for one
+learner in one fold (cost is the predicted time, in seconds if we
+have rates from past telemetry, else in arbitrary units)
+"""
+# pylint: enable=pointless-string-statement
+
+
+def doc_sizes(dpack):
+    """
+    Number of EDUs in each document of a data pack
+
+    :rtype: dict(string, int)
+    """
+    return {p.doc: p.size for p in pack_profiles(dpack, UNRELATED)}
+
+
+def _lpt(items, n_bins, cost):
+    """
+    Longest-processing-time-first assignment of items to bins:
+    each item (in the order given) goes to the bin with the least
+    total cost so far
+
+    :rtype: [[item]]
+    """
+    bins = [[] for _ in range(n_bins)]
+    heap = [(0., i) for i in range(n_bins)]
+    for item in items:
+        total, i = heapq.heappop(heap)
+        bins[i].append(item)
+        heapq.heappush(heap, (total + cost(item), i))
+    return bins
+
+
+def balanced_folds(sizes, n_folds, rng, exponent=DEFAULT_EXPONENT,
+                   jitter=JITTER):
+    """
+    Random fold assignment with roughly equal estimated costs
+
+    :param rng: random number generator (with `random()`)
+    :rtype: dict(string, int)
+    """
+    jittered = {d: (n ** exponent) * (1 + jitter * (2 * rng.random() - 1))
+                for d, n in sorted(sizes.items())}
+    docs = sorted(jittered, key=lambda d: jittered[d], reverse=True)
+    bins = _lpt(docs, n_folds, lambda d: sizes[d] ** exponent)
+    return {d: fold for fold, fdocs in enumerate(bins) for d in fdocs}
+
+
+def fold_costs(sizes, fold_dict, exponent):
+    """
+    Estimated training and test cost of each fold
+
+    :rtype: dict(int, (float, float))
+    """
+    test = defaultdict(float)
+    for doc, fold in fold_dict.items():
+        test[fold] += sizes.get(doc, 0) ** exponent
+    total = sum(test.values())
+    return {f: (total - c, c) for f, c in test.items()}
+
+
+def past_telemetry(lconf, own=True):
+    """
+    Telemetry records and folds of the most recent evaluation (in
+    the same data dir) that has both, trying the current one first;
+    (None, None) if there are none
+
+    :param own: whether to consider the current evaluation
+    """
+    data_dir = fp.dirname(fp.abspath(lconf.eval_dir))
+    fold_base = fp.basename(lconf.fold_file)
+    candidates = [lconf.eval_dir] if own else []
+    candidates.extend(sorted((d for d in glob.glob(fp.join(data_dir,
+                                                           'eval-*'))
+                              if not fp.islink(d) and
+                              fp.realpath(d) != fp.realpath(lconf.eval_dir)),
+                             reverse=True))
+    for eval_dir in candidates:
+        fold_file = fp.join(eval_dir, fold_base)
+        records = load_telemetry(lconf._replace(eval_dir=eval_dir))
+        if records and fp.exists(fold_file):
+            return records, load_fold_dict(fold_file)
+    return None, None
+
+
+def _decode_secs(records):
+    "total decoding time in each fold"
+    secs = defaultdict(float)
+    for rec in records:
+        if rec['phase'] == 'decode' and rec['fold'] is not None:
+            secs[rec['fold']] += rec['end'] - rec['start']
+    return secs
+
+
+def fit_exponent(sizes, fold_dict, records):
+    """
+    The cost exponent that best explains the decoding time of each
+    fold in a past run (least relative squared error, with the
+    best scale for each exponent); None if we have too little data
+    """
+    secs = _decode_secs(records)
+    folds = [f for f in sorted(secs) if secs[f] > 0]
+    if len(folds) < _MIN_FIT_FOLDS:
+        return None
+    best = None
+    for exponent in EXPONENTS:
+        costs = fold_costs(sizes, fold_dict, exponent)
+        ratios = [secs[f] / costs[f][1] for f in folds if costs.get(f)]
+        if len(ratios) < _MIN_FIT_FOLDS:
+            continue
+        scale = sum(ratios) / len(ratios)
+        error = sum((r / scale - 1) ** 2 for r in ratios)
+        if best is None or error < best[0]:
+            best = (error, exponent)
+    return None if best is None else best[1]
+
+
+def fit_rates(sizes, fold_dict, records, exponent):
+    """
+    Seconds per unit of cost, for learning with each learner (on the
+    training part of a fold) and decoding with each evaluation (on
+    its test part)
+
+    :rtype: (dict(string, float), dict(string, float))
+    """
+    costs = fold_costs(sizes, fold_dict, exponent)
+    learn = defaultdict(lambda: [0., 0.])
+    decode = defaultdict(lambda: [0., 0.])
+    seen = set()
+    for rec in records:
+        fold = rec['fold']
+        if fold is None or fold not in costs or not rec['ok']:
+            continue
+        secs = rec['end'] - rec['start']
+        if rec['phase'] == 'learn':
+            learn[rec['learner']][0] += secs
+            if (rec['learner'], fold) not in seen:
+                learn[rec['learner']][1] += costs[fold][0]
+                seen.add((rec['learner'], fold))
+        elif rec['phase'] == 'decode':
+            key = rec['key'].rsplit('-', 1)[0]
+            decode[key][0] += secs
+            if (key, fold) not in seen:
+                decode[key][1] += costs[fold][1]
+                seen.add((key, fold))
+    return ({k: s / c for k, (s, c) in learn.items() if c},
+            {k: s / c for k, (s, c) in decode.items() if c})
+
+
+def work_units(sizes, fold_dict, folds, rconfs, evaluations,
+               exponent, rates=None):
+    """
+    Predicted cost of each (fold, learner) unit of work, and whether
+    the costs are in seconds
+
+    If we have rates (see `fit_rates`) for every learner and
+    evaluation involved, costs are in seconds; otherwise we count
+    one unit of cost per learning or decoding pass
+
+    :rtype: ([Unit], bool)
+    """
+    costs = fold_costs(sizes, fold_dict, exponent)
+    learn_rates, decode_rates = rates or ({}, {})
+    usable = all(r.key in learn_rates for r in rconfs) and\
+        all(e.key in decode_rates for e in evaluations)
+    units = []
+    for fold in folds:
+        train_cost, test_cost = costs.get(fold, (0., 0.))
+        for rconf in rconfs:
+            econfs = [e for e in evaluations
+                      if e.learner.key == rconf.key]
+            if usable:
+                cost = learn_rates[rconf.key] * train_cost +\
+                    sum(decode_rates[e.key] for e in econfs) * test_cost
+            else:
+                cost = train_cost + len(econfs) * test_cost
+            units.append(Unit(fold, rconf.key, cost))
+    return units, usable
+
+
+def plan_jobs(units, n_jobs):
+    """
+    Group units of work into (at most) n jobs of roughly equal
+    predicted cost
+
+    :rtype: [[Unit]]
+    """
+    ordered = sorted(units, key=lambda u: (-u.cost, u.fold, u.learner))
+    return [j for j in _lpt(ordered, n_jobs, lambda u: u.cost) if j]
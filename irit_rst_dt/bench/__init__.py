@@ -0,0 +1,9 @@
+"""
+Benchmarks for the harness itself
+
+Each module here can be run as a script, eg.
+`python -m irit_rst_dt.bench.startup`
+"""
+
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
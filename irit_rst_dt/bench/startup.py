@@ -0,0 +1,98 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Startup-time benchmark for the harness CLI
+
+For each subcommand that should be cheap to start, we time (in a
+fresh interpreter) how long it takes to load the subcommand and
+configure its argument parser, and check that none of the slow
+dependencies (sklearn, the attelo learners/decoders) got pulled in
+along the way. Exits non-zero if any subcommand is over budget or
+imports something it should not.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import subprocess
+import sys
+
+CHEAP_SUBCOMMANDS = [None, 'gather', 'features', 'clean']
+"""
+Subcommands that should start quickly (None is just the top-level
+`irit-rst-dt --help`)
+"""
+
+HEAVY_MODULES = ['sklearn',
+                 'scipy',
+                 'attelo.learning',
+                 'attelo.decoding',
+                 'attelo.harness.report',
+                 'irit_rst_dt.report']
+"Modules that none of the cheap subcommands should import"
+
+DEFAULT_BUDGET = 1.0
+"Seconds we allow for any one subcommand to start"
+
+_CHILD = '''
+import argparse, json, sys, time
+start = time.time()
+from irit_rst_dt.cmd import load_subcommand
+if sys.argv[1] != '-':
+    module = load_subcommand(sys.argv[1])
+    module.config_argparser(argparse.ArgumentParser())
+elapsed = time.time() - start
+print(json.dumps({"elapsed": elapsed,
+                  "heavy": sorted(m for m in sys.argv[2:]
+                                  if m in sys.modules)}))
+'''
+
+
+def measure(subcommand, repeats=3):
+    """
+    Best-of-n startup time for a subcommand, along with any heavy
+    modules it imported
+
+    :rtype: (float, [string])
+    """
+    best = None
+    heavy = []
+    for _ in range(repeats):
+        cmd = [sys.executable, '-c', _CHILD, subcommand or '-']
+        cmd.extend(HEAVY_MODULES)
+        out = subprocess.check_output(cmd).decode('utf-8')
+        result = json.loads(out.strip().splitlines()[-1])
+        if best is None or result['elapsed'] < best:
+            best = result['elapsed']
+        heavy = result['heavy']
+    return best, heavy
+
+
+def main():
+    "run the startup benchmark"
+    psr = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    psr.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                     help='seconds allowed per subcommand '
+                     '(default: %(default)s)')
+    psr.add_argument('--repeats', type=int, default=3,
+                     help='take the best of this many runs')
+    args = psr.parse_args()
+
+    failures = []
+    for subcommand in CHEAP_SUBCOMMANDS:
+        name = subcommand or '(top-level)'
+        elapsed, heavy = measure(subcommand, args.repeats)
+        status = 'ok'
+        if heavy:
+            status = 'FAIL (imports {})'.format(', '.join(heavy))
+        elif elapsed > args.budget:
+            status = 'FAIL (over budget)'
+        if status != 'ok':
+            failures.append(name)
+        print('{:<12}\t{:.3f}s\t{}'.format(name, elapsed, status))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,519 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Synthetic-corpus benchmark for learning, decoding and scoring
+
+Generates a data pack (EDUs, pairings, sparse features, vocabulary)
+for a made-up corpus, and runs the real harness stages over it
+(`delayed_learn`, `delayed_decode`, `post_decode`, fold and global
+reports) for the selected evaluations. This lets us measure the
+harness without the licensed RST-DT and PTB.
+
+The corpus is shaped by the number of documents, the distribution
+of EDUs per document, how many EDUs make up a sentence, the size of
+the label set and the sparsity of the features. Gold structures are
+trees with mostly short, sentence-internal attachments; each label
+has a few signature features so that the learners have something to
+find. Several corpus sizes can be given at once (`--docs 20 50
+--edus 10 30`), in which case every combination is run, so we can
+see how eg. mst and local decoding scale with EDUs per document.
+
+Results go out as JSON: for each run, the shape of the corpus and,
+for each stage, its wall time, throughput (instances per second),
+CPU time and peak memory (taken from the run telemetry); decoding
+is also broken down by learner and core decoder.
+"""
+
+from __future__ import print_function
+from collections import (defaultdict, namedtuple)
+from os import path as fp
+import argparse
+import codecs
+import itertools as itr
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from attelo.io import (load_fold_dict, save_fold_dict)
+from attelo.table import (UNRELATED)
+from attelo.util import (mk_rng)
+import attelo.fold
+
+from ..data import (load_pack)
+from ..decode import (delayed_decode, post_decode)
+from ..learn import (delayed_learn)
+from ..loop import (DataConfig,
+                    LoopConfig,
+                    STAGE_NEEDS)
+from ..path import (edu_input_path,
+                    features_path,
+                    pairings_path,
+                    vocab_path)
+from ..precision import (PRECISIONS)
+from ..report import (mk_fold_report,
+                      mk_global_report)
+from ..selection import (Selection,
+                         check_pattern,
+                         learners,
+                         needs_intra,
+                         select_evaluations)
+from ..telemetry import (load_telemetry)
+from ..util import (concat_i,
+                    parallel)
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DATASET = 'synthetic'
+"Dataset name for the generated files"
+
+ROOT = 'ROOT'
+"Id of the root pseudo-EDU, and label of attachments to it"
+
+STAGE_PHASES = [('learn', ['learn']),
+                ('decode', ['decode']),
+                ('reassembly', ['reassembly']),
+                ('score', ['score', 'report', 'discr']),
+                ('report', ['report', 'discr', 'graph', 'provenance'])]
+"""
+Benchmark stages, and the telemetry phases whose records make up
+each one (the fold reports and the global report share phases, so
+we tell them apart by fold)
+"""
+
+_SIGNATURE_SIZE = 8
+"Number of signature features per label"
+
+# pylint: disable=pointless-string-statement
+CorpusShape = namedtuple('CorpusShape',
+                         ['docs',
+                          'edus',
+                          'edus_spread',
+                          'sentence_edus',
+                          'labels',
+                          'vocab',
+                          'density',
+                          'seed'])
+"""
+Parameters for a synthetic corpus (number of documents, mean and
+standard deviation of EDUs per document, mean EDUs per sentence,
+number of relation labels, vocabulary size, fraction of the
+vocabulary active on each instance, random seed)
+"""
+# pylint: enable=pointless-string-statement
+
+
+def _edu_counts(rng, n_docs, mean, spread):
+    "number of EDUs in each document (at least 2)"
+    return [max(2, int(round(rng.gauss(mean, spread))))
+            for _ in range(n_docs)]
+
+
+def _sentences(rng, n_edus, sentence_edus):
+    """
+    Sentence number for each EDU in a document (sentence lengths
+    are uniform with the given mean)
+    """
+    sents = []
+    snum = 0
+    while len(sents) < n_edus:
+        length = rng.randint(1, max(1, 2 * sentence_edus - 1))
+        sents.extend([snum] * length)
+        snum += 1
+    return sents[:n_edus]
+
+
+def _gold_tree(rng, sents, label_weights):
+    """
+    Head and label for each EDU of a document: the first EDU hangs
+    off the root; others mostly attach nearby, preferring an
+    earlier EDU in the same sentence
+
+    :rtype: [(int or None, string)]
+    """
+    labels, weights = zip(*label_weights)
+    tree = [(None, ROOT)]
+    for i in range(1, len(sents)):
+        same = [j for j in range(i) if sents[j] == sents[i]]
+        if same and rng.random() < 0.7:
+            head = rng.choice(same)
+        else:
+            dist = 1
+            while dist < i and rng.random() < 0.5:
+                dist += 1
+            head = i - dist
+        tree.append((head, _weighted_choice(rng, labels, weights)))
+    return tree
+
+
+def _weighted_choice(rng, items, weights):
+    "weighted random choice"
+    pick = rng.random() * sum(weights)
+    for item, weight in zip(items, weights):
+        pick -= weight
+        if pick <= 0:
+            return item
+    return items[-1]
+
+
+def _label_names(shape):
+    "relation labels (not counting root and unrelated)"
+    return ['rel{:02}'.format(i) for i in range(shape.labels)]
+
+
+def generate(shape, lconf):
+    """
+    Write the data pack files for a synthetic corpus into the
+    evaluation dir; return some counts describing it
+
+    The files are laid out as the feature extraction lays them
+    out: an EDU input file (`id, text, document, sentence, start,
+    end`), pairings (`parent, child`, every candidate parent for
+    every EDU, grouped by child), and an svmlight features file
+    whose header lists the labels (targets count from 1 in that
+    list) along with its vocabulary file
+
+    :rtype: dict
+    """
+    # pylint: disable=too-many-locals
+    rng = random.Random(shape.seed)
+    rels = _label_names(shape)
+    all_labels = [UNRELATED, ROOT] + rels
+    codes = {l: i + 1 for i, l in enumerate(all_labels)}
+    # a skewed (Zipf-like) label distribution, as in the real thing
+    label_weights = [(l, 1. / (i + 1)) for i, l in enumerate(rels)]
+
+    # features: a few signature features per label, distance and
+    # same-sentence features, and noise for the rest of the vocab
+    n_dist = 10
+    n_special = n_dist + 1
+    n_vocab = max(shape.vocab,
+                  n_special + _SIGNATURE_SIZE * (len(all_labels) + 1))
+    signatures = {}
+    for i, label in enumerate(all_labels):
+        start = n_special + i * _SIGNATURE_SIZE
+        signatures[label] = list(range(start, start + _SIGNATURE_SIZE))
+    n_active = max(1, int(round(shape.density * n_vocab)))
+
+    def _features(dist, same_sent, label):
+        "feature indices (0-based) for an instance"
+        feats = set([min(dist, n_dist) - 1])
+        if same_sent:
+            feats.add(n_dist)
+        sig = signatures[label]
+        feats.update(rng.sample(sig, min(len(sig), n_active // 2 or 1)))
+        while len(feats) < n_active + 1:
+            feats.add(rng.randrange(n_special, n_vocab))
+        return sorted(feats)
+
+    counts = {'documents': shape.docs, 'edus': 0, 'instances': 0}
+    with codecs.open(edu_input_path(lconf), 'w', 'utf-8') as edus,\
+            codecs.open(pairings_path(lconf), 'w', 'utf-8') as pairs,\
+            codecs.open(features_path(lconf), 'w', 'utf-8') as feats:
+        feats.write(u'# labels: {}\n'.format(u' '.join(all_labels)))
+        sizes = _edu_counts(rng, shape.docs, shape.edus, shape.edus_spread)
+        for dnum, n_edus in enumerate(sizes):
+            doc = u'd{:05}'.format(dnum)
+            ids = [u'{}_{}'.format(doc, i + 1) for i in range(n_edus)]
+            sents = _sentences(rng, n_edus, shape.sentence_edus)
+            tree = _gold_tree(rng, sents, label_weights)
+            offset = 0
+            for edu, sent in zip(ids, sents):
+                text = u' '.join([u'w'] * rng.randint(3, 12))
+                edus.write(u'\t'.join([edu, text, doc,
+                                       u'{}_s{}'.format(doc, sent),
+                                       str(offset),
+                                       str(offset + len(text))]) + u'\n')
+                offset += len(text) + 1
+            for child, (head, label) in enumerate(tree):
+                for parent in [None] + list(range(n_edus)):
+                    if parent == child:
+                        continue
+                    gold = label if parent == head else UNRELATED
+                    if parent is None:
+                        dist = child + 1
+                        same_sent = False
+                    else:
+                        dist = abs(child - parent)
+                        same_sent = sents[child] == sents[parent]
+                    pid = ROOT if parent is None else ids[parent]
+                    pairs.write(u'{}\t{}\n'.format(pid, ids[child]))
+                    feats.write(u'{} {}\n'.format(
+                        codes[gold],
+                        u' '.join(u'{}:1'.format(f + 1) for f in
+                                  _features(dist, same_sent, gold))))
+                    counts['instances'] += 1
+            counts['edus'] += n_edus
+    with codecs.open(vocab_path(lconf), 'w', 'utf-8') as stream:
+        for i in range(n_vocab):
+            if i < n_dist:
+                name = u'dist={}'.format(i + 1)
+            elif i == n_dist:
+                name = u'same_sentence'
+            else:
+                name = u'f{}'.format(i)
+            stream.write(u'{}\t{}\n'.format(name, i + 1))
+    counts['labels'] = len(all_labels)
+    counts['vocab'] = n_vocab
+    counts['features_bytes'] = os.path.getsize(features_path(lconf))
+    return counts
+
+
+# ---------------------------------------------------------------------
+# running
+# ---------------------------------------------------------------------
+
+
+def _maxrss_kb():
+    "peak resident memory of this process so far (KB), or None"
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss // 1024 if sys.platform == 'darwin' else maxrss
+
+
+def _mk_lconf(work_dir, evaluations, n_jobs, precision):
+    "loop config for a benchmark run in the given directory"
+    eval_dir = fp.join(work_dir, 'eval')
+    scratch_dir = fp.join(work_dir, 'scratch')
+    for path in [eval_dir, scratch_dir]:
+        os.makedirs(path)
+    return LoopConfig(eval_dir=eval_dir,
+                      scratch_dir=scratch_dir,
+                      stage=None,
+                      folds=None,
+                      fold_file=fp.join(eval_dir,
+                                        'folds-{}.json'.format(DATASET)),
+                      n_jobs=n_jobs,
+                      dataset=DATASET,
+                      evaluations=evaluations,
+                      sample=None,
+                      profile=None,
+                      mmap_models=False,
+                      precision=precision)
+
+
+def _stage_stats(records, phases, global_only, wall, instances):
+    """
+    Summary of a stage from its wall time and the telemetry records
+    of its tasks
+
+    :param global_only: None for both, True for the global report
+                        tasks only, False for the per-fold ones only
+    """
+    recs = [r for r in records if r['phase'] in phases and
+            (global_only is None or
+             (r['fold'] is None) == global_only)]
+    rss = [r['peak_rss_kb'] for r in recs if r['peak_rss_kb'] is not None]
+    cpu = [(r['cpu_user'] or 0) + (r['cpu_sys'] or 0) for r in recs]
+    return {'wall_secs': wall,
+            'tasks': len(recs),
+            'task_secs': sum(r['end'] - r['start'] for r in recs),
+            'cpu_secs': sum(cpu),
+            'instances': instances,
+            'instances_per_sec': instances / wall if wall else None,
+            'peak_rss_mb': max(rss) / 1024. if rss else None,
+            'failed': sum(1 for r in recs if not r['ok'])}
+
+
+def _by_decoder(records, evaluations):
+    "decoding task time per learner and core decoder"
+    totals = defaultdict(lambda: {'tasks': 0, 'task_secs': 0.})
+    cores = {e.decoder.key: e.decoder.key[len(e.settings.key) + 1:]
+             for e in evaluations}
+    for rec in records:
+        if rec['phase'] != 'decode':
+            continue
+        key = '{}:{}'.format(rec['learner'],
+                             cores.get(rec['decoder'], rec['decoder']))
+        totals[key]['tasks'] += 1
+        totals[key]['task_secs'] += rec['end'] - rec['start']
+    return dict(totals)
+
+
+def run(shape, evaluations, n_folds, n_jobs, work_dir,
+        precision='double'):
+    """
+    Generate a corpus and run the harness stages over it
+
+    :rtype: dict
+    """
+    # pylint: disable=too-many-locals
+    lconf = _mk_lconf(work_dir, evaluations, n_jobs, precision)
+    start = time.time()
+    corpus = generate(shape, lconf)
+    gen_secs = time.time() - start
+
+    start = time.time()
+    dpack = load_pack(lconf, STAGE_NEEDS[None])
+    load_secs = time.time() - start
+    fold_dict = attelo.fold.make_n_fold(dpack, n_folds, mk_rng())
+    save_fold_dict(fold_dict, lconf.fold_file)
+    dconf = DataConfig(pack=dpack,
+                       folds=load_fold_dict(lconf.fold_file))
+    folds = sorted(frozenset(dconf.folds.values()))
+
+    walls = defaultdict(float)
+    n_train = n_test = 0
+    for fold in folds:
+        n_testing = len(dconf.pack.testing(dconf.folds, fold))
+        n_test += n_testing
+        n_train += len(dconf.pack) - n_testing
+        stages = [('learn',
+                   lambda f=fold: parallel(lconf)(concat_i(
+                       delayed_learn(lconf, dconf, rconf, f,
+                                     needs_intra(evaluations, rconf))
+                       for rconf in learners(evaluations)))),
+                  ('decode',
+                   lambda f=fold: parallel(lconf)(concat_i(
+                       delayed_decode(lconf, dconf, econf, f)
+                       for econf in evaluations))),
+                  ('reassembly',
+                   lambda f=fold: [post_decode(lconf, dconf, econf, f)
+                                   for econf in evaluations]),
+                  ('score',
+                   lambda f=fold: mk_fold_report(lconf, dconf, f))]
+        for name, stage in stages:
+            print('[bench] fold {} {}'.format(fold, name), file=sys.stderr)
+            start = time.time()
+            stage()
+            walls[name] += time.time() - start
+    print('[bench] global report', file=sys.stderr)
+    start = time.time()
+    mk_global_report(lconf, dconf)
+    walls['report'] = time.time() - start
+
+    records = load_telemetry(lconf)
+    n_learners = len(learners(evaluations))
+    instances = {'learn': n_train * n_learners,
+                 'decode': n_test * len(evaluations),
+                 'reassembly': n_test * len(evaluations),
+                 'score': n_test * len(evaluations),
+                 'report': len(dpack) * len(evaluations)}
+    global_only = {'score': False, 'report': True}
+    stages = {'generate': {'wall_secs': gen_secs,
+                           'instances': corpus['instances'],
+                           'instances_per_sec':
+                           corpus['instances'] / gen_secs
+                           if gen_secs else None},
+              'load': {'wall_secs': load_secs,
+                       'instances': len(dpack),
+                       'instances_per_sec':
+                       len(dpack) / load_secs if load_secs else None,
+                       'peak_rss_mb': (_maxrss_kb() or 0) / 1024.}}
+    for name, phases in STAGE_PHASES:
+        stages[name] = _stage_stats(records, phases,
+                                    global_only.get(name),
+                                    walls[name], instances[name])
+    return {'shape': dict(shape._asdict()),
+            'corpus': corpus,
+            'folds': len(folds),
+            'stages': stages,
+            'decoders': _by_decoder(records, evaluations)}
+
+
+def _shapes(args):
+    "corpus shapes for every combination of sizes we were asked for"
+    return [CorpusShape(docs=docs,
+                        edus=edus,
+                        edus_spread=args.edus_spread * edus,
+                        sentence_edus=args.sentence_edus,
+                        labels=args.labels,
+                        vocab=args.vocab,
+                        density=args.density,
+                        seed=args.seed)
+            for docs, edus in itr.product(args.docs, args.edus)]
+
+
+def main():
+    "run the synthetic corpus benchmark"
+    psr = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    psr.add_argument('--docs', type=int, nargs='+', default=[40],
+                     help='number of documents (several for a series; '
+                     'default: %(default)s)')
+    psr.add_argument('--edus', type=float, nargs='+', default=[20],
+                     help='mean EDUs per document (several for a series; '
+                     'default: %(default)s)')
+    psr.add_argument('--edus-spread', type=float, default=0.5,
+                     help='standard deviation of the EDUs per document, '
+                     'relative to the mean (default: %(default)s)')
+    psr.add_argument('--sentence-edus', type=int, default=2,
+                     help='mean EDUs per sentence (default: %(default)s)')
+    psr.add_argument('--labels', type=int, default=16,
+                     help='number of relation labels (default: '
+                     '%(default)s)')
+    psr.add_argument('--vocab', type=int, default=5000,
+                     help='number of features (default: %(default)s)')
+    psr.add_argument('--density', type=float, default=0.005,
+                     help='fraction of the features active on each '
+                     'instance (default: %(default)s)')
+    psr.add_argument('--folds', type=int, default=2,
+                     help='number of folds (default: %(default)s)')
+    psr.add_argument('--seed', type=int, default=20150701,
+                     help='random seed for the corpus '
+                     '(default: %(default)s)')
+    psr.add_argument('--include', metavar='PATTERN', type=check_pattern,
+                     action='append', default=[],
+                     help='only evaluations matching this pattern '
+                     '(see `irit-rst-dt evaluate --include`)')
+    psr.add_argument('--exclude', metavar='PATTERN', type=check_pattern,
+                     action='append', default=[],
+                     help='skip evaluations matching this pattern')
+    psr.add_argument('--n-jobs', type=int, default=-1,
+                     help='number of jobs (as for `evaluate`; '
+                     'default: %(default)s)')
+    psr.add_argument('--precision', choices=PRECISIONS, default='double',
+                     help='storage precision for the feature matrix '
+                     '(as for `evaluate`; default: %(default)s)')
+    psr.add_argument('--output', metavar='FILE',
+                     help='write the results here (default: stdout)')
+    psr.add_argument('--keep', metavar='DIR',
+                     help='generate and run in this directory, and '
+                     'keep it (default: a temporary one, deleted)')
+    args = psr.parse_args()
+
+    selection = Selection(include=args.include, exclude=args.exclude)\
+        if args.include or args.exclude else None
+    evaluations = select_evaluations(selection)
+    if not evaluations:
+        sys.exit('No evaluations match the --include/--exclude patterns')
+
+    base_dir = args.keep or tempfile.mkdtemp(prefix='irit-rst-dt-bench-')
+    results = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpus': multiprocessing.cpu_count(),
+               'n_jobs': args.n_jobs,
+               'precision': args.precision,
+               'evaluations': [e.key for e in evaluations],
+               'runs': []}
+    try:
+        for i, shape in enumerate(_shapes(args)):
+            print('[bench] corpus {}: {} docs, {} EDUs per doc'
+                  ''.format(i, shape.docs, shape.edus), file=sys.stderr)
+            results['runs'].append(
+                run(shape, evaluations, args.folds, args.n_jobs,
+                    fp.join(base_dir, 'run-{}'.format(i)),
+                    precision=args.precision))
+    finally:
+        if args.keep is None:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    blob = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is None:
+        print(blob)
+    else:
+        with open(args.output, 'w') as stream:
+            print(blob, file=stream)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Reclaiming disk space: retention and deduplication
+
+Which runs we keep:
+
+* evaluation dirs with reports (all of them, or only the newest N
+  plus whatever `eval-current` points to); evaluation dirs without
+  reports are deleted, as always
+* scratch dirs are deleted, except for the model files that a kept
+  report vouches for in its provenance hashes (same path, same
+  digest), so that the report can still be checked against them
+* nothing in SNAPSHOTS is ever deleted
+
+Of what remains (SNAPSHOTS included), identical features and model
+files are replaced by hard links to a single copy. Files are only
+read if some other file has exactly the same size, and their digests
+are cached in a manifest (see `irit_rst_dt.provenance`), so repeated
+cleanups do not rehash anything that has not changed. We only ever
+link the large write-once artifacts (features and models), never
+files the harness might rewrite in place.
+"""
+
+from __future__ import print_function
+from collections import (defaultdict, namedtuple)
+from fnmatch import fnmatch
+from os import path as fp
+import glob
+import os
+
+from .provenance import (Manifest)
+
+# pylint: disable=too-few-public-methods
+
+ARTIFACT_PATTERNS = ['*.relations.sparse*', '*model*']
+"Files we may deduplicate (features and models; see `_link_data_files`)"
+
+# pylint: disable=pointless-string-statement
+Plan = namedtuple('Plan', ['delete_dirs', 'delete_files', 'links'])
+"""
+What a cleanup would do: dirs to delete outright, individual files
+to delete (from scratch dirs we are partly keeping), and
+`(path, canonical path)` pairs where the path is to be replaced by
+a hard link to the canonical copy
+"""
+# pylint: enable=pointless-string-statement
+
+
+class Manifests(object):
+    """
+    Digest manifests, one for each algorithm (reports may have been
+    hashed with different ones over time), created on first use
+    """
+    def __init__(self, path_for):
+        self._path_for = path_for
+        self._manifests = {}
+
+    def get(self, algo):
+        "manifest for an algorithm"
+        if algo not in self._manifests:
+            self._manifests[algo] = Manifest(self._path_for(algo), algo)
+        return self._manifests[algo]
+
+    def save(self):
+        "save all of the manifests we have used"
+        for manifest in self._manifests.values():
+            manifest.save()
+
+
+def _is_artifact(path):
+    "True if a file is one we may deduplicate"
+    return any(fnmatch(fp.basename(path), p) for p in ARTIFACT_PATTERNS)
+
+
+def _walk_files(root, skip_dirs=frozenset()):
+    "all regular files (not symlinks) under a dir"
+    for parent, subdirs, fnames in os.walk(root):
+        subdirs[:] = [d for d in subdirs
+                      if fp.join(parent, d) not in skip_dirs]
+        for fname in fnames:
+            path = fp.join(parent, fname)
+            if fp.isfile(path) and not fp.islink(path):
+                yield path
+
+
+def _stamp(eval_dir):
+    "timestamp part of an eval/scratch dir name"
+    return fp.basename(eval_dir).split('-', 1)[1]
+
+
+def _has_reports(eval_dir):
+    "True if an eval dir has any reports in it"
+    return any(f.startswith("reports-") for f in os.listdir(eval_dir))
+
+
+def _provenance_refs(eval_dir):
+    """
+    Files listed in the provenance hashes of the latest report of an
+    evaluation, as {relative path in the scratch dir: (algo, digest)}
+    """
+    hash_files = sorted(glob.glob(fp.join(eval_dir, 'reports-*',
+                                          'provenance', 'hashes.txt')))
+    refs = {}
+    if not hash_files:
+        return refs
+    with open(hash_files[-1]) as stream:
+        for line in stream:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 2:
+                continue
+            path, digest = fields
+            algo, _, digest = digest.rpartition(':')
+            refs[path] = (algo or 'md5', digest)
+    return refs
+
+
+def _vouched_for(scratch_dir, refs, manifests):
+    """
+    Files in a scratch dir that its evaluation's report vouches for
+    (listed in the provenance hashes, with the same digest)
+    """
+    vouched = set()
+    for rel_path, (algo, digest) in refs.items():
+        path = fp.join(scratch_dir, rel_path)
+        if fp.isfile(path) and\
+                manifests.get(algo).update([path])[path] == digest:
+            vouched.add(path)
+    return vouched
+
+
+def plan_retention(data_dirs, keep_last, manifests):
+    """
+    Dirs and files to delete (see the module docs for the policy)
+
+    :param keep_last: number of reported evaluations to keep (None
+                      for all of them)
+    :type manifests: Manifests
+    :rtype: (Plan, [string])
+    """
+    delete_dirs = []
+    delete_files = []
+    reported = []
+    current = set()
+    for data_dir in data_dirs:
+        link = fp.join(data_dir, 'eval-current')
+        if fp.islink(link):
+            current.add(fp.realpath(link))
+        for subdir in sorted(glob.glob(fp.join(data_dir, 'eval-*'))):
+            if fp.islink(subdir):
+                continue
+            if _has_reports(subdir):
+                reported.append(subdir)
+            else:
+                delete_dirs.append(subdir)
+    reported.sort(key=_stamp, reverse=True)
+    kept = [d for i, d in enumerate(reported)
+            if keep_last is None or i < keep_last or
+            fp.realpath(d) in current]
+    delete_dirs.extend(d for d in reported if d not in kept)
+
+    for data_dir in data_dirs:
+        scratch_dirs = glob.glob(fp.join(data_dir, 'scratch-*'))
+        for scratch_dir in sorted(scratch_dirs):
+            if fp.islink(scratch_dir):
+                continue
+            eval_dir = fp.join(data_dir, 'eval-' + _stamp(scratch_dir))
+            vouched = set()
+            if eval_dir in kept:
+                vouched = _vouched_for(scratch_dir,
+                                       _provenance_refs(eval_dir),
+                                       manifests)
+            if not vouched:
+                delete_dirs.append(scratch_dir)
+            else:
+                delete_files.extend(p for p in _walk_files(scratch_dir)
+                                    if p not in vouched)
+    return Plan(delete_dirs, delete_files, []), kept
+
+
+def plan_links(roots, plan, manifest):
+    """
+    `(path, canonical path)` for each deduplicable file under the
+    roots which has the same contents as another but is not already
+    a hard link to it; the canonical copy is the first one found.
+    All paths to a duplicate (ie. its existing hard links) are
+    relinked, so that it actually goes away. We skip anything the
+    retention plan deletes.
+    """
+    skip_dirs = frozenset(plan.delete_dirs)
+    skip_files = frozenset(plan.delete_files)
+    by_inode = defaultdict(list)
+    for root in roots:
+        if not fp.isdir(root):
+            continue
+        for path in _walk_files(root, skip_dirs):
+            if path in skip_files or not _is_artifact(path):
+                continue
+            stat = os.stat(path)
+            by_inode[(stat.st_dev, stat.st_ino, stat.st_size)].append(path)
+    by_size = defaultdict(list)
+    for inode, paths in by_inode.items():
+        by_size[inode[2]].append(inode)
+    # only files with a same-sized twin are worth reading
+    candidates = [i for size, inodes in by_size.items()
+                  if len(inodes) > 1 and size > 0 for i in inodes]
+    digests = manifest.update([by_inode[i][0] for i in candidates])
+    canonical = {}
+    links = []
+    for inode in candidates:
+        paths = by_inode[inode]
+        digest = digests[paths[0]]
+        if digest in canonical:
+            links.extend((p, canonical[digest]) for p in paths)
+        else:
+            canonical[digest] = paths[0]
+    return links
+
+
+def _freed(paths):
+    """
+    bytes we get back by unlinking some files (a file only counts
+    if all of its hard links are among them)
+    """
+    by_inode = defaultdict(int)
+    stats = {}
+    for path in paths:
+        stat = os.lstat(path)
+        key = (stat.st_dev, stat.st_ino)
+        by_inode[key] += 1
+        stats[key] = stat
+    return sum(stats[k].st_size for k, n in by_inode.items()
+               if stats[k].st_nlink <= n)
+
+
+def reclaimable(plan):
+    """
+    Approximate bytes a plan would free, as (deleting, linking)
+    """
+    doomed = list(plan.delete_files)
+    for ddir in plan.delete_dirs:
+        doomed.extend(_walk_files(ddir))
+    return _freed(doomed), _freed([p for p, _ in plan.links])
+
+
+def relink(path, canonical):
+    """
+    Replace a file with a hard link to an identical one (through a
+    rename, so the path is never missing); False if we could not
+    (eg. they are on different devices)
+    """
+    tmp_path = '{}.{}.relink'.format(path, os.getpid())
+    try:
+        os.link(canonical, tmp_path)
+    except OSError:
+        return False
+    os.rename(tmp_path, path)
+    return True
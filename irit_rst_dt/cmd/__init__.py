@@ -1,10 +1,43 @@
 """
 irit-rst-dt subcommands
+
+Subcommand modules are only imported when the subcommand is
+actually used (some of them need most of attelo and sklearn,
+which are slow to load), so we list their help text here
+rather than reading it from the module docstrings
 """
 
 # Author: Eric Kow
 # License: CeCILL-B (French BSD3)
 
-from . import evaluate, features, gather, clean
+import importlib
+
+SUBCOMMANDS = [('gather', 'gather', 'gather features'),
+               ('evaluate', 'evaluate', 'run an experiment'),
+               ('cluster-plan', 'cluster_plan',
+                'generate a SLURM submission script for the current '
+                'evaluation'),
+               ('learning-curve', 'learning_curve',
+                'learning curves over nested fractions of the training data'),
+               ('serve', 'serve',
+                'parse server keeping the combined models loaded'),
+               ('parse', 'parse',
+                'parse new documents with the combined models'),
+               ('compare', 'compare',
+                'compare the performance of two runs'),
+               ('features', 'features', 'print known features'),
+               ('clean', 'clean', 'remove scratch dirs, evals with no scores')]
+"""
+(name, module, help) for each subcommand, where module is
+relative to this package
+"""
+
 
-SUBCOMMANDS = [gather, evaluate, features, clean]
+def load_subcommand(name):
+    """
+    Import and return the module for the given subcommand
+    """
+    for sub_name, module, _ in SUBCOMMANDS:
+        if sub_name == name:
+            return importlib.import_module('.' + module, __name__)
+    raise KeyError('No such subcommand: ' + name)
@@ -9,10 +9,18 @@ from __future__ import print_function
 from os import path as fp
 import os
 import shutil
+import sys
 
 from attelo.harness.util import subdirs
 
-from ..local import LOCAL_TMP
+from ..cleanup import (Manifests,
+                       plan_links,
+                       plan_retention,
+                       reclaimable,
+                       relink)
+from ..local import (LOCAL_TMP,
+                     PROVENANCE_DIGEST,
+                     SNAPSHOTS)
 
 NAME = 'clean'
 
@@ -25,25 +33,84 @@ def config_argparser(parser):
     are to be added.
     """
     parser.set_defaults(func=main)
+    parser.add_argument("--keep-last", metavar='N', type=int,
+                        help="only keep the newest N evaluations with "
+                        "reports (and the current one); default: all")
+    parser.add_argument("--no-dedupe", action='store_true',
+                        help="don't replace identical features/model "
+                        "files with hard links")
+    parser.add_argument("--dry-run", action='store_true',
+                        help="only say what we would do")
 
 
-def main(_):
+def _show_size(nbytes):
+    "bytes in human-readable form"
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if nbytes < 1024:
+            return '{:.1f}{}'.format(nbytes, unit)
+        nbytes /= 1024.
+    return '{:.1f}TB'.format(nbytes)
+
+
+def _manifest_path(algo):
+    "where we cache the digests of the files we dedupe"
+    return fp.join(LOCAL_TMP, 'clean-manifest-{}.json'.format(algo))
+
+
+def _unlink_stale(data_dirs, doomed):
+    """
+    Remove the current eval/scratch symlinks (the latter always,
+    as scratch dirs are never kept whole; the former if we are
+    deleting what it points to)
+    """
+    for data_dir in data_dirs:
+        for name in ["eval-current", "scratch-current"]:
+            link = fp.join(data_dir, name)
+            if not fp.islink(link):
+                continue
+            if name == "scratch-current" or\
+                    fp.join(data_dir, os.readlink(link)) in doomed:
+                os.unlink(link)
+
+
+def main(args):
     """
     Subcommand main.
 
     You shouldn't need to call this yourself if you're using
     `config_argparser`
     """
-    for data_dir in sorted(subdirs(LOCAL_TMP)):
-        if fp.basename(data_dir) == "latest":
-            continue
-        for subdir in subdirs(data_dir):
-            bname = fp.basename(subdir)
-            if bname in ["eval-current", "scratch-current"]:
-                os.unlink(subdir)
-            elif bname.startswith("scratch-"):
-                shutil.rmtree(subdir)
-            elif bname.startswith("eval-"):
-                if not any(f.startswith("reports-") for
-                           f in os.listdir(subdir)):
-                    shutil.rmtree(subdir)
+    data_dirs = [d for d in sorted(subdirs(LOCAL_TMP))
+                 if fp.basename(d) != "latest"]
+    manifests = Manifests(_manifest_path)
+    plan, kept = plan_retention(data_dirs, args.keep_last, manifests)
+    if not args.no_dedupe:
+        links = plan_links(data_dirs + [SNAPSHOTS], plan,
+                           manifests.get(PROVENANCE_DIGEST))
+        plan = plan._replace(links=links)
+    manifests.save()
+    deleting, linking = reclaimable(plan)
+
+    verb = 'Would' if args.dry_run else 'Will'
+    print('{} keep {} evaluations; delete {} dirs and {} other files; '
+          'relink {} duplicate files'
+          ''.format(verb, len(kept), len(plan.delete_dirs),
+                    len(plan.delete_files), len(plan.links)),
+          file=sys.stderr)
+    for ddir in plan.delete_dirs:
+        print('  delete', ddir, file=sys.stderr)
+    if not args.dry_run:
+        _unlink_stale(data_dirs, frozenset(plan.delete_dirs))
+        for ddir in plan.delete_dirs:
+            shutil.rmtree(ddir)
+        for path in plan.delete_files:
+            os.remove(path)
+        failed = [p for p, canonical in plan.links
+                  if not relink(p, canonical)]
+        if failed:
+            print('Could not relink {} files (on different devices?)'
+                  ''.format(len(failed)), file=sys.stderr)
+    print('{} reclaimed: {} from deleting, {} from deduplication'
+          ''.format('Space that would be' if args.dry_run else 'Space',
+                    _show_size(deleting), _show_size(linking)),
+          file=sys.stderr)
@@ -0,0 +1,224 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+generate a SLURM submission script for the current evaluation
+"""
+
+from __future__ import print_function
+from collections import defaultdict
+from os import path as fp
+import sys
+
+from attelo.io import (load_fold_dict)
+from six.moves import (shlex_quote)
+
+from ..balance import (DEFAULT_EXPONENT,
+                       doc_sizes,
+                       fit_exponent,
+                       fit_rates,
+                       past_telemetry,
+                       plan_jobs,
+                       work_units)
+from ..data import (load_pack)
+from ..local import (TRAINING_CORPUS)
+from ..loop import (ClusterStage,
+                    LoopConfig,
+                    STAGE_NEEDS)
+from ..path import (sample_path,
+                    selection_path)
+from ..sample import (load_sample,
+                      sample_pack,
+                      show_duration)
+from ..selection import (learners,
+                         load_selection,
+                         select_evaluations)
+from ..util import (exit_ungathered,
+                    latest_tmp,
+                    sanity_check_config)
+
+NAME = 'cluster-plan'
+
+_HEADER = """#!/bin/bash
+# Generated by `irit-rst-dt cluster-plan` for {eval_dir}
+# {summary}
+# Usage: bash THIS_SCRIPT [EVALUATE_FLAGS...]
+# (run `irit-rst-dt evaluate --start` first)
+
+IRIT_RST_DT=$HOME/irit-rst-dt
+cd "$IRIT_RST_DT"
+
+mkdir -p OLD-LOGS
+mv irit-rst-dt-evaluate-*.out OLD-LOGS
+
+EVALUATE_FLAGS=("$@")
+if [ ! -e "$IRIT_RST_DT"/cluster/env ]; then
+    echo >&2 "Please set up your cluster/env script"
+    echo >&2 "(copy from example and edit)"
+    exit 1
+fi
+
+
+function j_sbatch {{
+    sbatch "$@" | sed -e 's/Submitted batch job //'
+}}
+
+function mk_deps {{
+    for job in "$@"; do
+       dep_str="${{dep_str+$dep_str:}}$job"
+    done
+    echo "${{dep_str+afterok:}}$dep_str"
+}}
+
+set -e
+source "$IRIT_RST_DT/cluster/env"
+# generate the global model (slow, so we start it first)
+jobs+=($(j_sbatch\\
+    "$IRIT_RST_DT"/cluster/evaluate.script --combined-models\\
+    "${{EVALUATE_FLAGS[@]}}"))
+"""
+
+_FOOTER = """# generate the report when all jobs are done
+job_str=$(mk_deps "${jobs[@]}")
+sbatch --dependency="$job_str" "$IRIT_RST_DT"/cluster/report.script
+"""
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.set_defaults(func=main)
+    psr.add_argument("--jobs", metavar='N', type=int, default=5,
+                     help="number of (fold/learner) jobs to submit "
+                     "(default: %(default)s)")
+    psr.add_argument("--cpus", metavar='N', type=int, default=64,
+                     help="cpus per job (default: %(default)s)")
+    psr.add_argument("--output", metavar='FILE',
+                     help="write the script here (default: stdout)")
+
+
+def _selection_flags(selection):
+    """
+    Evaluate flags that restrict a job to one learner but otherwise
+    keep the saved selection (learner includes would be alternatives
+    to the one we ask for, so we drop them)
+    """
+    flags = []
+    if selection is None:
+        return flags
+    for pattern in selection.include:
+        if not pattern.startswith('learner:'):
+            flags.extend(['--include', pattern])
+    for pattern in selection.exclude:
+        flags.extend(['--exclude', pattern])
+    return flags
+
+
+def _show_cost(cost, in_secs):
+    "predicted cost of some work"
+    return show_duration(cost) if in_secs else '{:.3g} units'.format(cost)
+
+
+def _job_lines(job, sel_flags, cpus, in_secs):
+    """
+    Script lines submitting a job: one evaluate call for each learner
+    in it, over the folds we have assigned to that learner
+    """
+    by_learner = defaultdict(list)
+    for unit in job:
+        by_learner[unit.learner].append(unit.fold)
+    calls = []
+    for learner in sorted(by_learner):
+        args = ['--folds'] + [str(f) for f in sorted(by_learner[learner])]
+        args += ['--include', 'learner:' + learner] + sel_flags
+        calls.append('bash \\"$IRIT_RST_DT\\"/cluster/evaluate.script ' +
+                     ' '.join(shlex_quote(a) for a in args) +
+                     ' ${EVALUATE_FLAGS[*]}')
+    units = ', '.join('{}/{}'.format(u.fold, u.learner)
+                      for u in sorted(job))
+    return ['# predicted: {} ({})'
+            ''.format(_show_cost(sum(u.cost for u in job), in_secs), units),
+            'jobs+=($(j_sbatch --output=irit-rst-dt-evaluate-%j.out\\',
+            '    --cpus-per-task={}\\'.format(cpus),
+            '    --wrap="{}"))'.format(' &&\\\n    '.join(calls))]
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    sanity_check_config()
+    if args.jobs < 1:
+        sys.exit("Need at least one job")
+    data_dir = latest_tmp()
+    if not fp.exists(data_dir):
+        exit_ungathered()
+    eval_dir = fp.join(data_dir, "eval-current")
+    scratch_dir = fp.join(data_dir, "scratch-current")
+    dataset = fp.basename(TRAINING_CORPUS)
+    fold_file = fp.join(eval_dir, "folds-%s.json" % dataset)
+    if not fp.exists(fold_file) or not fp.exists(scratch_dir):
+        sys.exit("No current evaluation to plan for "
+                 "(try `irit-rst-dt evaluate --start`)")
+
+    lconf = LoopConfig(eval_dir=eval_dir,
+                       scratch_dir=scratch_dir,
+                       folds=None,
+                       stage=ClusterStage.main,
+                       fold_file=fold_file,
+                       n_jobs=0,
+                       dataset=dataset,
+                       evaluations=None,
+                       sample=None,
+                       profile=None,
+                       mmap_models=False,
+                       precision='double')
+    selection = load_selection(selection_path(lconf))
+    evaluations = select_evaluations(selection)
+    dpack = load_pack(lconf, STAGE_NEEDS[ClusterStage.start])
+    sample = load_sample(sample_path(lconf))
+    if sample is not None:
+        dpack = sample_pack(dpack, sample['docs'])
+    sizes = doc_sizes(dpack)
+    fold_dict = load_fold_dict(fold_file)
+
+    rates = None
+    exponent = DEFAULT_EXPONENT
+    records, past_folds = past_telemetry(lconf)
+    if records is not None:
+        exponent = fit_exponent(sizes, past_folds, records) or exponent
+        rates = fit_rates(sizes, past_folds, records, exponent)
+    units, in_secs = work_units(sizes, fold_dict,
+                                sorted(frozenset(fold_dict.values())),
+                                learners(evaluations), evaluations,
+                                exponent, rates)
+    jobs = plan_jobs(units, args.jobs)
+    costs = [sum(u.cost for u in j) for j in jobs]
+    summary = '{} units of work in {} jobs; longest {}, shortest {}{}'\
+        ''.format(len(units), len(jobs),
+                  _show_cost(max(costs), in_secs),
+                  _show_cost(min(costs), in_secs),
+                  '' if in_secs else ' (no past telemetry to time)')
+    print(summary, file=sys.stderr)
+
+    sel_flags = _selection_flags(selection)
+    lines = [_HEADER.format(eval_dir=fp.realpath(eval_dir),
+                            summary=summary)]
+    for i, job in enumerate(jobs, 1):
+        lines.append('# job {}'.format(i))
+        lines.extend(_job_lines(job, sel_flags, args.cpus, in_secs))
+    lines.append(_FOOTER)
+    script = '\n'.join(lines)
+    if args.output is None:
+        print(script)
+    else:
+        with open(args.output, 'w') as stream:
+            print(script, file=stream)
+        print('Submission script saved in', args.output, file=sys.stderr)
@@ -0,0 +1,93 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+compare the performance of two runs
+"""
+
+from __future__ import print_function
+from os import path as fp
+import sys
+
+from ..local import (SNAPSHOTS)
+from ..perf import (DEFAULT_ALPHA,
+                    DEFAULT_MIN_CHANGE,
+                    compare_perf,
+                    find_perf,
+                    load_perf,
+                    show_changes,
+                    show_totals)
+from ..util import (latest_tmp)
+
+NAME = 'compare'
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.set_defaults(func=main)
+    psr.add_argument("baseline", metavar='BASELINE',
+                     help="baseline run: an evaluation dir, a report "
+                     "dir, a perf.json, or the name of a snapshot in "
+                     "{}".format(SNAPSHOTS))
+    psr.add_argument("run", metavar='RUN', nargs='?',
+                     help="run to check against it (same forms; "
+                     "default: the current evaluation)")
+    psr.add_argument("--alpha", type=float, default=DEFAULT_ALPHA,
+                     help="significance level (default: %(default)s)")
+    psr.add_argument("--min-change", type=float,
+                     default=DEFAULT_MIN_CHANGE,
+                     help="smallest relative increase to flag "
+                     "(default: %(default)s)")
+    psr.add_argument("--flagged-only", action='store_true',
+                     help="only list the regressions")
+
+
+def _get_perf(name):
+    """
+    Load the performance profile for a run, looking for it in the
+    snapshots dir if it's not a path (exits if we can't find one)
+    """
+    for path in [name, fp.join(SNAPSHOTS, name)]:
+        if fp.exists(path):
+            ppath = find_perf(path)
+            if ppath is None:
+                sys.exit("No perf.json in {} (was it evaluated with an "
+                         "older harness?)".format(path))
+            return ppath, load_perf(ppath)
+    sys.exit("No such run: {}".format(name))
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+
+    Exits with status 1 if there are any regressions
+    """
+    run = args.run or fp.join(latest_tmp(), 'eval-current')
+    base_path, base = _get_perf(args.baseline)
+    new_path, new = _get_perf(run)
+    print('Baseline: {}\nRun:      {}\n'.format(base_path, new_path))
+    for group in ['phases', 'learners', 'decoders']:
+        print('Totals by {}'.format(group[:-1]))
+        print(show_totals(base, new, group))
+        print()
+    changes = compare_perf(base, new,
+                           alpha=args.alpha,
+                           min_change=args.min_change)
+    print('Task types (medians)')
+    print(show_changes(changes, only_flagged=args.flagged_only))
+    flagged = [c for c in changes if c.flagged]
+    if flagged:
+        print('\n{} regression(s) in {} task types'
+              ''.format(len(flagged),
+                        len(frozenset(c.task_type for c in flagged))),
+              file=sys.stderr)
+        sys.exit(1)
@@ -8,30 +8,60 @@ run an experiment
 from __future__ import print_function
 from os import path as fp
 import glob
+import json
 import os
 import sys
+import time
 
-from attelo.io import (load_data_pack,
-                       load_fold_dict, save_fold_dict)
+from attelo.io import (load_fold_dict, save_fold_dict)
 from attelo.harness.util import\
-    timestamp, call, force_symlink
+    timestamp, call, force_symlink, makedirs
+from attelo.table import (UNRELATED)
 from attelo.util import (mk_rng)
-import attelo.fold
-import attelo.score
-import attelo.report
 
+from ..balance import (DEFAULT_EXPONENT,
+                       balanced_folds,
+                       doc_sizes,
+                       fit_exponent,
+                       past_telemetry)
+from ..data import (force_pack,
+                    load_pack)
 from ..decode import (delayed_decode, post_decode)
-from ..learn import (LEARNERS,
-                     delayed_learn,
+from ..learn import (delayed_learn,
                      mk_combined_models)
-from ..local import (EVALUATIONS,
+from ..local import (SAMPLE_FOLDS,
+                     SAMPLE_SEED,
+                     SAMPLE_SIZE,
                      TRAINING_CORPUS)
 from ..path import (edu_input_path,
                     fold_dir_path,
-                    features_path,
-                    pairings_path)
+                    fold_timings_path,
+                    report_dir_path,
+                    sample_path,
+                    selection_path)
+from ..precision import (PRECISIONS,
+                         baseline_folds,
+                         save_precision,
+                         saved_precision)
+from ..progress import (tracking)
 from ..report import (mk_fold_report,
                       mk_global_report)
+from ..sample import (SampleConfig,
+                      estimate_runtime,
+                      load_sample,
+                      pack_profiles,
+                      sample_pack,
+                      save_sample,
+                      show_duration,
+                      stratified_sample)
+from ..selection import (Selection,
+                         check_pattern,
+                         learners,
+                         load_selection,
+                         needs_intra,
+                         save_selection,
+                         select_evaluations,
+                         show_plan)
 from ..util import (concat_i,
                     exit_ungathered,
                     latest_tmp,
@@ -39,12 +69,14 @@ from ..util import (concat_i,
                     sanity_check_config)
 from ..loop import (LoopConfig,
                     DataConfig,
-                    ClusterStage)
+                    ClusterStage,
+                    STAGE_NEEDS)
 
 # pylint: disable=too-few-public-methods
 
 NAME = 'evaluate'
 _DEBUG = 0
+_N_FOLDS = 10
 
 # ---------------------------------------------------------------------
 # CODE CONVENTIONS USED HERE
@@ -149,36 +181,191 @@ def _create_eval_dirs(args, data_dir, jumpstart):
 
 def _generate_fold_file(lconf, dpack):
     """
-    Generate the folds file
+    Generate the folds file, balancing the estimated cost of the
+    folds (unless we are resuming an evaluation, which keeps the
+    folds it already has, or we are in single precision, which
+    borrows the folds of a double precision evaluation to check
+    its scores against)
     """
+    if fp.exists(lconf.fold_file):
+        return
+    sizes = doc_sizes(dpack)
+    fold_dict = baseline_folds(lconf, sizes)
+    if fold_dict is not None:
+        print('Reusing the folds of the last double precision evaluation',
+              file=sys.stderr)
+        save_fold_dict(fold_dict, lconf.fold_file)
+        return
     rng = mk_rng()
-    fold_dict = attelo.fold.make_n_fold(dpack, 10, rng)
+    n_folds = _N_FOLDS if lconf.sample is None else lconf.sample.folds
+    records, past_folds = past_telemetry(lconf, own=False)
+    exponent = None
+    if records is not None:
+        exponent = fit_exponent(sizes, past_folds, records)
+    if exponent is None:
+        exponent = DEFAULT_EXPONENT
+        print('Balancing folds on edus ** {}'.format(exponent),
+              file=sys.stderr)
+    else:
+        print('Balancing folds on edus ** {} (fitted to past decoding '
+              'times)'.format(exponent), file=sys.stderr)
+    fold_dict = balanced_folds(sizes, n_folds, rng, exponent)
     save_fold_dict(fold_dict, lconf.fold_file)
 
 
-def _do_fold(lconf, dconf, fold):
+def _sample_pack(lconf, dpack):
+    """
+    Restrict the data pack to a stratified sample of its documents
+    (drawing the sample if we have not already done so for this
+    evaluation)
+    """
+    spath = sample_path(lconf)
+    saved = load_sample(spath)
+    if saved is None or\
+       SampleConfig(saved['size'], saved['seed'], saved['folds'])\
+       != lconf.sample:
+        profiles = pack_profiles(dpack, UNRELATED)
+        docs = stratified_sample(profiles,
+                                 lconf.sample.size,
+                                 lconf.sample.seed)
+        saved = dict(lconf.sample._asdict(),
+                     docs=docs,
+                     documents=len(profiles),
+                     instances=len(dpack))
+        save_sample(spath, saved)
+    print('Sample: {} of {} documents, {} folds'
+          ''.format(len(saved['docs']), saved['documents'],
+                    lconf.sample.folds),
+          file=sys.stderr)
+    return sample_pack(dpack, saved['docs'])
+
+
+def _save_timings(lconf, dconf, fold, learn_secs, decode_secs,
+                  part=None):
+    """
+    Record the time spent learning and decoding in a fold (or our
+    part of it), along with the number of instances involved
+    """
+    n_testing = len(dconf.pack.testing(dconf.folds, fold))
+    with open(fold_timings_path(lconf, fold, part), 'w') as stream:
+        json.dump({'learn': learn_secs,
+                   'decode': decode_secs,
+                   'training': len(dconf.pack) - n_testing,
+                   'testing': n_testing}, stream, indent=2)
+
+
+def _load_timings(lconf, fold):
+    """
+    Time spent learning and decoding in a fold (adding up the parts
+    if it was done a few learners at a time), or None
+    """
+    tpath = fold_timings_path(lconf, fold)
+    if fp.exists(tpath):
+        with open(tpath) as stream:
+            return json.load(stream)
+    parts = []
+    for ppath in glob.glob(fold_timings_path(lconf, fold, '*')):
+        with open(ppath) as stream:
+            parts.append(json.load(stream))
+    if not parts:
+        return None
+    res = dict(parts[0])
+    res['learn'] = sum(p['learn'] for p in parts)
+    res['decode'] = sum(p['decode'] for p in parts)
+    return res
+
+
+def _mk_sample_estimate(lconf, dconf):
+    """
+    Estimate how long a full-corpus evaluation would take from
+    the costs measured on the sample
+    """
+    timings = []
+    for fold in sorted(frozenset(dconf.folds.values())):
+        timing = _load_timings(lconf, fold)
+        if timing is not None:
+            timings.append(timing)
+    saved = load_sample(sample_path(lconf))
+    if not timings or saved is None:
+        return
+    learn, decode = estimate_runtime(timings, saved['instances'],
+                                     _N_FOLDS)
+    lines = ['Sample of {} documents (of {}), {} folds, seed {}'
+             ''.format(len(saved['docs']), saved['documents'],
+                       saved['folds'], saved['seed']),
+             'Estimated full-corpus runtime ({} folds + combined models, '
+             '{} instances):'.format(_N_FOLDS, saved['instances']),
+             '  learning: {}'.format(show_duration(learn)),
+             '  decoding: {}'.format(show_duration(decode)),
+             '  total:    {}'.format(show_duration(learn + decode)),
+             '(linear in the number of instances; sequential time, so '
+             'divide by the parallelism you expect)']
+    if len(timings) < len(frozenset(dconf.folds.values())):
+        lines.append('(only {} folds were timed)'.format(len(timings)))
+    report_dir = report_dir_path(lconf, None)
+    makedirs(report_dir)
+    with open(fp.join(report_dir, 'sample-estimate.txt'), 'w') as stream:
+        print('\n'.join(lines), file=stream)
+    print('\n'.join(lines), file=sys.stderr)
+
+
+def _partial_run(lconf):
+    """
+    Name for our part of the folds if this is a cluster job doing
+    only some of the evaluation's learners (see `cluster-plan`),
+    else None
+
+    Such jobs share the folds with others, so they leave the fold
+    reports to the end stage
+    """
+    if lconf.stage != ClusterStage.main:
+        return None
+    full = select_evaluations(load_selection(selection_path(lconf)))
+    if frozenset(e.key for e in full) ==\
+            frozenset(e.key for e in lconf.evaluations):
+        return None
+    return '-'.join(sorted(r.key for r in learners(lconf.evaluations)))
+
+
+def _fold_report_done(lconf, fold):
+    "True if we have a (complete) fold report"
+    return fp.exists(fp.join(report_dir_path(lconf, fold),
+                             'scores-summary.txt'))
+
+
+def _do_fold(lconf, dconf, fold, part=None):
     """
-    Run all learner/decoder combos within this fold
+    Run all learner/decoder combos within this fold (for a partial
+    run, leaving the fold report to the end stage)
     """
     fold_dir = fold_dir_path(lconf, fold)
     print(_fold_banner(lconf, fold), file=sys.stderr)
     if not os.path.exists(fold_dir):
         os.makedirs(fold_dir)
 
-    # learn all models in parallel
-    include_intra = any(e.settings.intra is not None
-                        for e in EVALUATIONS)
+    # learn all models in parallel (only those that the selected
+    # evaluations need)
+    evaluations = lconf.evaluations
+    start = time.time()
     learner_jobs = concat_i(delayed_learn(lconf, dconf, rconf, fold,
-                                          include_intra)
-                            for rconf in LEARNERS)
+                                          needs_intra(evaluations, rconf))
+                            for rconf in learners(evaluations))
     parallel(lconf)(learner_jobs)
+    learned = time.time()
     # run all model/decoder joblets in parallel
     decoder_jobs = concat_i(delayed_decode(lconf, dconf, econf, fold)
-                            for econf in EVALUATIONS)
+                            for econf in evaluations)
     parallel(lconf)(decoder_jobs)
-    for econf in EVALUATIONS:
+    for econf in evaluations:
         post_decode(lconf, dconf, econf, fold)
-    mk_fold_report(lconf, dconf, fold)
+    _save_timings(lconf, dconf, fold, learned - start, time.time() - learned,
+                  part)
+    if part is None:
+        mk_fold_report(lconf, dconf, fold)
+    elif _fold_report_done(lconf, fold):
+        # stale now that we have new predictions
+        os.remove(fp.join(report_dir_path(lconf, fold),
+                          'scores-summary.txt'))
 
 
 def _is_standalone_or(lconf, stage):
@@ -197,29 +384,45 @@ def _do_corpus(lconf):
     if not os.path.exists(edus_file):
         exit_ungathered()
 
-    has_stripped = (lconf.stage in [ClusterStage.end, ClusterStage.start]
-                    and fp.exists(features_path(lconf, stripped=True)))
-    dpack = load_data_pack(edus_file,
-                           pairings_path(lconf),
-                           features_path(lconf, stripped=has_stripped),
-                           verbose=True)
+    dpack = load_pack(lconf, STAGE_NEEDS[lconf.stage])
+    if lconf.sample is not None:
+        dpack = _sample_pack(lconf, dpack)
 
     if _is_standalone_or(lconf, ClusterStage.start):
         _generate_fold_file(lconf, dpack)
+        if saved_precision(lconf) != lconf.precision:
+            if lconf.precision == 'single':
+                force_pack(dpack)  # to measure the memory saved
+            save_precision(lconf)
 
     dconf = DataConfig(pack=dpack,
                        folds=load_fold_dict(lconf.fold_file))
 
-    if _is_standalone_or(lconf, ClusterStage.main):
-        foldset = lconf.folds if lconf.folds is not None\
-            else frozenset(dconf.folds.values())
-        for fold in foldset:
-            _do_fold(lconf, dconf, fold)
+    foldset = lconf.folds if lconf.folds is not None\
+        else frozenset(dconf.folds.values())
+    if lconf.stage is None:
+        show_plan(lconf, foldset, combined=True)
+    elif lconf.stage == ClusterStage.main:
+        show_plan(lconf, foldset)
+    elif lconf.stage == ClusterStage.combined_models:
+        show_plan(lconf, [], combined=True)
+
+    part = _partial_run(lconf)
+    with tracking(lconf, foldset, fold_reports=part is None):
+        if _is_standalone_or(lconf, ClusterStage.main):
+            for fold in foldset:
+                _do_fold(lconf, dconf, fold, part)
 
-    if _is_standalone_or(lconf, ClusterStage.combined_models):
-        mk_combined_models(lconf, dconf)
+        if _is_standalone_or(lconf, ClusterStage.combined_models):
+            mk_combined_models(lconf, dconf)
 
     if _is_standalone_or(lconf, ClusterStage.end):
+        # folds done by partial runs (or from an older harness)
+        for fold in sorted(frozenset(dconf.folds.values())):
+            if not _fold_report_done(lconf, fold):
+                mk_fold_report(lconf, dconf, fold)
+        if lconf.sample is not None:
+            _mk_sample_estimate(lconf, dconf)
         mk_global_report(lconf, dconf)
 
 # ---------------------------------------------------------------------
@@ -248,6 +451,37 @@ def config_argparser(psr):
                      help="copy any model files over from last evaluation "
                      "(useful if you just want to evaluate recent changes "
                      "to the decoders without losing previous scores)")
+    psr.add_argument("--include", metavar='PATTERN', type=check_pattern,
+                     action='append', default=[],
+                     help="only run evaluations matching this pattern "
+                     "(eg. 'learner:maxent*', 'decoder:mst', "
+                     "'settings:AD.L_joint*', or a glob on the whole "
+                     "evaluation key); may be repeated")
+    psr.add_argument("--exclude", metavar='PATTERN', type=check_pattern,
+                     action='append', default=[],
+                     help="skip evaluations matching this pattern "
+                     "(same syntax as --include); may be repeated")
+    psr.add_argument("--profile", metavar='PATTERN', action='append',
+                     help="profile (cProfile, tracemalloc) tasks whose "
+                     "phase (learn, decode, reassembly, score, report, "
+                     "discr, graph, provenance) matches this pattern, or "
+                     "whose 'phase:key' does (eg. 'decode:maxent-*'); "
+                     "may be repeated")
+    psr.add_argument("--mmap-models", action='store_true',
+                     help="also save models in a memory-mappable form "
+                     "(loads instantly, and shared between the workers "
+                     "on a machine)")
+    psr.add_argument("--precision", choices=PRECISIONS,
+                     help="storage precision for the feature matrix: "
+                     "single is float32 values and int32 indices "
+                     "(default: that of the evaluation we are "
+                     "resuming, or double)")
+    psr.add_argument("--sample", metavar='N', type=int,
+                     nargs='?', const=SAMPLE_SIZE,
+                     help="evaluate on a stratified sample of N documents "
+                     "(default {}) over {} folds, and estimate the "
+                     "full-corpus runtime".format(SAMPLE_SIZE,
+                                                  SAMPLE_FOLDS))
 
     cluster_grp = psr.add_mutually_exclusive_group()
     cluster_grp.add_argument("--start", action='store_true',
@@ -278,6 +512,50 @@ def args_to_stage(args):
         return None
 
 
+def _get_selection(args, lconf):
+    """
+    The evaluation selection for this run: the patterns given on
+    the command line (saved if we are starting a new evaluation),
+    or else any saved with the evaluation we are resuming
+    """
+    if args.include or args.exclude:
+        selection = Selection(include=args.include,
+                              exclude=args.exclude)
+        if not args.resume and lconf.stage in [None, ClusterStage.start]:
+            save_selection(selection_path(lconf), selection)
+        return selection
+    else:
+        return load_selection(selection_path(lconf))
+
+
+def _get_sample(args, lconf):
+    """
+    The document sample for this run: whatever was asked for on the
+    command line, or else that of the evaluation we are resuming
+    """
+    if args.sample is not None:
+        return SampleConfig(size=args.sample,
+                            seed=SAMPLE_SEED,
+                            folds=SAMPLE_FOLDS)
+    saved = load_sample(sample_path(lconf))
+    if saved is None:
+        return None
+    return SampleConfig(size=saved['size'],
+                        seed=saved['seed'],
+                        folds=saved['folds'])
+
+
+def _get_precision(args, lconf):
+    """
+    The storage precision for this run: whatever was asked for on
+    the command line, or else that of the evaluation we are resuming
+    (double if neither)
+    """
+    if args.precision is not None:
+        return args.precision
+    return saved_precision(lconf) or 'double'
+
+
 def main(args):
     """
     Subcommand main.
@@ -302,5 +580,16 @@ def main(args):
                        stage=stage,
                        fold_file=fold_file,
                        n_jobs=args.n_jobs,
-                       dataset=dataset)
+                       dataset=dataset,
+                       evaluations=None,
+                       sample=None,
+                       profile=args.profile,
+                       mmap_models=args.mmap_models,
+                       precision=None)
+    evaluations = select_evaluations(_get_selection(args, lconf))
+    if not evaluations:
+        sys.exit("No evaluations match the --include/--exclude patterns")
+    lconf = lconf._replace(evaluations=evaluations,
+                           sample=_get_sample(args, lconf),
+                           precision=_get_precision(args, lconf))
     _do_corpus(lconf)
@@ -7,10 +7,18 @@ gather features
 
 from __future__ import print_function
 import os
+import sys
+import time
 
 from attelo.harness.util import call, force_symlink
 
-from ..local import (TRAINING_CORPUS, PTB_DIR, FEATURE_SET)
+from ..local import (TRAINING_CORPUS, PTB_DIR, FEATURE_SET,
+                     SAMPLE_SEED, SAMPLE_SIZE)
+from ..sample import (corpus_profiles,
+                      link_corpus,
+                      save_sample,
+                      show_duration,
+                      stratified_sample)
 from ..util import\
     current_tmp, latest_tmp
 
@@ -25,9 +33,41 @@ def config_argparser(parser):
     are to be added.
     """
     parser.set_defaults(func=main)
+    parser.add_argument("--sample", metavar='N', type=int,
+                        nargs='?', const=SAMPLE_SIZE,
+                        help="only extract features for a stratified "
+                        "sample of N documents (default {})"
+                        "".format(SAMPLE_SIZE))
 
 
-def main(_):
+def _mk_sample_corpus(tdir, size):
+    """
+    Create a sample of the training corpus (as symlinks) and return
+    its path along with a description of the sample
+
+    The sample corpus has the same basename as the real one, as
+    this is how corpora are identified
+    """
+    profiles = corpus_profiles(TRAINING_CORPUS)
+    docs = stratified_sample(profiles, size, SAMPLE_SEED)
+    sample_dir = os.path.join(tdir, 'sample',
+                              os.path.basename(TRAINING_CORPUS))
+    link_corpus(TRAINING_CORPUS, docs, sample_dir)
+    sizes = {p.doc: p.size for p in profiles}
+    blob = {'size': size,
+            'seed': SAMPLE_SEED,
+            'docs': docs,
+            'documents': len(profiles),
+            'edus': sum(sizes.values()),
+            'sample_edus': sum(sizes[d] for d in docs)}
+    print('Sample: {} of {} documents ({} of {} EDUs)'
+          ''.format(len(docs), len(profiles),
+                    blob['sample_edus'], blob['edus']),
+          file=sys.stderr)
+    return sample_dir, blob
+
+
+def main(args):
     """
     Subcommand main.
 
@@ -35,8 +75,24 @@ def main(_):
     `config_argparser`
     """
     tdir = current_tmp()
-    call(["rst-dt-learning", "extract", TRAINING_CORPUS, PTB_DIR, tdir,
+    corpus_dir = TRAINING_CORPUS
+    sample = None
+    if args.sample is not None:
+        corpus_dir, sample = _mk_sample_corpus(tdir, args.sample)
+    start = time.time()
+    call(["rst-dt-learning", "extract", corpus_dir, PTB_DIR, tdir,
           '--feature_set', FEATURE_SET])
+    if sample is not None:
+        # extraction cost is roughly linear in the number of EDUs
+        elapsed = time.time() - start
+        scale = float(sample['edus']) / (sample['sample_edus'] or 1)
+        sample['extract'] = elapsed
+        sample['estimate'] = elapsed * scale
+        save_sample(os.path.join(tdir, 'sample-gather.json'), sample)
+        print('Extracted the sample in {}; the full corpus would take '
+              'about {}'.format(show_duration(elapsed),
+                                show_duration(elapsed * scale)),
+              file=sys.stderr)
     with open(os.path.join(tdir, "versions-gather.txt"), "w") as stream:
         call(["pip", "freeze"], stdout=stream)
     latest_dir = latest_tmp()
@@ -0,0 +1,152 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+learning curves over nested fractions of the training data
+"""
+
+from __future__ import print_function
+from os import path as fp
+import json
+import sys
+
+from attelo.io import (load_fold_dict)
+from attelo.harness.util import (makedirs)
+
+from ..curve import (DEFAULT_FRACTIONS,
+                     delayed_curves,
+                     load_rows,
+                     show_curve)
+from ..data import (load_pack)
+from ..local import (TRAINING_CORPUS)
+from ..loop import (LoopConfig,
+                    DataConfig,
+                    STAGE_NEEDS)
+from ..path import (report_dir_basename,
+                    report_dir_path,
+                    sample_path,
+                    selection_path)
+from ..precision import (saved_precision)
+from ..sample import (load_sample,
+                      sample_pack)
+from ..selection import (Selection,
+                         check_pattern,
+                         learners,
+                         load_selection,
+                         select_evaluations)
+from ..util import (exit_ungathered,
+                    latest_tmp,
+                    parallel,
+                    sanity_check_config)
+
+NAME = 'learning-curve'
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.set_defaults(func=main)
+    psr.add_argument("--fractions", metavar='F', type=float, nargs='+',
+                     default=DEFAULT_FRACTIONS,
+                     help="fractions of the training documents to learn "
+                     "from (default: %(default)s)")
+    psr.add_argument("--folds", metavar='N', type=int, nargs='+',
+                     help="only these folds (default: all)")
+    psr.add_argument("--include", metavar='PATTERN', type=check_pattern,
+                     action='append', default=[],
+                     help="only evaluations matching this pattern "
+                     "(see `evaluate --include`)")
+    psr.add_argument("--exclude", metavar='PATTERN', type=check_pattern,
+                     action='append', default=[],
+                     help="skip evaluations matching this pattern")
+    psr.add_argument("--n-jobs", type=int,
+                     default=-1,
+                     help="number of jobs (-1 for max [DEFAULT], "
+                     "2+ for parallel, "
+                     "1 for sequential but using parallel infrastructure, "
+                     "0 for fully sequential)")
+
+
+def _write_curve(lconf, rows):
+    """
+    Save the learning curve in the scratch report dir (so that it
+    survives the global report being regenerated) and in the
+    evaluation report dir
+    """
+    for report_dir in [report_dir_path(lconf, None),
+                       fp.join(lconf.eval_dir, report_dir_basename(lconf))]:
+        makedirs(report_dir)
+        with open(fp.join(report_dir, 'learning-curve.txt'), 'w') as stream:
+            print(show_curve(rows), file=stream)
+        with open(fp.join(report_dir, 'learning-curve.json'), 'w') as stream:
+            json.dump(rows, stream, indent=2)
+    print('Learning curve saved in',
+          fp.join(lconf.eval_dir, report_dir_basename(lconf)),
+          file=sys.stderr)
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    sanity_check_config()
+    if any(f <= 0 or f > 1 for f in args.fractions):
+        sys.exit("Fractions should be in (0, 1]")
+    data_dir = latest_tmp()
+    if not fp.exists(data_dir):
+        exit_ungathered()
+    eval_dir = fp.join(data_dir, "eval-current")
+    scratch_dir = fp.join(data_dir, "scratch-current")
+    if not fp.exists(eval_dir) or not fp.exists(scratch_dir):
+        sys.exit("No current evaluation to work with "
+                 "(try `irit-rst-dt evaluate --start`)")
+
+    dataset = fp.basename(TRAINING_CORPUS)
+    lconf = LoopConfig(eval_dir=eval_dir,
+                       scratch_dir=scratch_dir,
+                       folds=args.folds,
+                       stage=None,
+                       fold_file=fp.join(eval_dir,
+                                         "folds-%s.json" % dataset),
+                       n_jobs=args.n_jobs,
+                       dataset=dataset,
+                       evaluations=None,
+                       sample=None,
+                       profile=None,
+                       mmap_models=False,
+                       precision=None)
+    lconf = lconf._replace(precision=saved_precision(lconf) or 'double')
+    if args.include or args.exclude:
+        selection = Selection(include=args.include, exclude=args.exclude)
+    else:
+        selection = load_selection(selection_path(lconf))
+    evaluations = select_evaluations(selection)
+    if not evaluations:
+        sys.exit("No evaluations match the --include/--exclude patterns")
+    lconf = lconf._replace(evaluations=evaluations)
+
+    dpack = load_pack(lconf, STAGE_NEEDS[None])
+    sample = load_sample(sample_path(lconf))
+    if sample is not None:
+        dpack = sample_pack(dpack, sample['docs'])
+    dconf = DataConfig(pack=dpack,
+                       folds=load_fold_dict(lconf.fold_file))
+
+    folds = sorted(lconf.folds if lconf.folds is not None
+                   else frozenset(dconf.folds.values()))
+    rconfs = learners(evaluations)
+    print('Learning curve: {} learners, {} evaluations, {} folds, '
+          'fractions {}'.format(len(rconfs), len(evaluations), len(folds),
+                                ', '.join(str(f) for f in
+                                          sorted(args.fractions))),
+          file=sys.stderr)
+    jobs = delayed_curves(lconf, dconf, rconfs, folds, args.fractions)
+    parallel(lconf)(jobs)
+    _write_curve(lconf, load_rows(lconf, rconfs, folds))
@@ -0,0 +1,124 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+parse new documents with the combined models
+"""
+
+from __future__ import print_function
+import codecs
+import multiprocessing
+import sys
+import time
+
+from ..parse import (add_config_args,
+                     current_lconf,
+                     decode_payload,
+                     iter_chunks,
+                     load_models,
+                     payload_paths,
+                     payload_prefix,
+                     pick_evaluation)
+
+NAME = 'parse'
+
+_WORKER = {}
+"Per-process state for parse workers (the models and config)"
+
+
+def _init_worker(args):
+    "load the models once for each worker process"
+    econf = pick_evaluation(args)
+    lconf = current_lconf()
+    _WORKER['econf'] = econf
+    _WORKER['precision'] = lconf.precision
+    _WORKER['models'] = load_models(lconf, econf)
+
+
+def _parse_chunk(chunk_no, payload):
+    """
+    Decode a chunk of documents (in a worker)
+
+    :rtype: (int, [(string, string, string)])
+    """
+    return chunk_no, decode_payload(payload, _WORKER['models'],
+                                    _WORKER['econf'],
+                                    _WORKER['precision'])
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.set_defaults(func=main)
+    psr.add_argument("input", metavar='DIR',
+                     help="directory with the extracted features for "
+                     "the documents (.edu_input, .pairings, "
+                     ".relations.sparse)")
+    psr.add_argument("output", metavar='FILE',
+                     help="where to write the predicted edges")
+    add_config_args(psr)
+    psr.add_argument("--chunk-size", type=int, default=20,
+                     help="documents per decoding job "
+                     "(default: %(default)s)")
+    psr.add_argument("--n-jobs", type=int, default=-1,
+                     help="number of worker processes (-1 for max "
+                     "[DEFAULT])")
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    econf = pick_evaluation(args)
+    paths = payload_paths(payload_prefix(args.input))
+    n_workers = args.n_jobs if args.n_jobs > 0\
+        else multiprocessing.cpu_count()
+    # enough chunks in flight to keep the workers busy, but no more
+    max_pending = 2 * n_workers
+    print('Parsing {} with {} ({} workers)'.format(args.input, econf.key,
+                                                   n_workers),
+          file=sys.stderr)
+    pool = multiprocessing.Pool(processes=n_workers,
+                                initializer=_init_worker,
+                                initargs=(args,))
+    start = time.time()
+    n_docs = 0
+    pending = []
+
+    def _write_oldest(ostream):
+        "wait for the oldest chunk and write it out"
+        size, result = pending.pop(0)
+        _, edges = result.get()
+        for edge in edges:
+            ostream.write(u'\t'.join(edge) + u'\n')
+        ostream.flush()
+        return size
+
+    try:
+        with codecs.open(args.output, 'w', 'utf-8') as ostream:
+            for chunk_no, (size, payload) in\
+                    enumerate(iter_chunks(paths, args.chunk_size)):
+                pending.append((size,
+                                pool.apply_async(_parse_chunk,
+                                                 (chunk_no, payload))))
+                while len(pending) >= max_pending:
+                    n_docs += _write_oldest(ostream)
+                    print('{} documents parsed ({:.1f}/s)'
+                          ''.format(n_docs, n_docs / (time.time() - start)),
+                          file=sys.stderr)
+            while pending:
+                n_docs += _write_oldest(ostream)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    print('Parsed {} documents in {:.1f}s; output in {}'
+          ''.format(n_docs, time.time() - start, args.output),
+          file=sys.stderr)
@@ -0,0 +1,360 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+parse server keeping the combined models loaded
+"""
+
+from __future__ import print_function
+from collections import deque
+import json
+import os
+import sys
+import threading
+import time
+
+from six.moves import (BaseHTTPServer, queue, socketserver)
+
+from ..parse import (Payload,
+                     add_config_args,
+                     concat_payloads,
+                     current_lconf,
+                     decode_payload,
+                     edu_ids,
+                     load_models,
+                     pick_evaluation)
+
+NAME = 'serve'
+
+_LATENCY_WINDOW = 1000
+"How many recent requests we compute latency percentiles over"
+
+_ALIVE_SECS = 1
+"How often a waiting request checks that the batcher is still there"
+
+# pylint: disable=too-few-public-methods
+
+
+class _Counters(object):
+    """
+    Latency and throughput counters (shared between threads)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.edus = 0
+        self.decode_secs = 0.
+        self.latencies = deque(maxlen=_LATENCY_WINDOW)
+
+    def batch(self, n_edus, secs):
+        "record a decoded batch"
+        with self._lock:
+            self.batches += 1
+            self.edus += n_edus
+            self.decode_secs += secs
+
+    def request(self, secs, ok=True):
+        "record a finished request"
+        with self._lock:
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+            self.latencies.append(secs)
+
+    def as_dict(self):
+        "snapshot of the counters"
+        with self._lock:
+            uptime = time.time() - self.started
+            lats = sorted(self.latencies)
+
+            def _pct(pct):
+                "latency percentile"
+                return lats[min(len(lats) - 1,
+                                int(pct * len(lats)))] if lats else None
+
+            return {'uptime': uptime,
+                    'requests': self.requests,
+                    'errors': self.errors,
+                    'batches': self.batches,
+                    'edus': self.edus,
+                    'mean_batch_size': (float(self.requests) / self.batches
+                                        if self.batches else None),
+                    'decode_secs': self.decode_secs,
+                    'requests_per_sec': self.requests / uptime,
+                    'edus_per_sec': self.edus / uptime,
+                    'latency_mean': sum(lats) / len(lats) if lats else None,
+                    'latency_p50': _pct(0.5),
+                    'latency_p95': _pct(0.95),
+                    'latency_p99': _pct(0.99)}
+
+
+class _Pending(object):
+    "a request waiting for the batcher"
+    def __init__(self, payload):
+        self.payload = payload
+        self.ids = frozenset(edu_ids(payload))
+        self.done = threading.Event()
+        self.edges = None
+        self.error = None
+
+
+class _Batcher(threading.Thread):
+    """
+    Gathers concurrent requests into batches which are decoded
+    together (one scoring call per batch)
+
+    If decoding raises something that is not an `Exception` (eg. a
+    `SystemExit` from deep within a learner), the batcher fails all
+    of the requests it has, stops, and calls `on_stop` (eg. to shut
+    the server down)
+    """
+    def __init__(self, models, econf, counters, max_batch, max_wait,
+                 precision='double'):
+        super(_Batcher, self).__init__()
+        self.on_stop = None
+        self.stopped = None
+        self.daemon = True
+        self._models = models
+        self._econf = econf
+        self._precision = precision
+        self._counters = counters
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._queue = queue.Queue()
+        self._carry = []
+
+    def submit(self, payload):
+        "queue a payload, and wait for it to be decoded"
+        pending = _Pending(payload)
+        self._queue.put(pending)
+        while not pending.done.wait(_ALIVE_SECS):
+            if not self.is_alive():
+                raise RuntimeError('The parse server is stopping')
+        if isinstance(pending.error, Exception):
+            raise pending.error
+        elif pending.error is not None:
+            raise RuntimeError('Decoding stopped the parse server: '
+                               '{!r}'.format(pending.error))
+        return pending.edges
+
+    def _next_batch(self):
+        """
+        Requests for the next batch: whatever comes in within the
+        wait window (up to the batch size); requests that reuse an
+        EDU id already in the batch are kept for the next one
+        """
+        batch = [self._carry.pop(0) if self._carry else self._queue.get()]
+        ids = set(batch[0].ids)
+        deadline = time.time() + self._max_wait
+        carry = []
+        while len(batch) < self._max_batch:
+            if self._carry:
+                pending = self._carry.pop(0)
+            else:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if ids & pending.ids:
+                carry.append(pending)
+            else:
+                batch.append(pending)
+                ids |= pending.ids
+        self._carry = carry + self._carry
+        return batch
+
+    def _decode(self, batch):
+        "decode a batch and hand each request its edges"
+        start = time.time()
+        try:
+            edges = decode_payload(concat_payloads([p.payload for p in batch]),
+                                   self._models, self._econf,
+                                   self._precision)
+            owner = {}
+            for pending in batch:
+                pending.edges = []
+                for edu in pending.ids:
+                    owner[edu] = pending
+            for edge in edges:
+                if edge[1] in owner:
+                    owner[edge[1]].edges.append(edge)
+        except Exception as oops:  # pylint: disable=broad-except
+            for pending in batch:
+                pending.error = oops
+        except BaseException as oops:
+            for pending in batch:
+                pending.error = oops
+            raise
+        finally:
+            self._counters.batch(sum(len(p.ids) for p in batch),
+                                 time.time() - start)
+            for pending in batch:
+                pending.done.set()
+
+    def _fail_waiting(self, oops):
+        "fail any requests still waiting to be decoded"
+        waiting = self._carry
+        self._carry = []
+        while True:
+            try:
+                waiting.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for pending in waiting:
+            pending.error = oops
+            pending.done.set()
+
+    def run(self):
+        try:
+            while True:
+                self._decode(self._next_batch())
+        except BaseException as oops:  # pylint: disable=broad-except
+            self.stopped = oops
+            print('Decoding failed, stopping the server: {!r}'.format(oops),
+                  file=sys.stderr)
+            self._fail_waiting(oops)
+            if self.on_stop is not None:
+                self.on_stop()
+
+
+def _read_payload(blob):
+    "payload from a request body (JSON with a text field for each part)"
+    try:
+        parts = [blob[k] for k in Payload._fields]
+    except KeyError as oops:
+        raise ValueError('Missing payload field: {}'.format(oops))
+    return Payload(*[p.splitlines() for p in parts])
+
+
+def _mk_handler(batcher, counters):
+    "request handler class bound to our batcher and counters"
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        "POST /parse, GET /stats"
+
+        def _reply(self, code, blob):
+            "send a JSON response"
+            body = json.dumps(blob).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            "counters"
+            if self.path == '/stats':
+                self._reply(200, counters.as_dict())
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            "parse a payload"
+            if self.path != '/parse':
+                self._reply(404, {'error': 'not found'})
+                return
+            start = time.time()
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                blob = json.loads(self.rfile.read(length).decode('utf-8'))
+                edges = batcher.submit(_read_payload(blob))
+            except ValueError as oops:
+                counters.request(time.time() - start, ok=False)
+                self._reply(400, {'error': str(oops)})
+                return
+            except Exception as oops:  # pylint: disable=broad-except
+                counters.request(time.time() - start, ok=False)
+                self._reply(500, {'error': str(oops)})
+                return
+            latency = time.time() - start
+            counters.request(latency)
+            self._reply(200, {'edges': [list(e) for e in edges],
+                              'latency': latency})
+
+        def address_string(self):
+            # unix socket clients have no address
+            return self.client_address[0] if self.client_address\
+                else 'local'
+
+        def log_message(self, fmt, *args):
+            print(fmt % args, file=sys.stderr)
+
+    return Handler
+
+
+class _TcpServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    "threaded HTTP server on a TCP port"
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    "threaded HTTP server on a unix socket"
+    daemon_threads = True
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.set_defaults(func=main)
+    add_config_args(psr)
+    psr.add_argument("--port", type=int, default=8765,
+                     help="local port to listen on (default: %(default)s)")
+    psr.add_argument("--socket", metavar='PATH',
+                     help="listen on this unix socket instead of a port")
+    psr.add_argument("--max-batch", type=int, default=16,
+                     help="most requests to decode at once "
+                     "(default: %(default)s)")
+    psr.add_argument("--max-wait", type=float, default=10,
+                     help="how long to wait (ms) for more requests to "
+                     "batch with the first one (default: %(default)s)")
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    lconf = current_lconf()
+    econf = pick_evaluation(args)
+    print('Loading combined models for', econf.key, file=sys.stderr)
+    models = load_models(lconf, econf)
+    counters = _Counters()
+    batcher = _Batcher(models, econf, counters,
+                       max_batch=args.max_batch,
+                       max_wait=args.max_wait / 1000.,
+                       precision=lconf.precision)
+    handler = _mk_handler(batcher, counters)
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = _UnixServer(args.socket, handler)
+        where = args.socket
+    else:
+        server = _TcpServer(('127.0.0.1', args.port), handler)
+        where = 'http://127.0.0.1:{}'.format(args.port)
+    batcher.on_stop = server.shutdown
+    batcher.start()
+    print('Serving {} on {} (POST /parse, GET /stats)'
+          ''.format(econf.key, where), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    if batcher.stopped is not None:
+        sys.exit('Parse server stopped: {!r}'.format(batcher.stopped))
@@ -0,0 +1,332 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Learning curves
+
+For each fold, we train each learner on nested, growing fractions
+of the training documents (a seeded shuffle of the documents, of
+which each fraction takes a prefix), and decode the same test
+documents with each model.
+
+A learner is carried through all of the fractions of a fold in a
+single job, so that it can be warm-started from the model for the
+previous fraction if it supports it (sklearn estimators with a
+`warm_start` parameter). We work on private copies of the learners
+so that warm-starting one configuration does not leak into another.
+A learner which did not fit anything for a fraction (because we
+already had the model, eg. when resuming) is replaced by a fresh
+copy, so the next fraction does not warm-start from an older one.
+
+The sub-packs for each fraction are selected from a per-fold index
+of instances by document, which we build only once.
+
+Decoding runs under the usual task limits (see
+`irit_rst_dt.supervise`); if we give up on decoding a fraction, its
+row says it is missing rather than giving scores.
+"""
+
+from __future__ import print_function
+from collections import (defaultdict)
+from os import path as fp
+import copy
+import json
+import os
+import random
+import sys
+import time
+
+from attelo.learning import (Task)
+from attelo.table import (for_intra)
+from attelo.util import (Team)
+import attelo.harness.learn as ath_learn
+from joblib import (delayed)
+
+from .decode import (delayed_decode, post_decode)
+from .loop import (DataConfig)
+from .path import (attelo_doc_model_paths,
+                   attelo_sent_model_paths,
+                   decode_output_path,
+                   fold_dir_basename)
+from .score import (doc_counts,
+                    gold_columns,
+                    load_columns)
+from .selection import (needs_intra)
+from .stats import (Counts,
+                    attach_scores,
+                    label_scores,
+                    merge_counts)
+from .supervise import (load_missing)
+
+DEFAULT_FRACTIONS = [0.1, 0.25, 0.5, 0.75, 1.0]
+"Fractions of the training data to learn from"
+
+DEFAULT_SEED = 20150601
+"Seed for the order in which training documents are added"
+
+
+def curve_dir(lconf):
+    "Where we keep the learning curve models and predictions"
+    return fp.join(lconf.scratch_dir, 'curve')
+
+
+def _fraction_lconf(lconf, fraction):
+    """
+    Loop configuration for a single fraction (the same as the
+    original, but with its own scratch space)
+    """
+    return lconf._replace(
+        scratch_dir=fp.join(curve_dir(lconf),
+                            'frac-{:.3f}'.format(fraction)))
+
+
+def _rows_path(lconf, rconf, fold):
+    "Learning curve results for a learner in a fold"
+    return fp.join(curve_dir(lconf), 'rows',
+                   '{}.{}.json'.format(fold_dir_basename(fold),
+                                       rconf.key))
+
+
+def doc_index(dpack):
+    """
+    Instance indices for each document in a data pack
+
+    :rtype: dict(string, [int])
+    """
+    res = defaultdict(list)
+    for i, (_, edu2) in enumerate(dpack.pairings):
+        res[edu2.grouping].append(i)
+    return res
+
+
+def nested_docs(dconf, fold, fractions, seed):
+    """
+    Training documents for each fraction; the documents of each
+    fraction include those of the ones before
+
+    :rtype: [(float, [string])]
+    """
+    docs = sorted(d for d, f in dconf.folds.items() if f != fold)
+    random.Random(seed + fold).shuffle(docs)
+    return [(f, docs[:max(1, int(round(f * len(docs))))])
+            for f in sorted(fractions)]
+
+
+def _fraction_dconf(dconf, index, fold, docs):
+    """
+    Data config restricted to the given training documents (and
+    all of the test documents for the fold)
+    """
+    test_docs = [d for d, f in dconf.folds.items() if f == fold]
+    idxes = sorted(i for d in list(docs) + test_docs
+                   for i in index.get(d, []))
+    return DataConfig(pack=dconf.pack.selected(idxes),
+                      folds=dconf.folds)
+
+
+def _warm_start(learner):
+    """
+    Ask a learner to start from its current model the next time
+    it is fit (if it knows how to); return True if it does
+    """
+    try:
+        params = learner.get_params()
+    except AttributeError:
+        return False
+    if 'warm_start' not in params:
+        return False
+    learner.set_params(warm_start=True)
+    return True
+
+
+def _private_learners(rconf):
+    """
+    Fresh copies of the attach/relate learners for a learner
+    config (separate copies even if the config uses the same
+    learner for both, since a warm-started learner has state)
+    """
+    relate = rconf.relate or rconf.attach
+    return Team(attach=copy.deepcopy(rconf.attach.payload),
+                relate=copy.deepcopy(relate.payload))
+
+
+def _learn(rconf, subpack, paths, learners):
+    """
+    Learn the attach and relate models for a fraction (unless we
+    already have them)
+
+    :rtype: Team(bool) (True for each model we learned)
+    """
+    done = {}
+    for task, key, path in [(Task.attach, rconf.attach.key, paths.attach),
+                            (Task.relate, (rconf.relate or rconf.attach).key,
+                             paths.relate)]:
+        done[task.name] = False
+        if key == 'oracle' or fp.exists(path):
+            continue
+        ath_learn.learn(subpack, learners, task, path, quiet=True)
+        done[task.name] = True
+    return Team(**done)
+
+
+def _next_learners(rconf, learners, learned):
+    """
+    The learners for the next fraction: those which just fitted a
+    model warm-start from it (if they know how to), and the others
+    are replaced by fresh copies (any state they have is from an
+    earlier fraction); also return True if any of them warm-starts
+
+    :rtype: (Team(learner), bool)
+    """
+    fresh = _private_learners(rconf)
+    res = Team(attach=learners.attach if learned.attach else fresh.attach,
+               relate=learners.relate if learned.relate else fresh.relate)
+    warm = [_warm_start(x) for x, fitted in zip(res, learned) if fitted]
+    return res, any(warm)
+
+
+def _run(jobs):
+    "run delayed jobs in this process"
+    # pylint: disable=star-args
+    for func, args, kwargs in jobs:
+        func(*args, **kwargs)
+    # pylint: enable=star-args
+
+
+def _learner_curve(lconf, dconf, rconf, fold, fractions, seed):
+    """
+    Learn and decode for every fraction of the training data
+    for a single learner in a fold, saving a row per fraction
+    and evaluation
+    """
+    rows_path = _rows_path(lconf, rconf, fold)
+    if fp.exists(rows_path):
+        return
+    evaluations = [e for e in lconf.evaluations
+                   if e.learner.key == rconf.key]
+    intra = needs_intra(evaluations)
+    index = doc_index(dconf.pack)
+    gold = gold_columns(dconf.pack.testing(dconf.folds, fold))
+    doc_learners = _private_learners(rconf)
+    sent_learners = _private_learners(rconf)
+    warm = False
+    rows = []
+    for fraction, docs in nested_docs(dconf, fold, fractions, seed):
+        flconf = _fraction_lconf(lconf, fraction)
+        fdconf = _fraction_dconf(dconf, index, fold, docs)
+        subpack = fdconf.pack.training(fdconf.folds, fold)
+        start = time.time()
+        doc_learned = _learn(rconf, subpack,
+                             attelo_doc_model_paths(flconf, rconf, fold),
+                             doc_learners)
+        sent_learned = Team(attach=False, relate=False)
+        if intra:
+            sent_learned = _learn(rconf, for_intra(subpack),
+                                  attelo_sent_model_paths(flconf, rconf,
+                                                          fold),
+                                  sent_learners)
+        learn_secs = time.time() - start
+        for econf in evaluations:
+            start = time.time()
+            _run(delayed_decode(flconf, fdconf, econf, fold))
+            post_decode(flconf, fdconf, econf, fold)
+            decode_secs = time.time() - start
+            output_path = decode_output_path(flconf, econf, fold)
+            missing = load_missing(output_path)
+            if missing is None:
+                pred = load_columns(gold, output_path)
+                counts = list(merge_counts([doc_counts(gold, pred)]))
+            else:
+                counts = None
+            rows.append({'fold': fold,
+                         'fraction': fraction,
+                         'docs': len(docs),
+                         'instances': len(subpack),
+                         'config': econf.key,
+                         'learner': rconf.key,
+                         'learn': learn_secs,
+                         'decode': decode_secs,
+                         'warm': warm,
+                         'counts': counts,
+                         'missing': None if missing is None
+                                    else missing['reason']})
+        # only warm-start from models we actually fitted here
+        doc_learners, doc_warm = _next_learners(rconf, doc_learners,
+                                                doc_learned)
+        sent_learners, sent_warm = _next_learners(rconf, sent_learners,
+                                                  sent_learned)
+        warm = doc_warm or sent_warm
+        print('learning curve: fold {} {} {:.0%} ({} docs) in {:.1f}s'
+              ''.format(fold, rconf.key, fraction, len(docs), learn_secs),
+              file=sys.stderr)
+    if not fp.exists(fp.dirname(rows_path)):
+        os.makedirs(fp.dirname(rows_path))
+    with open(rows_path + '.tmp', 'w') as stream:
+        json.dump(rows, stream, indent=2)
+    os.rename(rows_path + '.tmp', rows_path)
+
+
+def delayed_curves(lconf, dconf, rconfs, folds, fractions,
+                   seed=DEFAULT_SEED):
+    """
+    Return futures for learning curves for each learner in each
+    fold (one job carries a learner through all fractions)
+    """
+    return [delayed(_learner_curve)(lconf, dconf, rconf, fold,
+                                    fractions, seed)
+            for fold in folds for rconf in rconfs
+            if not fp.exists(_rows_path(lconf, rconf, fold))]
+
+
+def load_rows(lconf, rconfs, folds):
+    """
+    All of the learning curve rows we have saved so far
+    """
+    rows = []
+    for fold in folds:
+        for rconf in rconfs:
+            rows_path = _rows_path(lconf, rconf, fold)
+            if fp.exists(rows_path):
+                with open(rows_path) as stream:
+                    rows.extend(json.load(stream))
+    return rows
+
+
+def show_curve(rows):
+    """
+    Tab-separated learning curve (merging counts across folds;
+    timings are averaged per fold); points we gave up on in any
+    fold have their scores listed as missing
+    """
+    groups = defaultdict(list)
+    for row in rows:
+        groups[(row['config'], row['fraction'])].append(row)
+    header = ['config', 'fraction', 'docs', 'instances',
+              'attach-F', 'label-F',
+              'learn-secs', 'decode-secs', 'warm-start', 'folds']
+    lines = ['\t'.join(header)]
+    for (config, fraction), group in sorted(groups.items()):
+        n_folds = len(group)
+        if any(r.get('counts') is None for r in group):
+            scores = ['missing', 'missing']
+        else:
+            counts = sum((Counts(*r['counts']) for r in group),
+                         Counts.zero())
+            scores = ['{:.4f}'.format(attach_scores(counts).fscore),
+                      '{:.4f}'.format(label_scores(counts).fscore)]
+        fields = [config,
+                  '{:.3f}'.format(fraction),
+                  '{:.0f}'.format(sum(r['docs'] for r in group) /
+                                  float(n_folds)),
+                  '{:.0f}'.format(sum(r['instances'] for r in group) /
+                                  float(n_folds))]
+        fields.extend(scores)
+        fields.extend(['{:.2f}'.format(sum(r['learn'] for r in group) /
+                                       n_folds),
+                       '{:.2f}'.format(sum(r['decode'] for r in group) /
+                                       n_folds),
+                       'yes' if all(r['warm'] for r in group) else 'no',
+                       str(n_folds)])
+        lines.append('\t'.join(fields))
+    return '\n'.join(lines)
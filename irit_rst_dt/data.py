@@ -0,0 +1,149 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Loading data packs
+
+Loading the feature matrix is by far the most expensive part of
+reading a data pack, but several stages (eg. the end-of-evaluation
+report) only look at its gold structure. For these we read a
+stripped copy of the features file (targets only), and only load
+the real features if something actually asks for them.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import codecs
+import os
+import sys
+
+from attelo.io import (load_data_pack)
+
+from .loop import (PackNeeds)
+from .path import (edu_input_path,
+                   features_path,
+                   pairings_path)
+from .precision import (compact_pack)
+
+# pylint: disable=too-few-public-methods
+
+_FEATURE_ATTRS = frozenset(['data', 'vocab', '_replace', '_asdict'])
+"""
+Pack attributes we cannot answer from the stripped pack
+(anything that gives access to the feature matrix)
+"""
+
+
+def strip_features(path, stripped_path):
+    """
+    Write a copy of a sparse features file with only the targets
+    (this is the same thing the cluster gather script does): the
+    labels header, a single feature on the first instance (so that
+    the matrix is not empty), and just the target for the rest
+    """
+    tmp_path = stripped_path + '.tmp'
+    with codecs.open(path, 'r', 'utf-8') as istream:
+        with codecs.open(tmp_path, 'w', 'utf-8') as ostream:
+            for lnum, line in enumerate(istream):
+                if lnum == 0:
+                    ostream.write(line)
+                elif lnum == 1:
+                    ostream.write(' '.join(line.split()[:2]) + '\n')
+                else:
+                    ostream.write(line.split(' ', 1)[0].rstrip() + '\n')
+    os.rename(tmp_path, stripped_path)
+
+
+class LazyPack(object):
+    """
+    Stand-in for a data pack which was loaded without features
+
+    Anything to do with the gold structure is answered from the
+    stripped pack; the first access to the features (directly or
+    through a sub-pack) loads the full pack. Sub-packs are lazy
+    in the same way.
+    """
+    def __init__(self, stripped, load_full):
+        self._stripped = stripped
+        self._load_full = load_full
+        self._full = None
+
+    def force(self):
+        """
+        The full data pack (loading it if we haven't already)
+        """
+        if self._full is None:
+            self._full = self._load_full()
+            self._stripped = None
+        return self._full
+
+    def _sub(self, method, *args):
+        "lazy version of a sub-pack"
+        if self._full is not None:
+            return getattr(self._full, method)(*args)
+        stripped = getattr(self._stripped, method)(*args)
+        return LazyPack(stripped,
+                        lambda: getattr(self.force(), method)(*args))
+
+    def testing(self, *args):
+        "See `DataPack.testing`"
+        return self._sub('testing', *args)
+
+    def training(self, *args):
+        "See `DataPack.training`"
+        return self._sub('training', *args)
+
+    def selected(self, *args):
+        "See `DataPack.selected`"
+        return self._sub('selected', *args)
+
+    def __len__(self):
+        return len(self._full if self._full is not None
+                   else self._stripped)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if self._full is not None or name in _FEATURE_ATTRS:
+            return getattr(self.force(), name)
+        return getattr(self._stripped, name)
+
+
+def force_pack(dpack):
+    """
+    The actual data pack behind a possibly lazy one (for passing
+    on to code that needs the real thing)
+    """
+    return dpack.force() if isinstance(dpack, LazyPack) else dpack
+
+
+def load_pack(lconf, needs):
+    """
+    Load the data pack, with features only if the stage needs them
+    (otherwise they will be loaded on first access), in the storage
+    precision we asked for (see `irit_rst_dt.precision`)
+
+    :type needs: frozenset(PackNeeds)
+    """
+    def _load(fpath):
+        "load the pack using the given features file"
+        return load_data_pack(edu_input_path(lconf),
+                              pairings_path(lconf),
+                              fpath,
+                              verbose=True)
+
+    if PackNeeds.features in needs:
+        return compact_pack(lconf, _load(features_path(lconf)))
+
+    stripped_path = features_path(lconf, stripped=True)
+    if not fp.exists(stripped_path):
+        print('Stripping features file...', file=sys.stderr)
+        strip_features(features_path(lconf), stripped_path)
+
+    def _load_full():
+        "load the real pack when we first need it"
+        print('Loading features (first use)...', file=sys.stderr)
+        return compact_pack(lconf, _load(features_path(lconf)))
+
+    return LazyPack(_load(stripped_path), _load_full)
@@ -10,15 +10,24 @@ from __future__ import print_function
 from os import path as fp
 import sys
 
-from attelo.io import (load_model)
 from attelo.decoding.intra import (IntraInterPair)
 from attelo.harness.util import (makedirs)
 from attelo.util import (Team)
 import attelo.harness.decode as ath_decode
+import six
 
+from .mapped import (load_any)
+from .oracle import (is_oracle, join_oracle, oracle_jobs)
 from .path import (attelo_doc_model_paths,
                    attelo_sent_model_paths,
-                   decode_output_path)
+                   decode_output_path,
+                   decode_store_path)
+from .store import (convert_output,
+                    has_store)
+from .supervise import (clear_missing,
+                        is_missing,
+                        mark_missing)
+from .telemetry import (task, task_info, traced)
 
 
 def _eval_banner(econf, lconf, fold):
@@ -51,6 +60,30 @@ def _say_if_decoded(lconf, econf, fold, stage='decoding'):
         return False
 
 
+def _lacks_models(lconf, econf, fold):
+    """
+    True if we gave up on learning any of the models this
+    model/decoder combo needs in the given fold
+    """
+    teams = [attelo_doc_model_paths(lconf, econf.learner, fold)]
+    if econf.settings.intra is not None:
+        teams.append(attelo_sent_model_paths(lconf, econf.learner, fold))
+    return any(is_missing(p) for team in teams for p in team)
+
+
+def _job_output(job, output_path):
+    """
+    The file a per-group decoding job writes: the one path among its
+    arguments (other than the final output) that sits next to the
+    final output, or None if we can't tell
+    """
+    _, args, kwargs = job
+    paths = [a for a in list(args) + list(kwargs.values())
+             if isinstance(a, six.string_types) and a != output_path and
+             fp.dirname(a) == fp.dirname(output_path)]
+    return paths[0] if len(paths) == 1 else None
+
+
 def delayed_decode(lconf, dconf, econf, fold):
     """
     Return possible futures for decoding groups within
@@ -61,8 +94,33 @@ def delayed_decode(lconf, dconf, econf, fold):
 
     output_path = decode_output_path(lconf, econf, fold)
     makedirs(fp.dirname(output_path))
+    clear_missing(output_path)
+    if _lacks_models(lconf, econf, fold):
+        print(("skipping decoding {learner} {decoder} "
+               "(missing models)").format(learner=econf.learner.key,
+                                          decoder=econf.decoder.key),
+              file=sys.stderr)
+        mark_missing(output_path, 'model')
+        return []
 
     subpack = dconf.pack.testing(dconf.folds, fold)
+    if is_oracle(econf):
+        # gold structure where we know it, decoding for the rest
+        # (see `oracle`)
+        jobs = oracle_jobs(subpack, econf, output_path)
+        return [traced(lconf,
+                       task_info('decode',
+                                 '{}-{}'.format(econf.key,
+                                                'oracle' if i == 0
+                                                else i - 1),
+                                 fold=fold,
+                                 learner=econf.learner.key,
+                                 decoder=econf.decoder.key),
+                       job,
+                       output=output_path,
+                       written=_job_output(job, output_path))
+                for i, job in enumerate(jobs)]
+
     doc_model_paths = attelo_doc_model_paths(lconf, econf.learner, fold)
     intra_flag = econf.settings.intra
     if intra_flag is not None:
@@ -71,30 +129,65 @@ def delayed_decode(lconf, dconf, econf, fold):
 
         intra_model = Team('oracle', 'oracle')\
             if intra_flag.intra_oracle\
-            else sent_model_paths.fmap(load_model)
+            else sent_model_paths.fmap(load_any)
         inter_model = Team('oracle', 'oracle')\
             if intra_flag.inter_oracle\
-            else doc_model_paths.fmap(load_model)
+            else doc_model_paths.fmap(load_any)
 
         models = IntraInterPair(intra=intra_model,
                                 inter=inter_model)
     else:
-        models = doc_model_paths.fmap(load_model)
+        models = doc_model_paths.fmap(load_any)
 
-    return ath_decode.jobs(subpack, models,
+    jobs = ath_decode.jobs(subpack, models,
                            econf.decoder.payload,
                            econf.settings.mode,
                            output_path)
+    return [traced(lconf,
+                   task_info('decode', '{}-{}'.format(econf.key, i),
+                             fold=fold,
+                             learner=econf.learner.key,
+                             decoder=econf.decoder.key),
+                   job,
+                   output=output_path,
+                   written=_job_output(job, output_path))
+            for i, job in enumerate(jobs)]
+
+
+def _mk_store(lconf, subpack, econf, fold):
+    """
+    Convert the output for this model/decoder combo into a
+    document-indexed prediction store (if we don't already have one)
+    """
+    spath = decode_store_path(lconf, econf, fold)
+    if has_store(spath):
+        return
+    doc_of = {e.id: e.grouping for e in subpack.edus}
+    convert_output(decode_output_path(lconf, econf, fold), spath, doc_of)
 
 
 def post_decode(lconf, dconf, econf, fold):
     """
     Join together output files from this model/decoder combo
+    (unless we gave up on some of them)
     """
-    if _say_if_decoded(lconf, econf, fold, stage='reassembly'):
+    if is_missing(decode_output_path(lconf, econf, fold)):
+        print(("skipping reassembly {learner} {decoder} "
+               "(missing)").format(learner=econf.learner.key,
+                                   decoder=econf.decoder.key),
+              file=sys.stderr)
         return
-
-    print(_eval_banner(econf, lconf, fold), file=sys.stderr)
-    subpack = dconf.pack.testing(dconf.folds, fold)
-    ath_decode.concatenate_outputs(subpack,
-                                   decode_output_path(lconf, econf, fold))
+    info = task_info('reassembly', econf.key,
+                     fold=fold,
+                     learner=econf.learner.key,
+                     decoder=econf.decoder.key)
+    with task(lconf, info):
+        subpack = dconf.pack.testing(dconf.folds, fold)
+        if not _say_if_decoded(lconf, econf, fold, stage='reassembly'):
+            print(_eval_banner(econf, lconf, fold), file=sys.stderr)
+            output_path = decode_output_path(lconf, econf, fold)
+            if is_oracle(econf):
+                join_oracle(subpack, econf, output_path)
+            else:
+                ath_decode.concatenate_outputs(subpack, output_path)
+        _mk_store(lconf, subpack, econf, fold)
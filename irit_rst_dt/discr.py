@@ -0,0 +1,223 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Discriminating feature summaries for models
+
+Summaries are computed in parallel (one job per learner and
+grain), and cached by a fingerprint of the model and vocabulary
+files they were computed from (via the evaluation's digest
+manifest), so that rerunning a report does not need to reload and
+rerank any models that have not changed. The jobs get the path to
+the vocabulary rather than the vocabulary itself, and each worker
+loads it once.
+
+The summaries themselves are attelo's
+(`attelo.score.discriminating_features`), but we do not let it sort
+every coefficient of the models. We first pick out, by partial
+sorting, the features that could make the top n of any row (from
+either end, ties included), and hand attelo models and a vocabulary
+narrowed down to those: it then ranks exactly the same features in
+the same order, over a handful of columns.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import codecs
+import copy
+import hashlib
+import os
+import sys
+
+from attelo.harness.util import (makedirs)
+from attelo.io import (load_vocab)
+from joblib import (delayed)
+import attelo.report
+import attelo.score
+import numpy as np
+
+from .local import (PROVENANCE_DIGEST)
+from .mapped import (load_any)
+from .path import (attelo_doc_model_paths,
+                   attelo_sent_model_paths,
+                   manifest_path,
+                   model_info_path,
+                   vocab_path)
+from .provenance import (Manifest)
+
+TOP_N = 3
+"Number of features to show for each label"
+
+_VOCABS = {}
+"Vocabulary loaded in this process, by (path, mtime)"
+
+
+def _cache_dir(lconf):
+    "Where we keep cached summaries"
+    return fp.join(lconf.scratch_dir, 'cache', 'discr')
+
+
+def _fingerprint(digests, paths, top_n):
+    """
+    A key that changes whenever the contents of any of the model
+    or vocabulary files (or the number of features we want) does
+
+    :param digests: digest of each path
+    """
+    hasher = hashlib.sha1()
+    for path in paths:
+        hasher.update(digests[path].encode('utf-8'))
+    hasher.update(str(top_n).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def _load_vocab(path):
+    """
+    The vocabulary at a path, loaded at most once per (worker)
+    process for all of the summaries it computes
+    """
+    key = (path, os.stat(path).st_mtime)
+    if key not in _VOCABS:
+        _VOCABS.clear()
+        _VOCABS[key] = load_vocab(path)
+    return _VOCABS[key]
+
+
+def _coef_owner(model):
+    """
+    The object holding the coefficients of a (possibly wrapped)
+    linear model, or None if it doesn't look like it has any
+    """
+    for obj in [model, getattr(model, '_learner', None)]:
+        if getattr(obj, 'coef_', None) is not None:
+            return obj
+    return None
+
+
+def _dense_rows(coef):
+    "coefficients as a dense 2D array (one row per class)"
+    if hasattr(coef, 'toarray'):
+        coef = coef.toarray()
+    return np.atleast_2d(np.asarray(coef))
+
+
+def _top_columns(coef, top_n):
+    """
+    Columns which could make the `top_n` of some row of the
+    coefficients, ranking from either end (ties at the cut-off
+    included), found with a partial sort of each row
+    """
+    rows = _dense_rows(coef)
+    n_cols = rows.shape[1]
+    if 2 * top_n >= n_cols:
+        return np.arange(n_cols)
+    keep = np.zeros(n_cols, dtype=bool)
+    for row in rows:
+        high = row[np.argpartition(row, n_cols - top_n)[n_cols - top_n]]
+        low = row[np.argpartition(row, top_n - 1)[top_n - 1]]
+        keep |= (row >= high) | (row <= low)
+    return np.flatnonzero(keep)
+
+
+def _narrowed(model, columns):
+    "copy of a model whose coefficients only cover some columns"
+    owner = _coef_owner(model)
+    coef = owner.coef_
+    narrow = copy.copy(owner)
+    narrow.coef_ = coef[columns] if np.ndim(coef) == 1\
+        else coef[:, columns]
+    if owner is model:
+        return narrow
+    res = copy.copy(model)
+    res._learner = narrow  # pylint: disable=protected-access
+    return res
+
+
+def _narrow(models, vocab, top_n):
+    """
+    The models and vocabulary narrowed down to the features that
+    could make it into a summary of the top `top_n` (the models
+    and vocabulary as they are if we can't see the coefficients)
+    """
+    if _coef_owner(models.attach) is None or\
+            _coef_owner(models.relate) is None:
+        return models, vocab
+    columns = np.union1d(_top_columns(_coef_owner(models.attach).coef_,
+                                      top_n),
+                         _top_columns(_coef_owner(models.relate).coef_,
+                                      top_n))
+    return (models.fmap(lambda m: _narrowed(m, columns)),
+            [vocab[i] for i in columns])
+
+
+def _summarise(desc, model_paths, labels, vocab_path, top_n,
+               cache_path, output_path):
+    """
+    Write a discriminating features summary for a pair of models,
+    computing it if there is no cached copy
+    """
+    if not fp.exists(cache_path):
+        models, vocab = _narrow(model_paths.fmap(load_any),
+                                _load_vocab(vocab_path), top_n)
+        discr = attelo.score.discriminating_features(models, labels,
+                                                     vocab, top_n)
+        if discr is None:
+            print('No discriminating features for {}'.format(desc),
+                  file=sys.stderr)
+            return False
+        makedirs(fp.dirname(cache_path))
+        with codecs.open(cache_path + '.tmp', 'wb', 'utf-8') as fout:
+            print(attelo.report.show_discriminating_features(discr),
+                  file=fout)
+        os.rename(cache_path + '.tmp', cache_path)
+    makedirs(fp.dirname(output_path))
+    with codecs.open(cache_path, 'rb', 'utf-8') as fin:
+        with codecs.open(output_path, 'wb', 'utf-8') as fout:
+            fout.write(fin.read())
+    return True
+
+
+def delayed_model_summaries(lconf, rconfs, fold, labels, top_n=TOP_N):
+    """
+    Return futures for writing the discriminating features summary
+    for each learner (doc and sentence grain)
+
+    :param labels: datapack labels
+    """
+    todo = []
+    for rconf in rconfs:
+        for intra in [False, True]:
+            paths_fn = attelo_sent_model_paths if intra\
+                else attelo_doc_model_paths
+            paths = paths_fn(lconf, rconf, fold)
+            if not (fp.exists(paths.attach) and fp.exists(paths.relate)):
+                if not intra:
+                    print(('No discriminating features for {name} doc model'
+                           '').format(name=rconf.key),
+                          file=sys.stderr)
+                continue
+            todo.append((rconf, intra, paths))
+
+    # hash everything in one go (in parallel), leaving the digests
+    # in the manifest for the provenance hashes
+    vpath = vocab_path(lconf)
+    manifest = Manifest(manifest_path(lconf), PROVENANCE_DIGEST)
+    digests = manifest.update([vpath] +
+                              [p for _, _, ps in todo
+                               for p in [ps.attach, ps.relate]],
+                              n_jobs=lconf.n_jobs)
+    manifest.save()
+
+    jobs = []
+    for rconf, intra, paths in todo:
+        key = _fingerprint(digests, [paths.attach, paths.relate, vpath],
+                           top_n)
+        cache_path = fp.join(_cache_dir(lconf), key + '.txt')
+        output_path = model_info_path(lconf, rconf, fold, intra)
+        desc = '{name} {grain} model'.format(name=rconf.key,
+                                             grain='sent' if intra
+                                             else 'doc')
+        jobs.append(delayed(_summarise)(desc, paths, labels, vpath, top_n,
+                                        cache_path, output_path))
+    return jobs
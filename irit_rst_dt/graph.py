@@ -1,24 +1,46 @@
 '''
 graphing output from the harness
+
+Graphs are rendered one document at a time, and each rendered
+document is recorded in a small cache index (per output directory)
+under a hash of everything that goes into drawing it (EDUs, gold
+and predicted edges, settings). Rerunning a report thus only redraws
+the graphs that would actually change. The remaining renders go
+through a bounded pool of long-lived worker processes (sized like
+joblib would for `--n-jobs`), or are drawn in-process if we are
+running sequentially (`--n-jobs 0`).
 '''
 
 from __future__ import print_function
+from collections import (defaultdict, namedtuple)
 from enum import Enum
 from os import path as fp
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
 
 from attelo.graph import (diff_all, graph_all,
                           GraphSettings)
 from attelo.io import (Torpor, load_predictions)
-from joblib import (Parallel, delayed)
 
-from .local import (GRAPH_DOCS,
-                    DETAILED_EVALUATIONS)
+from .local import (GRAPH_DOCS)
 from .path import (decode_output_path,
+                   decode_store_path,
                    fold_dir_basename,
                    report_dir_path)
+from .selection import (detailed)
+from .store import (has_store, load_docs)
+from .supervise import (is_missing)
+from .util import (n_workers)
 
 # pylint: disable=too-few-public-methods
 
+_CACHE_INDEX = '.graph-cache.json'
+"Basename of the cache index in each graph output directory"
+
 
 class GraphDiffMode(Enum):
     "what sort of graph output to make"
@@ -27,6 +49,17 @@ class GraphDiffMode(Enum):
     diff_intra = 3
 
 
+RenderUnit = namedtuple('RenderUnit',
+                        ['diffmode',
+                         'doc',
+                         'edus',
+                         'gold',
+                         'predictions',
+                         'settings',
+                         'output_dir'])
+"a single document graph to draw (gold is ignored in solo mode)"
+
+
 def to_predictions(dpack):
     """
     Convert a datapack to a list of predictions
@@ -36,9 +69,103 @@ def to_predictions(dpack):
                                      dpack.target)]
 
 
+def _by_doc(edus, predictions):
+    """
+    Split predictions by the document of their target EDU
+
+    :rtype: dict(string, [(string, string, string)])
+    """
+    doc_of = {e.id: e.grouping for e in edus}
+    res = defaultdict(list)
+    for pred in predictions:
+        res[doc_of.get(pred[1])].append(pred)
+    return res
+
+
+def _unit_key(unit):
+    "hash of everything that goes into drawing a document graph"
+    blob = repr((unit.diffmode.name,
+                 [tuple(e) for e in unit.edus],
+                 sorted(unit.gold) if unit.gold is not None else None,
+                 sorted(unit.predictions),
+                 tuple(unit.settings)))
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+
+def _load_index(output_dir):
+    "read the cache index for an output directory"
+    ipath = fp.join(output_dir, _CACHE_INDEX)
+    if fp.exists(ipath):
+        with open(ipath) as stream:
+            return json.load(stream)
+    return {}
+
+
+def _save_index(output_dir, index):
+    "write the cache index for an output directory"
+    if not fp.exists(output_dir):
+        os.makedirs(output_dir)
+    ipath = fp.join(output_dir, _CACHE_INDEX)
+    with open(ipath + '.tmp', 'w') as stream:
+        json.dump(index, stream, indent=0, sort_keys=True)
+    os.rename(ipath + '.tmp', ipath)
+
+
+def _is_rendered(unit, key, index):
+    "true if we have drawn this exact graph before"
+    return (index.get(unit.doc) == key and
+            bool(glob.glob(fp.join(unit.output_dir, unit.doc + '*'))))
+
+
+def _render(unit):
+    """
+    Draw a single document graph (run in a renderer worker)
+
+    :rtype: (RenderUnit, bool)
+    """
+    try:
+        if unit.diffmode == GraphDiffMode.solo:
+            graph_all(unit.edus, unit.predictions, unit.settings,
+                      unit.output_dir)
+        else:
+            diff_all(unit.edus, unit.gold, unit.predictions, unit.settings,
+                     unit.output_dir)
+        return unit, True
+    except Exception as oops:  # pylint: disable=broad-except
+        print('Could not draw {doc} in {odir}: {err}'
+              ''.format(doc=unit.doc, odir=unit.output_dir, err=oops),
+              file=sys.stderr)
+        return unit, False
+
+
+def _mk_units(diffmode, edus, gold, predictions, settings, output_dir):
+    "Return render units for every selected document"
+    edus_by_doc = defaultdict(list)
+    for edu in edus:
+        edus_by_doc[edu.grouping].append(edu)
+    docs = sorted(edus_by_doc) if settings.select is None\
+        else [d for d in settings.select if d in edus_by_doc]
+    gold_by_doc = _by_doc(edus, gold) if gold is not None else None
+    pred_by_doc = _by_doc(edus, predictions)
+    for doc in docs:
+        yield RenderUnit(diffmode=diffmode,
+                         doc=doc,
+                         edus=edus_by_doc[doc],
+                         gold=gold_by_doc.get(doc, [])
+                         if gold_by_doc is not None else None,
+                         predictions=pred_by_doc.get(doc, []),
+                         settings=settings._replace(select=[doc]),
+                         output_dir=output_dir)
+
+
 def _mk_econf_graphs(lconf, edus, gold, econf, fold):
-    "Return jobs generating graphs for a single configuration"
-    predictions = load_predictions(decode_output_path(lconf, econf, fold))
+    "Return render units for a single configuration"
+    spath = decode_store_path(lconf, econf, fold)
+    if has_store(spath) and GRAPH_DOCS is not None:
+        predictions = load_docs(spath, GRAPH_DOCS)
+    else:
+        predictions = load_predictions(decode_output_path(lconf, econf,
+                                                          fold))
     for diffmode in GraphDiffMode:
         # output path
         if diffmode == GraphDiffMode.solo:
@@ -62,21 +189,15 @@ def _mk_econf_graphs(lconf, edus, gold, econf, fold):
                           timeout=15,
                           quiet=False)
 
-        if diffmode == GraphDiffMode.solo:
-            yield delayed(graph_all)(edus,
-                                     predictions,
-                                     settings,
-                                     output_dir)
-        else:
-            yield delayed(diff_all)(edus,
-                                    gold,
-                                    predictions,
-                                    settings,
-                                    output_dir)
+        for unit in _mk_units(diffmode, edus,
+                              None if diffmode == GraphDiffMode.solo
+                              else gold,
+                              predictions, settings, output_dir):
+            yield unit
 
 
 def _mk_gold_graphs(lconf, dconf):
-    "Generate graphs for a single configuration"
+    "Return render units for the gold data"
     # output path
     output_dir = fp.join(report_dir_path(lconf, None),
                          'graphs-gold')
@@ -89,20 +210,74 @@ def _mk_gold_graphs(lconf, dconf):
                       quiet=True)
 
     predictions = to_predictions(dconf.pack)
-    graph_all(dconf.pack.edus, predictions, settings, output_dir)
+    return _mk_units(GraphDiffMode.solo, dconf.pack.edus, None,
+                     predictions, settings, output_dir)
+
+
+def _render_all(lconf, units):
+    """
+    Draw any graphs which are not already in the cache, through
+    a bounded pool of renderer processes (or in this process if
+    we are running sequentially)
+    """
+    indices = {}
+    todo = []
+    n_cached = 0
+    for unit in units:
+        if unit.output_dir not in indices:
+            indices[unit.output_dir] = _load_index(unit.output_dir)
+        key = _unit_key(unit)
+        if _is_rendered(unit, key, indices[unit.output_dir]):
+            n_cached += 1
+        else:
+            todo.append((key, unit))
+    print('Graphs: {} unchanged, {} to draw'.format(n_cached, len(todo)),
+          file=sys.stderr)
+    if not todo:
+        return
+
+    keys = {(u.output_dir, u.doc, u.diffmode): k for k, u in todo}
+
+    def _rendered(unit, ok):
+        "note a drawn graph in the cache index (or forget a failed one)"
+        index = indices[unit.output_dir]
+        if ok:
+            index[unit.doc] = keys[(unit.output_dir, unit.doc,
+                                    unit.diffmode)]
+        else:
+            index.pop(unit.doc, None)
+        _save_index(unit.output_dir, index)
+
+    n_procs = n_workers(lconf.n_jobs)
+    if n_procs == 0:
+        for _, unit in todo:
+            _rendered(*_render(unit))
+        return
+    pool = multiprocessing.Pool(processes=min(n_procs, len(todo)))
+    try:
+        for unit, ok in pool.imap_unordered(_render, [u for _, u in todo]):
+            _rendered(unit, ok)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 def mk_graphs(lconf, dconf):
-    "Generate graphs for the gold data and for one of the folds"
-    with Torpor('creating gold graphs'):
-        _mk_gold_graphs(lconf, dconf)
+    """
+    Generate graphs for the gold data and for one of the folds
+    (skipping any evaluations we gave up on in that fold)
+    """
     fold = sorted(set(dconf.folds.values()))[0]
 
-    with Torpor('creating graphs for fold {}'.format(fold),
+    with Torpor('creating graphs for gold and fold {}'.format(fold),
                 sameline=False):
+        units = list(_mk_gold_graphs(lconf, dconf))
         pack = dconf.pack.testing(dconf.folds, fold)
         gold = to_predictions(pack)
-        jobs = []
-        for econf in DETAILED_EVALUATIONS:
-            jobs.extend(_mk_econf_graphs(lconf, pack.edus, gold, econf, fold))
-        Parallel(n_jobs=-1)(jobs)
+        for econf in detailed(lconf.evaluations):
+            if is_missing(decode_output_path(lconf, econf, fold)):
+                continue
+            units.extend(_mk_econf_graphs(lconf, pack.edus, gold,
+                                          econf, fold))
+        _render_all(lconf, units)
@@ -17,15 +17,28 @@ from attelo.util import (Team)
 import attelo.harness.learn as ath_learn
 from joblib import (delayed)
 
+from .attelo_cfg import (LazyList)
 from .local import (EVALUATIONS)
+from .mapped import (has_mapped, map_model)
 from .path import (attelo_doc_model_paths,
                    attelo_sent_model_paths,
                    combined_dir_path,
                    fold_dir_path)
+from .selection import (learners, needs_intra)
+from .supervise import (clear_missing)
+from .telemetry import (task_info, traced)
 from .util import (concat_i, parallel)
 
 
-LEARNERS = {e.learner.key: e.learner for e in EVALUATIONS}.values()
+LEARNERS = LazyList(lambda: {e.learner.key: e.learner
+                             for e in EVALUATIONS}.values())
+"learners used in any of our evaluations (built on first use)"
+
+
+def _learn_and_map(subpack, learners, task, output_path, quiet):
+    "learn a model, then save a memory-mappable copy of it"
+    ath_learn.learn(subpack, learners, task, output_path, quiet=quiet)
+    map_model(output_path)
 
 
 def _get_learn_job(lconf, rconf, subpack, paths, task):
@@ -48,8 +61,11 @@ def _get_learn_job(lconf, rconf, subpack, paths, task):
                           task=task.name,
                           path=fp.relpath(output_path, lconf.scratch_dir)),
               file=sys.stderr)
+        if lconf.mmap_models and not has_mapped(output_path):
+            return delayed(map_model)(output_path)
     else:
-        learn_fn = ath_learn.learn
+        clear_missing(output_path)
+        learn_fn = _learn_and_map if lconf.mmap_models else ath_learn.learn
         learners = Team(attach=rconf.attach,
                         relate=rconf.relate or rconf.attach)
         learners = learners.fmap(lambda x: x.payload)
@@ -57,6 +73,23 @@ def _get_learn_job(lconf, rconf, subpack, paths, task):
                                  quiet=False)
 
 
+def _traced_learn_job(lconf, rconf, fold, grain, subpack, paths, task):
+    """
+    learning job (see `_get_learn_job`) which records its telemetry
+    (and whose model is marked as missing if we have to give up on
+    learning it)
+    """
+    info = task_info('learn',
+                     '{}-{}-{}'.format(rconf.key, grain, task.name),
+                     fold=fold, learner=rconf.key)
+    output_path = paths.attach if task == Task.attach else paths.relate
+    if fp.exists(output_path):
+        output_path = None  # not ours to delete
+    return traced(lconf, info,
+                  _get_learn_job(lconf, rconf, subpack, paths, task),
+                  output=output_path)
+
+
 def delayed_learn(lconf, dconf, rconf, fold, include_intra):
     """
     Return possible futures for learning models for this
@@ -76,22 +109,24 @@ def delayed_learn(lconf, dconf, rconf, fold, include_intra):
     if True:
         subpack = get_subpack(dconf.pack)
         paths = attelo_doc_model_paths(lconf, rconf, fold)
-        jobs.append(_get_learn_job(lconf, rconf, subpack, paths, Task.attach))
-        jobs.append(_get_learn_job(lconf, rconf, subpack, paths, Task.relate))
+        for task in [Task.attach, Task.relate]:
+            jobs.append(_traced_learn_job(lconf, rconf, fold, 'doc',
+                                          subpack, paths, task))
     if include_intra:
         subpack = for_intra(get_subpack(dconf.pack))
         paths = attelo_sent_model_paths(lconf, rconf, fold)
-        jobs.append(_get_learn_job(lconf, rconf, subpack, paths, Task.attach))
-        jobs.append(_get_learn_job(lconf, rconf, subpack, paths, Task.relate))
+        for task in [Task.attach, Task.relate]:
+            jobs.append(_traced_learn_job(lconf, rconf, fold, 'sent',
+                                          subpack, paths, task))
     return [j for j in jobs if j is not None]
 
 
 def mk_combined_models(lconf, dconf):
     """
-    Create global for all learners
+    Create global for all learners in the selected evaluations
     """
-    include_intra = any(e.settings.intra is not None
-                        for e in EVALUATIONS)
-    jobs = concat_i(delayed_learn(lconf, dconf, learner, None, include_intra)
-                    for learner in LEARNERS)
+    evaluations = lconf.evaluations
+    jobs = concat_i(delayed_learn(lconf, dconf, learner, None,
+                                  needs_intra(evaluations, learner))
+                    for learner in learners(evaluations))
     parallel(lconf)(jobs)
@@ -11,27 +11,8 @@ In the future we may move this to a proper configuration file.
 from __future__ import print_function
 import itertools as itr
 
-from attelo.harness.config import (EvaluationConfig,
-                                   LearnerConfig,
-                                   Keyed)
-
-from attelo.decoding import (DecodingMode)
-from attelo.decoding.baseline import (LocalBaseline)
-from attelo.decoding.mst import (MstDecoder, MstRootStrategy)
-from attelo.decoding.intra import (IntraInterDecoder, IntraStrategy)
-from attelo.learning import (can_predict_proba)
-from sklearn.linear_model import (LogisticRegression,
-                                  Perceptron as SkPerceptron,
-                                  PassiveAggressiveClassifier as
-                                  SkPassiveAggressiveClassifier)
-from attelo.learning.perceptron import (PerceptronArgs,
-                                        Perceptron,
-                                        PassiveAggressive,
-                                        StructuredPerceptron,
-                                        StructuredPassiveAggressive)
-from numpy import inf
-
 from .attelo_cfg import (combined_key,
+                         LazyList,
                          Settings,
                          KeyedDecoder,
                          IntraFlag)
@@ -71,83 +52,172 @@ FEATURE_SET = 'li2014'  # one of ['dev', 'eyk', 'li2014']
 Which feature set to use for feature extraction
 """
 
+SAMPLE_SIZE = 20
+"""
+Default number of documents for `--sample` mode (quick runs on a
+representative subset of the corpus)
+"""
+
+SAMPLE_FOLDS = 3
+"""
+Number of cross-validation folds in `--sample` mode
+"""
+
+SAMPLE_SEED = 20150501
+"""
+Seed for drawing samples (a fixed seed makes sample runs
+comparable with each other)
+"""
+
+PROVENANCE_DIGEST = 'md5'  # any hashlib algorithm, or 'xxh64'
+"""
+Digest used to fingerprint features and models (for the report
+provenance hashes, and for caching things derived from models).
+'xxh64' is much faster but needs the xxhash package
+"""
+
+TASK_LIMITS = [
+    # ('decoder:*mst*', 2 * 3600, None),
+    # ('learner:*perc*', None, 16000),
+]
+"""
+Limits on learning and decoding tasks, as `(PATTERN, SECS, RSS_MB)`
+(None for no limit on wall-clock time or resident memory). Patterns
+are `FIELD:GLOB`, where the field is the `phase` (learn or decode),
+`learner`, `decoder` or task `key`; the first matching rule applies.
+Tasks with limits are run in a child process which is killed if it
+goes over them (see `irit_rst_dt.supervise`)
+"""
+
+TASK_RETRIES = 1
+"""
+How many times to retry a task that was killed for going over its
+limits before giving up on it (its evaluations are then reported as
+missing)
+"""
+
+
+# ---------------------------------------------------------------------
+# learners, decoders, settings
+# ---------------------------------------------------------------------
+#
+# sklearn and the attelo learners/decoders take a good while to
+# import, and most harness commands never need them. So everything
+# from here on is built on first use (see `LazyList`), and the
+# functions below import what they need themselves.
+
 
 def decoder_local(settings):
     "our instantiation of the local baseline decoder"
+    from attelo.decoding import (DecodingMode)
+    from attelo.decoding.baseline import (LocalBaseline)
     use_prob = settings.mode == DecodingMode.post_label
     return LocalBaseline(0.5, use_prob)
 
 
 def decoder_mst(settings):
     "our instantiation of the local baseline decoder"
+    from attelo.decoding import (DecodingMode)
+    from attelo.decoding.mst import (MstDecoder, MstRootStrategy)
     use_prob = settings.mode == DecodingMode.post_label
     return MstDecoder(MstRootStrategy.fake_root,
                       use_prob)
 
 
-LOCAL_PERC_ARGS = PerceptronArgs(iterations=10,
-                                 averaging=True,
-                                 use_prob=False,
-                                 aggressiveness=inf)
-
-LOCAL_PA_ARGS = PerceptronArgs(iterations=10,
-                                 averaging=True,
-                                 use_prob=False,
-                                 aggressiveness=inf)
-
-STRUCT_PERC_ARGS = PerceptronArgs(iterations=50,
-                                 averaging=True,
-                                 use_prob=False,
-                                 aggressiveness=inf)
-
-STRUCT_PA_ARGS = PerceptronArgs(iterations=50,
-                                 averaging=True,
-                                 use_prob=False,
-                                 aggressiveness=inf) 
-
-
-LEARNER_MAXENT = Keyed('maxent', LogisticRegression())
+def _perceptron_args(iterations):
+    "(averaged, non-probabilistic) perceptron arguments"
+    from attelo.learning.perceptron import (PerceptronArgs)
+    from numpy import inf
+    return PerceptronArgs(iterations=iterations,
+                          averaging=True,
+                          use_prob=False,
+                          aggressiveness=inf)
+
+
+def _mk_learner_maxent():
+    "see `_LEARNER_MAXENT`"
+    from attelo.harness.config import (Keyed)
+    from sklearn.linear_model import (LogisticRegression)
+    return [Keyed('maxent', LogisticRegression())]
+
+
+_LEARNER_MAXENT = LazyList(_mk_learner_maxent)
+"""Our maxent learner (a singleton list, so that it is shared by
+all the learner configs that use it)"""
+
+
+def _mk_local_learners():
+    "see `_LOCAL_LEARNERS`"
+    from attelo.harness.config import (LearnerConfig, Keyed)
+    from attelo.learning.perceptron import (Perceptron,
+                                            PassiveAggressive)
+    from sklearn.linear_model import (Perceptron as SkPerceptron,
+                                      PassiveAggressiveClassifier as
+                                      SkPassiveAggressiveClassifier)
+    learner_maxent = _LEARNER_MAXENT[0]
+    local_perc_args = _perceptron_args(10)
+    local_pa_args = _perceptron_args(10)
+    return [
+        LearnerConfig(attach=Keyed('oracle', 'oracle'),
+                      relate=None),
+        LearnerConfig(attach=learner_maxent,
+                      relate=None),
+        LearnerConfig(attach=Keyed('perc', Perceptron(local_perc_args)),
+                      relate=learner_maxent),
+        LearnerConfig(attach=Keyed('sk-perceptron', SkPerceptron()),
+                      relate=learner_maxent),
+        LearnerConfig(attach=Keyed('pa', PassiveAggressive(local_pa_args)),
+                      relate=learner_maxent),
+        LearnerConfig(attach=Keyed('sk-pasagg',
+                                   SkPassiveAggressiveClassifier()),
+                      relate=learner_maxent),
+    ]
 
-_LOCAL_LEARNERS = [
-    LearnerConfig(attach=Keyed('oracle', 'oracle'),
-                  relate=None),
-    LearnerConfig(attach=LEARNER_MAXENT,
-                  relate=None),
-    LearnerConfig(attach=Keyed('perc', Perceptron( LOCAL_PERC_ARGS )),
-                  relate=LEARNER_MAXENT),
-    LearnerConfig(attach=Keyed('sk-perceptron', SkPerceptron()),
-                  relate=LEARNER_MAXENT),
-    LearnerConfig(attach=Keyed('pa', PassiveAggressive( LOCAL_PA_ARGS )),
-                  relate=LEARNER_MAXENT),
-    LearnerConfig(attach=Keyed('sk-pasagg', SkPassiveAggressiveClassifier()),
-                  relate=LEARNER_MAXENT),
 
-]
+_LOCAL_LEARNERS = LazyList(_mk_local_learners)
 """Straightforward attelo learner algorithms to try
 
 It's up to you to choose values for the key field that can distinguish
 between different configurations of your learners.
 """
 
-_STRUCTURED_LEARNERS = [
-    lambda d: LearnerConfig(attach=Keyed('struct-perc',
-                                        StructuredPerceptron(d,STRUCT_PERC_ARGS)),
-                           relate=LEARNER_MAXENT),
-    lambda d: LearnerConfig(attach=Keyed('struct-pa',
-                                        StructuredPassiveAggressive(d,STRUCT_PA_ARGS)),
-                           relate=LEARNER_MAXENT)
-]
 
+def _mk_structured_learners():
+    "see `_STRUCTURED_LEARNERS`"
+    from attelo.harness.config import (LearnerConfig, Keyed)
+    from attelo.learning.perceptron import (StructuredPerceptron,
+                                            StructuredPassiveAggressive)
+    learner_maxent = _LEARNER_MAXENT[0]
+    struct_perc_args = _perceptron_args(50)
+    struct_pa_args = _perceptron_args(50)
+    return [
+        lambda d: LearnerConfig(attach=Keyed('struct-perc',
+                                             StructuredPerceptron(
+                                                 d, struct_perc_args)),
+                                relate=learner_maxent),
+        lambda d: LearnerConfig(attach=Keyed('struct-pa',
+                                             StructuredPassiveAggressive(
+                                                 d, struct_pa_args)),
+                                relate=learner_maxent)
+    ]
+
+
+_STRUCTURED_LEARNERS = LazyList(_mk_structured_learners)
 """Attelo learners that take decoders as arguments.
 We assume that they cannot be used relation modelling
 """
 
 
-_CORE_DECODERS = [
-    Keyed('local', decoder_local),
-    Keyed('mst', decoder_mst)
-]
+def _mk_core_decoders():
+    "see `_CORE_DECODERS`"
+    from attelo.harness.config import (Keyed)
+    return [
+        Keyed('local', decoder_local),
+        Keyed('mst', decoder_mst)
+    ]
+
 
+_CORE_DECODERS = LazyList(_mk_core_decoders)
 """Attelo decoders to try in experiment
 
 Don't forget that you can parameterise the decoders ::
@@ -156,29 +226,36 @@ Don't forget that you can parameterise the decoders ::
 """
 
 
-_SETTINGS = [
-    Settings(key='AD.L_joint_intra_soft',
-             mode=DecodingMode.joint,
-             intra=IntraFlag(strategy=IntraStrategy.soft,
-                             intra_oracle=False,
-                             inter_oracle=False)),
-    Settings(key='AD.L_joint_intra_heads',
-             mode=DecodingMode.joint,
-             intra=IntraFlag(strategy=IntraStrategy.heads,
-                             intra_oracle=False,
-                             inter_oracle=False)),
-    Settings(key='AD.L_joint_intra_only',
-             mode=DecodingMode.joint,
-             intra=IntraFlag(strategy=IntraStrategy.only,
-                             intra_oracle=False,
-                             inter_oracle=False)),
-    Settings(key='AD.L_joint',
-             mode=DecodingMode.joint,
-             intra=None),
-    Settings(key='AD.L_post',
-             mode=DecodingMode.post_label,
-             intra=None),
-    ]
+def _mk_settings():
+    "see `_SETTINGS`"
+    from attelo.decoding import (DecodingMode)
+    from attelo.decoding.intra import (IntraStrategy)
+    return [
+        Settings(key='AD.L_joint_intra_soft',
+                 mode=DecodingMode.joint,
+                 intra=IntraFlag(strategy=IntraStrategy.soft,
+                                 intra_oracle=False,
+                                 inter_oracle=False)),
+        Settings(key='AD.L_joint_intra_heads',
+                 mode=DecodingMode.joint,
+                 intra=IntraFlag(strategy=IntraStrategy.heads,
+                                 intra_oracle=False,
+                                 inter_oracle=False)),
+        Settings(key='AD.L_joint_intra_only',
+                 mode=DecodingMode.joint,
+                 intra=IntraFlag(strategy=IntraStrategy.only,
+                                 intra_oracle=False,
+                                 inter_oracle=False)),
+        Settings(key='AD.L_joint',
+                 mode=DecodingMode.joint,
+                 intra=None),
+        Settings(key='AD.L_post',
+                 mode=DecodingMode.post_label,
+                 intra=None),
+        ]
+
+
+_SETTINGS = LazyList(_mk_settings)
 """Variants on global settings that would generally apply
 over all decoder combos.
 
@@ -203,6 +280,10 @@ def _is_junk(klearner, kdecoder):
     Any configuration for which this function returns True
     will be silently discarded
     """
+    from attelo.decoding import (DecodingMode)
+    from attelo.decoding.intra import (IntraStrategy)
+    from attelo.learning import (can_predict_proba)
+
     # intrasential head to head mode only works with mst for now
     intra_flag = kdecoder.settings.intra
     if kdecoder.key != 'mst':
@@ -231,6 +312,7 @@ def _mk_keyed_decoder(kdecoder, settings):
 
     :rtype: KeyedDecoder
     """
+    from attelo.decoding.intra import (IntraInterDecoder)
     decoder_key = combined_key([settings, kdecoder])
     decoder = kdecoder.payload(settings)
     if settings.intra:
@@ -275,6 +357,7 @@ def _mk_evaluations():
 
     :rtype [(Keyed(learner), KeyedDecoder)]
     """
+    from attelo.harness.config import (EvaluationConfig)
 
     kdecoders = [_mk_keyed_decoder(d, s)
                  for d, s in itr.product(_CORE_DECODERS, _SETTINGS)]
@@ -295,7 +378,7 @@ def _mk_evaluations():
             if not _is_junk(klearner, kdecoder)]
 
 
-EVALUATIONS = _mk_evaluations()
+EVALUATIONS = LazyList(_mk_evaluations)
 """Learners and decoders that are associated with each other.
 The idea her is that if multiple decoders have a learner in
 common, we will avoid rebuilding the model associated with
@@ -313,11 +396,12 @@ GRAPH_DOCS = [
 Set to None to graph everything
 """
 
-DETAILED_EVALUATIONS = [e for e in EVALUATIONS if
-                        'maxent' in e.learner.key and
-                        ('mst' in e.decoder.key or 'astar' in e.decoder.key)
-                        and 'joint' in e.settings.key
-                        and 'orc' not in e.settings.key]
+DETAILED_EVALUATIONS = LazyList(lambda: [
+    e for e in EVALUATIONS if
+    'maxent' in e.learner.key and
+    ('mst' in e.decoder.key or 'astar' in e.decoder.key)
+    and 'joint' in e.settings.key
+    and 'orc' not in e.settings.key])
 """
 Any evalutions that we'd like full reports and graphs for.
 You could just set this to EVALUATIONS, but this sort of
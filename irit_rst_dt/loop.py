@@ -15,7 +15,12 @@ LoopConfig = namedtuple("LoopConfig",
                          "folds",
                          "fold_file",
                          "n_jobs",
-                         "dataset"])
+                         "dataset",
+                         "evaluations",
+                         "sample",
+                         "profile",
+                         "mmap_models",
+                         "precision"])
 "that which is common to outerish loops"
 
 
@@ -34,3 +39,27 @@ class ClusterStage(Enum):
     main = 2
     combined_models = 3
     end = 4
+
+
+class PackNeeds(Enum):
+    '''
+    What parts of the data pack a stage works with
+    '''
+    gold = 1
+    features = 2
+
+
+# pylint: disable=pointless-string-statement
+STAGE_NEEDS = {None: frozenset([PackNeeds.gold, PackNeeds.features]),
+               ClusterStage.start: frozenset([PackNeeds.gold]),
+               ClusterStage.main: frozenset([PackNeeds.gold,
+                                             PackNeeds.features]),
+               ClusterStage.combined_models: frozenset([PackNeeds.gold,
+                                                        PackNeeds.features]),
+               ClusterStage.end: frozenset([PackNeeds.gold])}
+"""
+What each stage needs from the data pack (None is standalone mode).
+Stages that only need the gold structure (EDUs, pairings, targets,
+labels) get a pack whose features are only loaded on first access
+"""
+# pylint: enable=pointless-string-statement
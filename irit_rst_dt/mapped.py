@@ -0,0 +1,134 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Memory-mappable models
+
+Alongside the ordinary pickled model that attelo writes, we can
+save a copy whose large numpy arrays (coefficients, intercepts,
+perceptron weights...) are stored as raw `.npy` files, with the
+rest of the model (its metadata) pickled separately. Loading it
+memory-maps the arrays rather than reading them, so it is almost
+instantaneous, and all processes using the same model on a machine
+share a single copy in the page cache. This includes joblib
+workers: joblib passes memory-mapped arrays by reference to their
+file rather than by value.
+
+The arrays are found generically (by hooking into pickling), so
+this works for any model attelo can pickle. The files live next to
+the model (`X.model.mmap.pickle`, `X.model.mmap-N.npy`); the
+metadata is written last, so a copy is complete if it exists and
+is no older than the model it was made from.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import glob
+import os
+import pickle
+
+from attelo.io import (load_model)
+import numpy as np
+
+# pylint: disable=too-few-public-methods
+
+MIN_MAPPED_BYTES = 1 << 16
+"Arrays smaller than this stay in the metadata pickle"
+
+_META_EXT = '.mmap.pickle'
+_ARRAY_EXT = '.mmap-{}.npy'
+
+
+def mapped_paths(path):
+    """
+    All of the files for the mapped copy of a model
+    """
+    return sorted(glob.glob(path + _ARRAY_EXT.format('*')) +
+                  glob.glob(path + _META_EXT))
+
+
+def has_mapped(path):
+    """
+    True if the model has an up-to-date mapped copy
+    """
+    meta_path = path + _META_EXT
+    return fp.exists(meta_path) and\
+        (not fp.exists(path) or
+         os.path.getmtime(meta_path) >= os.path.getmtime(path))
+
+
+def _mappable(obj):
+    "True if an object is an array we should store on its own"
+    return isinstance(obj, np.ndarray) and\
+        not obj.dtype.hasobject and\
+        obj.nbytes >= MIN_MAPPED_BYTES
+
+
+class _Pickler(pickle.Pickler, object):
+    "pickler which writes large arrays out to their own files"
+    def __init__(self, stream, path):
+        super(_Pickler, self).__init__(stream, pickle.HIGHEST_PROTOCOL)
+        self._path = path
+        self.n_arrays = 0
+
+    def persistent_id(self, obj):  # pylint: disable=method-hidden
+        "array number for arrays we store separately (else None)"
+        if not _mappable(obj):
+            return None
+        num = self.n_arrays
+        self.n_arrays += 1
+        np.save(self._path + _ARRAY_EXT.format(num),
+                np.ascontiguousarray(obj))
+        return str(num)
+
+
+class _Unpickler(pickle.Unpickler, object):
+    "unpickler which memory-maps the separately stored arrays"
+    def __init__(self, stream, path):
+        super(_Unpickler, self).__init__(stream)
+        self._path = path
+
+    def persistent_load(self, pid):  # pylint: disable=method-hidden
+        "memory-mapped array for an array number"
+        return np.load(self._path + _ARRAY_EXT.format(pid), mmap_mode='r')
+
+
+def save_mapped(model, path):
+    """
+    Save a mapped copy of a model which has been pickled to the
+    given path
+    """
+    for old_path in mapped_paths(path):
+        os.remove(old_path)
+    tmp_path = '{}{}.{}.tmp'.format(path, _META_EXT, os.getpid())
+    with open(tmp_path, 'wb') as stream:
+        _Pickler(stream, path).dump(model)
+    os.rename(tmp_path, path + _META_EXT)
+
+
+def map_model(path):
+    """
+    Make a mapped copy of a pickled model (if it does not already
+    have an up-to-date one)
+    """
+    if not has_mapped(path):
+        save_mapped(load_model(path), path)
+
+
+def load_mapped(path):
+    """
+    Load the mapped copy of a model
+    """
+    with open(path + _META_EXT, 'rb') as stream:
+        return _Unpickler(stream, path).load()
+
+
+def load_any(path):
+    """
+    Load a model, through its mapped copy if it has an up-to-date
+    one (see `map_model`), else from the pickle
+    """
+    if has_mapped(path):
+        return load_mapped(path)
+    return load_model(path)
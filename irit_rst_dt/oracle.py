@@ -0,0 +1,200 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Fast path for decoding with the oracle learner
+
+The oracle "model" gives gold attachments probability 1 (with their
+gold label), and everything else probability 0. For some decoders we
+know what that decodes to without running them:
+
+* the local baseline attaches everything above its threshold, so
+  it returns the gold structure
+* mst returns the maximum spanning tree, which is the gold structure
+  for any document whose gold attachments already form a tree
+  (rooted at the fake root)
+
+This holds in both joint and post-label mode, but not for the
+intra/inter-sentential settings, which decode sentences separately.
+For these documents we write the gold structure out directly, in
+the attelo output format, in a single job. The rest are decoded for
+real (without models to load), in the usual per-group jobs.
+"""
+
+from __future__ import print_function
+from collections import defaultdict
+import codecs
+import os
+import shutil
+
+from attelo.decoding.intra import (IntraInterPair)
+from attelo.table import (UNRELATED)
+from attelo.util import (Team)
+import attelo.harness.decode as ath_decode
+from joblib import (delayed)
+import numpy as np
+
+ROOT = 'ROOT'
+"Id of the fake root EDU in the pairings"
+
+_GOLD_DECODERS = ['local', 'mst']
+"Core decoders that return the gold structure for some oracle documents"
+
+
+def is_oracle(econf):
+    """
+    True if an evaluation uses the oracle for both attachment and
+    labelling
+    """
+    learner = econf.learner
+    return learner.attach.key == 'oracle' and\
+        (learner.relate is None or learner.relate.key == 'oracle')
+
+
+def _core_decoder(econf):
+    "key of the core decoder of an evaluation (eg. mst)"
+    return econf.decoder.key[len(econf.settings.key) + 1:]
+
+
+def _gold_labels(dpack):
+    "gold label name for each pairing (as an array)"
+    uniq, inverse = np.unique(np.asarray(dpack.target), return_inverse=True)
+    names = np.array([dpack.get_label(t) for t in uniq], dtype=object)
+    return names[inverse] if len(uniq) else np.empty(0, dtype=object)
+
+
+def _tree_docs(dpack, labels):
+    """
+    Documents whose gold attachments form a tree: each EDU has
+    exactly one parent, exactly one of them is the fake root, and
+    following the parents from any EDU leads to the root
+    """
+    parents = defaultdict(dict)
+    bad = set()
+    for i in np.flatnonzero(labels != UNRELATED):
+        edu1, edu2 = dpack.pairings[i]
+        doc_parents = parents[edu2.grouping]
+        if edu2.id in doc_parents:
+            bad.add(edu2.grouping)
+        doc_parents[edu2.id] = edu1.id
+    edus = defaultdict(set)
+    for edu in dpack.edus:
+        if edu.grouping is not None:
+            edus[edu.grouping].add(edu.id)
+    docs = set()
+    for doc, doc_edus in edus.items():
+        doc_parents = parents[doc]
+        if doc in bad or set(doc_parents) != doc_edus or\
+                list(doc_parents.values()).count(ROOT) != 1:
+            continue
+        reaches_root = {ROOT}
+        for edu in doc_edus:
+            path = []
+            while edu not in reaches_root and edu not in path:
+                path.append(edu)
+                edu = doc_parents.get(edu, edu)
+            if edu not in reaches_root:
+                break  # cycle
+            reaches_root.update(path)
+        else:
+            docs.add(doc)
+    return docs
+
+
+def gold_docs(econf, dpack, labels):
+    """
+    Documents for which decoding with this (oracle) evaluation would
+    just give us the gold structure
+    """
+    if econf.settings.intra is not None:
+        return set()
+    decoder = _core_decoder(econf)
+    if decoder not in _GOLD_DECODERS:
+        return set()
+    elif decoder == 'local':
+        return set(e.grouping for e in dpack.edus
+                   if e.grouping is not None)
+    else:
+        return _tree_docs(dpack, labels)
+
+
+def _oracle_models(econf):
+    "the models to decode an oracle evaluation with"
+    oracle = Team('oracle', 'oracle')
+    if econf.settings.intra is not None:
+        return IntraInterPair(intra=oracle, inter=oracle)
+    return oracle
+
+
+def _gold_path(output_path):
+    "where we write the gold structure part of an oracle output"
+    return output_path + '.gold'
+
+
+def _rest_path(output_path):
+    "where we decode the rest of an oracle output"
+    return output_path + '.rest'
+
+
+def _split(dpack, econf):
+    """
+    Documents we can write the gold structure out for, and a pack
+    of the rest (None if there is no rest)
+    """
+    docs = gold_docs(econf, dpack, _gold_labels(dpack))
+    rest = np.array([e2.grouping not in docs for _, e2 in dpack.pairings],
+                    dtype=bool)
+    return docs, dpack.selected(np.flatnonzero(rest)) if rest.any()\
+        else None
+
+
+def _write_gold(dpack, docs, path):
+    """
+    Write the gold structure for some documents in the attelo
+    output format
+    """
+    labels = _gold_labels(dpack)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with codecs.open(tmp_path, 'w', 'utf-8') as stream:
+        for i, (edu1, edu2) in enumerate(dpack.pairings):
+            if edu2.grouping in docs:
+                stream.write(u'\t'.join([edu1.id, edu2.id, labels[i]]) +
+                             u'\n')
+    os.rename(tmp_path, path)
+
+
+def oracle_jobs(dpack, econf, output_path):
+    """
+    Delayed jobs for an oracle evaluation: one writing out the gold
+    structure for the documents we can (see the module docs), and
+    the usual per-group decoding jobs for the rest (see
+    `join_oracle` for putting them together)
+    """
+    docs, rest = _split(dpack, econf)
+    jobs = [delayed(_write_gold)(dpack, docs, _gold_path(output_path))]
+    if rest is not None:
+        jobs.extend(ath_decode.jobs(rest, _oracle_models(econf),
+                                    econf.decoder.payload,
+                                    econf.settings.mode,
+                                    _rest_path(output_path)))
+    return jobs
+
+
+def join_oracle(dpack, econf, output_path):
+    """
+    Put the output of the `oracle_jobs` together
+    """
+    _, rest = _split(dpack, econf)
+    parts = [_gold_path(output_path)]
+    if rest is not None:
+        ath_decode.concatenate_outputs(rest, _rest_path(output_path))
+        parts.append(_rest_path(output_path))
+    tmp_path = '{}.{}.tmp'.format(output_path, os.getpid())
+    with codecs.open(tmp_path, 'w', 'utf-8') as stream:
+        for path in parts:
+            with codecs.open(path, 'r', 'utf-8') as part:
+                shutil.copyfileobj(part, stream)
+    os.rename(tmp_path, output_path)
+    for path in parts:
+        os.remove(path)
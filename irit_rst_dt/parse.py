@@ -0,0 +1,392 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Parsing new documents with the combined models
+
+The input is the same as what the harness itself works with:
+EDUs (`.edu_input`), candidate pairs (`.pairings`), and their
+features (`.relations.sparse`, vectorised against the training
+vocabulary). We call such a triple a payload. Several payloads
+can be decoded together by concatenating them; the predictions
+can then be split back out by EDU id.
+
+Decoding a payload happens in memory: we build its data pack from
+the lines, score the whole of its feature matrix with one call to
+each model, and then decode it a document at a time, with each
+document picking its rows out of the batch scores.
+"""
+
+from __future__ import print_function
+from collections import (defaultdict, namedtuple)
+from os import path as fp
+import codecs
+import io
+import itertools as itr
+import os
+import sys
+
+from attelo.decoding import (decode)
+from attelo.decoding.intra import (IntraInterPair)
+from attelo.edu import (EDU, FAKE_ROOT, FAKE_ROOT_ID)
+from attelo.table import (DataPack, UNRELATED)
+from attelo.util import (Team)
+import numpy as np
+import six
+
+from .local import (TRAINING_CORPUS)
+from .loop import (LoopConfig)
+from .mapped import (load_any)
+from .path import (attelo_doc_model_paths,
+                   attelo_sent_model_paths)
+from .precision import (compact_matrix,
+                         saved_precision)
+from .selection import (Selection,
+                        select_evaluations)
+from .util import (exit_ungathered,
+                   latest_tmp)
+
+# pylint: disable=too-few-public-methods
+
+Payload = namedtuple('Payload', ['edus', 'pairings', 'features'])
+"""
+Lines of the EDU, pairings and (sparse) features files for a set
+of documents (the features have their header line first; pairings
+and feature lines are in the same order)
+"""
+
+PAYLOAD_EXTS = Payload(edus='edu_input',
+                       pairings='pairings',
+                       features='relations.sparse')
+"Extension for each part of a payload"
+
+
+def current_lconf(n_jobs=-1):
+    """
+    Loop configuration for the current evaluation (the one whose
+    combined models we use, at its storage precision)
+    """
+    data_dir = latest_tmp()
+    if not fp.exists(data_dir):
+        exit_ungathered()
+    eval_dir = fp.join(data_dir, "eval-current")
+    scratch_dir = fp.join(data_dir, "scratch-current")
+    if not fp.exists(eval_dir) or not fp.exists(scratch_dir):
+        sys.exit("No current evaluation to take models from "
+                 "(try `irit-rst-dt evaluate`)")
+    dataset = fp.basename(TRAINING_CORPUS)
+    lconf = LoopConfig(eval_dir=eval_dir,
+                       scratch_dir=scratch_dir,
+                       folds=None,
+                       stage=None,
+                       fold_file=fp.join(eval_dir,
+                                         "folds-%s.json" % dataset),
+                       n_jobs=n_jobs,
+                       dataset=dataset,
+                       evaluations=None,
+                       sample=None,
+                       profile=None,
+                       mmap_models=False,
+                       precision=None)
+    return lconf._replace(precision=saved_precision(lconf) or 'double')
+
+
+def add_config_args(psr):
+    """
+    Flags for choosing the learner, decoder and settings to
+    parse with
+    """
+    psr.add_argument("--learner", metavar='KEY', required=True,
+                     help="learner (its combined models must exist)")
+    psr.add_argument("--decoder", metavar='KEY', required=True,
+                     help="core decoder (eg. mst)")
+    psr.add_argument("--settings", metavar='KEY', required=True,
+                     help="decoder settings (eg. AD.L_joint)")
+
+
+def pick_evaluation(args):
+    """
+    The one evaluation config that matches the learner, decoder
+    and settings flags (exits if there isn't exactly one)
+    """
+    selection = Selection(include=['learner:' + args.learner,
+                                   'decoder:' + args.decoder,
+                                   'settings:' + args.settings],
+                          exclude=[])
+    matches = select_evaluations(selection)
+    if len(matches) != 1:
+        sys.exit("Need exactly one configuration for {} {} {} "
+                 "(found {})".format(args.learner, args.decoder,
+                                     args.settings, len(matches)))
+    return matches[0]
+
+
+def load_models(lconf, econf):
+    """
+    Load the combined models for an evaluation config (in the
+    form the attelo decoding jobs expect)
+    """
+    doc_paths = attelo_doc_model_paths(lconf, econf.learner, None)
+    for path in doc_paths:
+        if path != 'oracle' and not fp.exists(path):
+            sys.exit("No combined model {} "
+                     "(try `irit-rst-dt evaluate --combined-models`)"
+                     "".format(path))
+    intra_flag = econf.settings.intra
+    if intra_flag is None:
+        return doc_paths.fmap(load_any)
+    sent_paths = attelo_sent_model_paths(lconf, econf.learner, None)
+    intra_model = Team('oracle', 'oracle')\
+        if intra_flag.intra_oracle\
+        else sent_paths.fmap(load_any)
+    inter_model = Team('oracle', 'oracle')\
+        if intra_flag.inter_oracle\
+        else doc_paths.fmap(load_any)
+    return IntraInterPair(intra=intra_model, inter=inter_model)
+
+
+def edu_ids(payload):
+    "ids of the EDUs in a payload"
+    return [l.split(u'\t', 1)[0] for l in payload.edus]
+
+
+def concat_payloads(payloads):
+    """
+    A single payload for a list of payloads (we keep the features
+    header from the first one)
+
+    :rtype: Payload
+    """
+    edus = []
+    pairings = []
+    features = []
+    for payload in payloads:
+        edus.extend(payload.edus)
+        pairings.extend(payload.pairings)
+        if not features:
+            features.extend(payload.features)
+        else:
+            features.extend(payload.features[1:])
+    return Payload(edus, pairings, features)
+
+
+def payload_paths(prefix):
+    """
+    Paths to the files for a payload (`prefix.<ext>`)
+
+    :rtype: Payload (of paths)
+    """
+    return Payload(*['.'.join([prefix, ext]) for ext in PAYLOAD_EXTS])
+
+
+def _read_edu(line):
+    "an EDU from a line of an EDU input file"
+    fields = line.rstrip(u'\r\n').split(u'\t')
+    if len(fields) != 6:
+        raise ValueError('EDU line has {} fields instead of 6: {}'
+                         ''.format(len(fields), line.strip()))
+    global_id, txt, grouping, subgrouping, start, end = fields
+    return EDU(global_id, txt, int(start), int(end), grouping, subgrouping)
+
+
+def _read_labels(header):
+    "the labels from the header line of a features file"
+    seq = header[1:].split() if header.startswith(u'#') else []
+    if not seq or seq[0] != u'labels:':
+        raise ValueError('Features have no labels header line')
+    return seq[1:]
+
+
+def payload_pack(payload, precision='double'):
+    """
+    The data pack for a payload, built in memory (as
+    `attelo.io.load_data_pack` would from the payload files), with
+    its features in the given storage precision
+
+    :rtype: DataPack
+    """
+    from sklearn.datasets import (load_svmlight_file)
+    edus = [_read_edu(l) for l in payload.edus if l.strip()]
+    edumap = {e.id: e for e in edus}
+    pairs = [l.rstrip(u'\r\n').split(u'\t')[:2]
+             for l in payload.pairings if l.strip()]
+    if any(FAKE_ROOT_ID in p for p in pairs):
+        edus.insert(0, FAKE_ROOT)
+        edumap[FAKE_ROOT_ID] = FAKE_ROOT
+    unknown = [i for p in pairs for i in p if i not in edumap]
+    if unknown:
+        raise ValueError('Pairings mention unknown EDUs: {}'
+                         ''.format(' '.join(sorted(set(unknown)))))
+    pairings = [(edumap[id1], edumap[id2]) for id1, id2 in pairs]
+    labels = _read_labels(payload.features[0]) if payload.features\
+        else []
+    blob = u'\n'.join(l.rstrip(u'\r\n') for l in payload.features)
+    # pylint: disable=unbalanced-tuple-unpacking
+    data, target = load_svmlight_file(io.BytesIO(blob.encode('utf-8')))
+    # pylint: enable=unbalanced-tuple-unpacking
+    if precision == 'single':
+        data = compact_matrix(data)
+    return DataPack.load(edus, pairings, data, target, labels)
+
+
+class _BatchModel(object):
+    """
+    Stand-in for a model, which scores a whole batch in one call
+    (the first time it is asked about any of it), and answers for
+    the documents in the batch by picking out their rows
+
+    Scoring is row by row, so this gives the same answers as the
+    model would. Anything we can't answer this way (calls with
+    other arguments, or pairings outside of the batch) goes to the
+    model itself.
+    """
+    _SCORING = ['decision_function', 'predict', 'predict_proba',
+                'predict_score']
+
+    def __init__(self, model, dpack):
+        self._model = model
+        self._dpack = dpack
+        self._rows = {(e1.id, e2.id): i
+                      for i, (e1, e2) in enumerate(dpack.pairings)}
+        self._scores = {}
+
+    def _scorer(self, name):
+        "batched version of a scoring method"
+        method = getattr(self._model, name)
+
+        def _score(dpack, *args, **kwargs):
+            "rows of the batch scores for the pack (see `_BatchModel`)"
+            rows = [self._rows.get((e1.id, e2.id))
+                    for e1, e2 in dpack.pairings]
+            if args or kwargs or None in rows:
+                return method(dpack, *args, **kwargs)
+            if name not in self._scores:
+                self._scores[name] = method(self._dpack)
+            return self._scores[name][np.array(rows, dtype=np.intp)]
+        return _score
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name in self._SCORING:
+            return self._scorer(name)
+        return getattr(self._model, name)
+
+
+def _batch_models(models, dpack):
+    """
+    The models (as loaded by `load_models`), each scoring the whole
+    data pack in one call (see `_BatchModel`)
+    """
+    if isinstance(models, IntraInterPair):
+        return IntraInterPair(intra=_batch_models(models.intra, dpack),
+                              inter=_batch_models(models.inter, dpack))
+    return models.fmap(lambda m: m if isinstance(m, six.string_types)
+                       else _BatchModel(m, dpack))
+
+
+def decode_payload(payload, models, econf, precision='double'):
+    """
+    Decode a payload (in memory, see the module docs), with its
+    features in the given storage precision; return the predicted
+    edges (attachments only, ie. no unrelated)
+
+    :rtype: [(string, string, string)]
+    """
+    dpack = payload_pack(payload, precision)
+    models = _batch_models(models, dpack)
+    docs = defaultdict(list)
+    for i, (_, edu2) in enumerate(dpack.pairings):
+        docs[edu2.grouping].append(i)
+    edges = []
+    for doc in sorted(docs):
+        onepack = dpack.selected(docs[doc])
+        predictions = decode(econf.settings.mode, econf.decoder.payload,
+                             onepack, models)
+        edges.extend(tuple(p) for p in predictions if p[2] != UNRELATED)
+    return edges
+
+
+# ---------------------------------------------------------------------
+# streaming
+# ---------------------------------------------------------------------
+
+_EDU_GROUPING_COL = 2
+"Column of the document name in the EDU input file"
+
+
+def payload_prefix(input_dir):
+    """
+    Common prefix for the payload files in a directory (exits if
+    there is not exactly one set of them)
+    """
+    suffix = '.' + PAYLOAD_EXTS.features
+    prefixes = [fp.join(input_dir, f[:-len(suffix)])
+                for f in sorted(os.listdir(input_dir))
+                if f.endswith(suffix)]
+    if len(prefixes) != 1:
+        sys.exit("Expected one *{} file in {} (found {})"
+                 "".format(suffix, input_dir, len(prefixes)))
+    return prefixes[0]
+
+
+def _doc_payloads(paths):
+    """
+    Stream `(doc, edu lines, pairing lines, feature lines)` for each
+    document in a set of payload files
+
+    This only ever holds one document in memory, so it relies on
+    the EDUs and pairings being in the same document order (as the
+    feature extraction writes them)
+    """
+    with codecs.open(paths.edus, 'r', 'utf-8') as edus,\
+            codecs.open(paths.pairings, 'r', 'utf-8') as pairings,\
+            codecs.open(paths.features, 'r', 'utf-8') as features:
+        next(features)  # header
+        pairs = six.moves.zip(pairings, features)
+        ahead = next(pairs, None)
+        for doc, lines in itr.groupby(
+                edus, lambda l: l.split(u'\t')[_EDU_GROUPING_COL]):
+            edu_lines = list(lines)
+            ids = frozenset(l.split(u'\t', 1)[0] for l in edu_lines)
+            pair_lines = []
+            feat_lines = []
+            while ahead is not None and\
+                    ahead[0].rstrip(u'\r\n').split(u'\t')[1] in ids:
+                pair_lines.append(ahead[0])
+                feat_lines.append(ahead[1])
+                ahead = next(pairs, None)
+            yield doc, edu_lines, pair_lines, feat_lines
+        if ahead is not None:
+            raise ValueError('Pairing {} is not for any EDU we have seen '
+                             '(are the EDUs and pairings in the same '
+                             'document order?)'.format(ahead[0].strip()))
+
+
+def iter_chunks(paths, chunk_size):
+    """
+    Stream `(number of docs, payload)` for chunks of (up to)
+    `chunk_size` documents each from a set of payload files
+
+    :type paths: Payload (of paths)
+    :rtype: iterable((int, Payload))
+    """
+    with codecs.open(paths.features, 'r', 'utf-8') as stream:
+        header = [next(stream)]
+    chunk = []
+    for doc in _doc_payloads(paths):
+        chunk.append(doc)
+        if len(chunk) == chunk_size:
+            yield _mk_chunk(header, chunk)
+            chunk = []
+    if chunk:
+        yield _mk_chunk(header, chunk)
+
+
+def _mk_chunk(header, docs):
+    "`(number of docs, payload)` for `(doc, edus, pairings, features)`"
+    return len(docs), Payload(edus=[l for d in docs for l in d[1]],
+                              pairings=[l for d in docs for l in d[2]],
+                              features=header + [l for d in docs
+                                                 for l in d[3]])
@@ -62,6 +62,43 @@ def pairings_path(lconf):
     return features_path(lconf) + '.pairings'
 
 
+def manifest_path(lconf):
+    """
+    Path to the file digest manifest for the evaluation
+    """
+    return fp.join(lconf.eval_dir, 'manifest.json')
+
+
+def telemetry_path(lconf):
+    """
+    Path to the telemetry log for the evaluation
+    """
+    return fp.join(lconf.eval_dir, 'telemetry.jsonl')
+
+
+def profile_dir_path(lconf):
+    """
+    Directory for task profiles (if we are profiling)
+    """
+    return fp.join(lconf.eval_dir, 'profiles')
+
+
+def selection_path(lconf):
+    """
+    Path to the evaluation selection patterns (if any) for the
+    evaluation
+    """
+    return fp.join(lconf.eval_dir, 'selection.json')
+
+
+def sample_path(lconf):
+    """
+    Path to the description of the document sample (if any) we
+    are evaluating on
+    """
+    return fp.join(lconf.eval_dir, 'sample.json')
+
+
 def fold_dir_basename(fold):
     "Relative directory for working within a given fold"
     return "fold-%d" % fold
@@ -121,6 +158,27 @@ def decode_output_path(lconf, econf, fold):
     return fp.join(fold_dir, decode_output_basename(econf))
 
 
+def fold_stats_path(lconf, econf, fold):
+    "Sufficient statistics for a given loop/eval config and fold"
+    return fp.join(fold_dir_path(lconf, fold), 'stats',
+                   ".".join(["stats", econf.key, "json"]))
+
+
+def fold_timings_path(lconf, fold, part=None):
+    """
+    Time spent learning and decoding in a fold (or in part of it,
+    eg. for a cluster job doing only some of the learners)
+    """
+    bname = 'timings.json' if part is None\
+        else 'timings-{}.json'.format(part)
+    return fp.join(fold_dir_path(lconf, fold), bname)
+
+
+def decode_store_path(lconf, econf, fold):
+    "Document-indexed prediction store for a given loop/eval config and fold"
+    return decode_output_path(lconf, econf, fold) + '.store'
+
+
 def report_dir_basename(lconf):
     "Relative directory for a report directory"
     return "reports-%s" % lconf.dataset
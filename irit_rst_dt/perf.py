@@ -0,0 +1,316 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Performance profiles of evaluations, and comparing them
+
+Each evaluation report includes a `perf.json`, distilled from the
+run telemetry: the time and CPU of every task, grouped by task type
+(`phase:key`, where decoding tasks for the same evaluation count as
+one type), along with totals per phase, per learner and per decoder,
+and the peak memory of the whole run. Snapshots keep it along with
+the rest of the report, so any two runs can be compared.
+
+Most tasks share a (worker) process with others, and the peak memory
+we have for them is that of the process so far, which only ever
+grows; which task it gets pinned on depends on how the tasks were
+scheduled. So we only keep per-task memory samples for the tasks
+that ran in a process of their own (those with limits, see
+`irit_rst_dt.supervise`), and otherwise compare memory on the peak
+of the whole run.
+
+The comparison tests each task type shared by the two runs for a
+slowdown (or memory growth) with a one-sided Mann-Whitney U test
+over the task samples; it flags the ones that are both significant
+and bigger than a minimum relative change. Task types with too few
+samples for a test (eg. the global report), and the run peaks, are
+flagged on the size of the change alone.
+"""
+
+from __future__ import print_function
+from collections import (defaultdict, namedtuple)
+from os import path as fp
+import glob
+import json
+
+from .telemetry import (load_telemetry)
+
+# pylint: disable=too-few-public-methods
+
+PERF_VERSION = 2
+"""
+Version of the perf.json format (version 1 had per-task memory
+samples for every task, which we do not trust; see above)
+"""
+
+DEFAULT_ALPHA = 0.01
+"Significance level for flagging a regression"
+
+DEFAULT_MIN_CHANGE = 0.1
+"Smallest relative change (of the medians) we flag"
+
+_MIN_SAMPLES = 3
+"Fewest samples (in each run) we run a significance test on"
+
+RUN_PEAK = '(run peak)'
+"Task type under which we compare the peak memory of whole runs"
+
+# pylint: disable=pointless-string-statement
+Change = namedtuple('Change', ['task_type', 'measure',
+                               'n_base', 'n_new',
+                               'base', 'new', 'ratio',
+                               'pvalue', 'flagged'])
+"""
+Comparison of a measure (secs or peak_rss_kb) for a task type
+(or `RUN_PEAK`) between a baseline and a new run (medians; pvalue
+is None where we had too few samples to test)
+"""
+# pylint: enable=pointless-string-statement
+
+
+def task_type(rec):
+    """
+    Type of a task for comparison purposes (the decoding tasks
+    for an evaluation are split into numbered groups; these all
+    count as the same type)
+    """
+    key = rec['key']
+    if rec['phase'] == 'decode':
+        key = key.rsplit('-', 1)[0]
+    return '{}:{}'.format(rec['phase'], key)
+
+
+def _secs(rec):
+    "duration of a task"
+    return rec['end'] - rec['start']
+
+
+def _cpu(rec):
+    "cpu time of a task (None if unknown)"
+    if rec['cpu_user'] is None:
+        return None
+    return rec['cpu_user'] + (rec['cpu_sys'] or 0)
+
+
+def _totals(records):
+    "summed time and peak memory over some task records"
+    rss = [r['peak_rss_kb'] for r in records
+           if r['peak_rss_kb'] is not None]
+    cpu = [_cpu(r) for r in records if _cpu(r) is not None]
+    return {'tasks': len(records),
+            'task_secs': sum(_secs(r) for r in records),
+            'cpu_secs': sum(cpu),
+            'peak_rss_kb': max(rss) if rss else None}
+
+
+def perf_profile(records):
+    """
+    Performance profile from the telemetry records of a run
+
+    :rtype: dict
+    """
+    tasks = defaultdict(lambda: {'secs': [], 'cpu_secs': [],
+                                 'peak_rss_kb': []})
+    groups = {'phases': defaultdict(list),
+              'learners': defaultdict(list),
+              'decoders': defaultdict(list)}
+    for rec in records:
+        if not rec['ok']:
+            continue
+        samples = tasks[task_type(rec)]
+        samples['secs'].append(_secs(rec))
+        samples['cpu_secs'].append(_cpu(rec))
+        if rec.get('isolated'):
+            samples['peak_rss_kb'].append(rec['peak_rss_kb'])
+        groups['phases'][rec['phase']].append(rec)
+        if rec['learner'] is not None:
+            groups['learners'][rec['learner']].append(rec)
+        if rec['decoder'] is not None:
+            groups['decoders'][rec['decoder']].append(rec)
+    blob = {'version': PERF_VERSION,
+            'tasks': dict(tasks),
+            'peak_rss_kb': _totals(records)['peak_rss_kb']}
+    for name, group in groups.items():
+        blob[name] = {k: _totals(v) for k, v in group.items()}
+    return blob
+
+
+def save_perf(lconf, output_path):
+    """
+    Save the performance profile of an evaluation (nothing if we
+    have no telemetry)
+    """
+    records = load_telemetry(lconf)
+    if not records:
+        return
+    with open(output_path, 'w') as stream:
+        json.dump(perf_profile(records), stream, indent=2, sort_keys=True)
+
+
+def find_perf(path):
+    """
+    The perf.json for a run, given either the file itself, a report
+    dir, or an evaluation dir (the latest report in it); None if
+    there isn't one
+    """
+    if fp.isfile(path):
+        return path
+    candidates = [fp.join(path, 'perf.json')]
+    candidates.extend(sorted(glob.glob(fp.join(path, 'reports-*',
+                                               'perf.json')),
+                             reverse=True))
+    for cpath in candidates:
+        if fp.exists(cpath):
+            return cpath
+    return None
+
+
+def load_perf(path):
+    """
+    Read a perf.json
+    """
+    with open(path) as stream:
+        return json.load(stream)
+
+
+def _median(values):
+    "median of a non-empty list"
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.
+
+
+def _increase_pvalue(base, new):
+    """
+    p-value for the new samples being stochastically larger than
+    the baseline ones (one-sided Mann-Whitney U)
+    """
+    # scipy is slow to import, and we only need it here
+    from scipy.stats import mannwhitneyu
+    try:
+        return mannwhitneyu(new, base, alternative='greater')[1]
+    except TypeError:  # older scipy: one-sided p-value only
+        stat, pvalue = mannwhitneyu(new, base)
+        return pvalue if stat > len(new) * len(base) / 2. else 1.
+    except ValueError:  # eg. all values identical
+        return 1.
+
+
+def _compare_samples(ttype, measure, base, new, alpha, min_change):
+    "comparison of one measure for one task type"
+    base = [x for x in base if x is not None]
+    new = [x for x in new if x is not None]
+    if not base or not new:
+        return None
+    b_med = _median(base)
+    n_med = _median(new)
+    ratio = n_med / b_med if b_med else None
+    big = ratio is not None and ratio > 1 + min_change
+    if min(len(base), len(new)) >= _MIN_SAMPLES:
+        pvalue = _increase_pvalue(base, new)
+        flagged = big and pvalue < alpha
+    else:
+        pvalue = None
+        flagged = big
+    return Change(ttype, measure, len(base), len(new), b_med, n_med,
+                  ratio, pvalue, flagged)
+
+
+def _run_peak(blob):
+    "peak memory of a whole run (None if unknown)"
+    if 'peak_rss_kb' in blob:
+        return blob['peak_rss_kb']
+    # version 1: the largest of the phase peaks
+    rss = [t['peak_rss_kb'] for t in blob.get('phases', {}).values()
+           if t['peak_rss_kb'] is not None]
+    return max(rss) if rss else None
+
+
+def compare_perf(base, new,
+                 alpha=DEFAULT_ALPHA,
+                 min_change=DEFAULT_MIN_CHANGE):
+    """
+    Compare the task types two performance profiles have in common,
+    and their run peaks (memory)
+
+    :rtype: [Change]
+    """
+    # version 1 profiles have untrustworthy per-task memory samples
+    measures = ['secs']
+    if min(base['version'], new['version']) >= 2:
+        measures.append('peak_rss_kb')
+    changes = []
+    for ttype in sorted(frozenset(base['tasks']) & frozenset(new['tasks'])):
+        for measure in measures:
+            change = _compare_samples(ttype, measure,
+                                      base['tasks'][ttype][measure],
+                                      new['tasks'][ttype][measure],
+                                      alpha, min_change)
+            if change is not None:
+                changes.append(change)
+    change = _compare_samples(RUN_PEAK, 'peak_rss_kb',
+                              [_run_peak(base)], [_run_peak(new)],
+                              alpha, min_change)
+    if change is not None:
+        changes.append(change)
+    return changes
+
+
+def _show_value(measure, value):
+    "a median for display"
+    if measure == 'peak_rss_kb':
+        return '{:.1f}MB'.format(value / 1024.)
+    return '{:.2f}s'.format(value)
+
+
+def show_changes(changes, only_flagged=False):
+    """
+    Comparison table
+    """
+    header = ['task-type', 'measure', 'n-base', 'n-new', 'base', 'new',
+              'ratio', 'p-value', '']
+    lines = ['\t'.join(header)]
+    for change in changes:
+        if only_flagged and not change.flagged:
+            continue
+        lines.append('\t'.join([
+            change.task_type,
+            'time' if change.measure == 'secs' else 'memory',
+            str(change.n_base),
+            str(change.n_new),
+            _show_value(change.measure, change.base),
+            _show_value(change.measure, change.new),
+            '' if change.ratio is None else '{:.2f}'.format(change.ratio),
+            '' if change.pvalue is None else '{:.3g}'.format(change.pvalue),
+            'REGRESSION' if change.flagged else '']))
+    return '\n'.join(lines)
+
+
+def show_totals(base, new, group):
+    """
+    Side-by-side totals for a group (phases, learners, decoders)
+    """
+    header = ['name', 'base-secs', 'new-secs', 'base-peak-mb',
+              'new-peak-mb']
+    lines = ['\t'.join(header)]
+    names = sorted(frozenset(base.get(group, {})) |
+                   frozenset(new.get(group, {})))
+
+    def _fields(blob, name):
+        "secs and peak memory for a name (blank if missing)"
+        tot = blob.get(group, {}).get(name)
+        if tot is None:
+            return ['', '']
+        rss = tot['peak_rss_kb']
+        return ['{:.1f}'.format(tot['task_secs']),
+                '' if rss is None else '{:.1f}'.format(rss / 1024.)]
+
+    for name in names:
+        bfields = _fields(base, name)
+        nfields = _fields(new, name)
+        lines.append('\t'.join([name, bfields[0], nfields[0],
+                                bfields[1], nfields[1]]))
+    return '\n'.join(lines)
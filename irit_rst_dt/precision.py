@@ -0,0 +1,235 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Storage precision for the feature matrix
+
+Our features are almost all binary, so storing them as float64 with
+64-bit indices wastes half of the memory (and of the copying into
+sub-packs and workers). In single precision, the feature matrix is
+converted to float32 values with int32 indices as soon as it is
+loaded, so every sub-pack starts from the compact form. That is as
+far as it goes: the learners keep float64 weights, so the score
+matrices computed from the features (and everything downstream of
+them) are still in double precision. Carrying single precision
+further is out of scope here.
+
+The precision is saved with the evaluation (`precision.json`), by
+the stage that starts it (or the standalone run), along with the
+memory saved; later stages and resumed runs use the saved precision
+unless told otherwise.
+The report shows it, and checks the scores against those of the
+most recent double precision evaluation with the same folds: they
+should not change. To make that possible, a new single precision
+evaluation borrows its folds from the latest double precision one
+over the same documents.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+
+PRECISIONS = ['double', 'single']
+"Storage precisions we know about"
+
+_MAX_INT32 = np.iinfo(np.int32).max
+
+_MEASURED = {}
+"Feature matrix bytes before and after conversion, in this process"
+
+
+def _matrix_bytes(data):
+    "bytes taken by a (sparse or dense) matrix"
+    if hasattr(data, 'indptr'):
+        return data.data.nbytes + data.indices.nbytes + data.indptr.nbytes
+    return data.nbytes
+
+
+def compact_matrix(data):
+    """
+    Single precision copy of a feature matrix: float32 values and
+    (for sparse matrices, if they fit) int32 indices
+    """
+    res = data.astype(np.float32)
+    if hasattr(res, 'indptr') and res.nnz <= _MAX_INT32 and\
+            max(res.shape) <= _MAX_INT32:
+        res.indices = res.indices.astype(np.int32, copy=False)
+        res.indptr = res.indptr.astype(np.int32, copy=False)
+    return res
+
+
+def precision_path(lconf):
+    """
+    Where we record the storage precision of an evaluation
+    """
+    return fp.join(lconf.eval_dir, 'precision.json')
+
+
+def compact_pack(lconf, dpack):
+    """
+    The data pack with its features in the evaluation's storage
+    precision (noting the memory saved for `save_precision`)
+    """
+    if lconf.precision != 'single':
+        return dpack
+    before = _matrix_bytes(dpack.data)
+    data = compact_matrix(dpack.data)
+    after = _matrix_bytes(data)
+    print('Feature matrix in single precision: {:.1f}MB -> {:.1f}MB'
+          ''.format(before / 1048576., after / 1048576.), file=sys.stderr)
+    _MEASURED.update(bytes_before=before, bytes_after=after)
+    return dpack._replace(data=data)
+
+
+def save_precision(lconf):
+    """
+    Record the storage precision of the evaluation, and in single
+    precision, the memory saved (so the features must have been
+    loaded by now)
+    """
+    blob = {'precision': lconf.precision}
+    if lconf.precision == 'single':
+        blob.update(_MEASURED)
+    path = precision_path(lconf)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as stream:
+        json.dump(blob, stream, indent=2)
+    os.rename(tmp_path, path)
+
+
+def saved_precision(lconf):
+    """
+    The storage precision saved with the evaluation (None if there
+    is none)
+    """
+    if not fp.exists(precision_path(lconf)):
+        return None
+    return _load_info(lconf.eval_dir)['precision']
+
+
+def _load_info(eval_dir):
+    "the recorded precision of an evaluation (double if none)"
+    path = fp.join(eval_dir, 'precision.json')
+    if not fp.exists(path):
+        return {'precision': 'double'}
+    with open(path) as stream:
+        return json.load(stream)
+
+
+def _load_summary(path):
+    "rows of a scores summary, as {(learner, decoder, settings): fields}"
+    rows = {}
+    with open(path) as stream:
+        next(stream, None)  # header
+        for line in stream:
+            fields = line.rstrip('\n').split('\t')
+            rows[tuple(fields[:3])] = fields[3:]
+    return rows
+
+
+def _load_folds(eval_dir, lconf):
+    "the fold dictionary of an evaluation (None if it has none)"
+    path = fp.join(eval_dir, fp.basename(lconf.fold_file))
+    if not fp.exists(path):
+        return None
+    with open(path) as stream:
+        return json.load(stream)
+
+
+def _double_evals(lconf):
+    """
+    Other double precision evaluations, most recent first
+    """
+    data_dir = fp.dirname(fp.abspath(lconf.eval_dir))
+    for eval_dir in sorted(glob.glob(fp.join(data_dir, 'eval-*')),
+                           reverse=True):
+        if fp.islink(eval_dir) or\
+                fp.realpath(eval_dir) == fp.realpath(lconf.eval_dir) or\
+                _load_info(eval_dir)['precision'] != 'double':
+            continue
+        yield eval_dir
+
+
+def baseline_folds(lconf, docs):
+    """
+    Folds of the most recent double precision evaluation over the
+    given documents, if we are in single precision (else None)
+
+    :rtype: dict(string, int) or None
+    """
+    if lconf.precision != 'single':
+        return None
+    docs = frozenset(docs)
+    for eval_dir in _double_evals(lconf):
+        folds = _load_folds(eval_dir, lconf)
+        if folds is not None and frozenset(folds) == docs:
+            return folds
+    return None
+
+
+def _baseline(lconf):
+    """
+    Latest scores summary of the most recent double precision
+    evaluation with the same folds (None if there is none)
+    """
+    ours = _load_folds(lconf.eval_dir, lconf)
+    for eval_dir in _double_evals(lconf):
+        if ours is None or _load_folds(eval_dir, lconf) != ours:
+            continue
+        summaries = sorted(glob.glob(fp.join(eval_dir, 'reports-*',
+                                             'scores-summary.txt')))
+        if summaries:
+            return summaries[-1]
+    return None
+
+
+def mk_precision_report(lconf, report_dir):
+    """
+    Write the memory saved by single precision, and a check of our
+    scores against a double precision baseline (nothing if we are
+    in double precision)
+    """
+    info = _load_info(lconf.eval_dir)
+    if info['precision'] == 'double':
+        return
+    before = info.get('bytes_before')
+    after = info.get('bytes_after')
+    lines = ['precision: {} (float32 features, int32 indices; '
+             'scores still computed in float64)'
+             ''.format(info['precision'])]
+    if before is None or after is None:
+        lines.append('feature matrix: memory saved not measured')
+    else:
+        lines.append('feature matrix: {:.1f}MB -> {:.1f}MB (saved {:.0%})'
+                     ''.format(before / 1048576., after / 1048576.,
+                               1 - float(after) / before if before else 0.))
+    lines.append('')
+    base_path = _baseline(lconf)
+    if base_path is None:
+        lines.append('no double precision evaluation with the same folds '
+                     'to check the scores against')
+    else:
+        base = _load_summary(base_path)
+        ours = _load_summary(fp.join(report_dir, 'scores-summary.txt'))
+        common = sorted(frozenset(base) & frozenset(ours))
+        changed = [c for c in common if base[c] != ours[c]]
+        lines.append('baseline: {}'.format(base_path))
+        lines.append('{} of {} configurations in common have the same '
+                     'scores'.format(len(common) - len(changed),
+                                     len(common)))
+        for config in changed:
+            lines.append('CHANGED\t{}'.format('\t'.join(config)))
+            lines.append('  double\t{}'.format('\t'.join(base[config])))
+            lines.append('  single\t{}'.format('\t'.join(ours[config])))
+        if changed:
+            print('Single precision changed the scores of {} '
+                  'configurations (see precision.txt in the report)'
+                  ''.format(len(changed)), file=sys.stderr)
+    with open(fp.join(report_dir, 'precision.txt'), 'w') as stream:
+        print('\n'.join(lines), file=stream)
@@ -0,0 +1,129 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Opt-in profiling of harness tasks
+
+Profiling is requested with patterns on the task phase (eg.
+`decode`) or on `phase:key` (eg. `decode:maxent-*`). Matching
+tasks run under cProfile and, where available (Python 3),
+tracemalloc; this happens in whichever process runs the task, so
+it works inside joblib workers too. Each task leaves a `.pstats`
+file and an `.alloc.txt` summary of its biggest allocations under
+the profiles directory of the evaluation; the report merges the
+`.pstats` files into a single list of hot functions.
+"""
+
+from __future__ import print_function
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from os import path as fp
+import cProfile
+import glob
+import os
+import pstats
+
+import six
+
+from .path import (profile_dir_path)
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_TOP_N = 30
+"Number of functions to list in the merged summary"
+
+_TOP_ALLOCS = 25
+"Number of allocation sites to list for each task"
+
+
+def wants_profile(lconf, info):
+    """
+    True if we were asked to profile this task
+    """
+    patterns = lconf.profile or []
+    key = '{}:{}'.format(info.phase, info.key)
+    return any(fnmatch(info.phase, p) or fnmatch(key, p)
+               for p in patterns)
+
+
+def profile_prefix(lconf, info):
+    """
+    Path prefix for the profile files of a task (None if we are
+    not profiling it)
+    """
+    if not wants_profile(lconf, info):
+        return None
+    fold = 'global' if info.fold is None else 'fold-{}'.format(info.fold)
+    name = '{}.{}'.format(fold, info.key.replace(os.sep, '_'))
+    return fp.join(profile_dir_path(lconf), info.phase, name)
+
+
+def _save_allocs(snapshot, peak, path):
+    "write the top allocation sites in a tracemalloc snapshot"
+    with open(path, 'w') as stream:
+        print('peak traced memory: {:.1f} MB'.format(peak / 1048576.),
+              file=stream)
+        for stat in snapshot.statistics('lineno')[:_TOP_ALLOCS]:
+            print(stat, file=stream)
+
+
+@contextmanager
+def profiled(prefix):
+    """
+    Run the body under cProfile and tracemalloc, saving the results
+    with the given path prefix (does nothing if the prefix is None)
+    """
+    if prefix is None:
+        yield
+        return
+    parent = fp.dirname(prefix)
+    if not fp.exists(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:  # eg. another worker got there first
+            pass
+    tracing = tracemalloc is not None and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:  # another profiler is running (nested task)
+        prof = None
+    try:
+        yield
+    finally:
+        if prof is not None:
+            prof.disable()
+            prof.dump_stats(prefix + '.pstats')
+        if tracing:
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            _save_allocs(snapshot, peak, prefix + '.alloc.txt')
+
+
+def mk_profile_summary(lconf, output_path, top_n=_TOP_N):
+    """
+    Merge all of the task profiles for an evaluation into a list
+    of hot functions (nothing if we have no profiles)
+    """
+    paths = sorted(glob.glob(fp.join(profile_dir_path(lconf),
+                                     '*', '*.pstats')))
+    if not paths:
+        return
+    stream = six.StringIO()
+    stats = pstats.Stats(paths[0], stream=stream)
+    for path in paths[1:]:
+        stats.add(path)
+    print('Merged from {} task profiles under {}'
+          ''.format(len(paths), profile_dir_path(lconf)), file=stream)
+    for order in ['tottime', 'cumulative']:
+        print('\nTop {} functions by {}'.format(top_n, order), file=stream)
+        stats.sort_stats(order).print_stats(top_n)
+    with open(output_path, 'w') as ostream:
+        ostream.write(stream.getvalue())
@@ -0,0 +1,407 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Progress and ETA for an evaluation run
+
+Before it starts on the folds (or the combined models), the harness
+plans the tasks it has left to do: learning each missing model,
+decoding and reassembling each evaluation, and the fold reports.
+Each task gets an expected cost, the median time of tasks of the same
+type in past telemetry (see `irit_rst_dt.balance.past_telemetry`).
+
+The tasks themselves run in joblib workers, so we follow their
+progress the same way the reports do: by reading the telemetry log
+as it grows (a background thread polls it). We only count the records
+of our own run (see `irit_rst_dt.telemetry.RUN_ID`), so cluster jobs
+sharing the log do not count each other's work. The ETA is the
+expected cost left divided by the rate at which we have been getting
+through expected costs so far, so it accounts for parallelism and for
+this machine being faster or slower than the past runs.
+
+Every so often we print an ETA line, and rewrite a status file in
+the evaluation dir (`status-<job>.txt`, one per job), which shows the
+percentage done and the projected finish time of each fold.
+"""
+
+from __future__ import print_function
+from collections import (defaultdict, namedtuple)
+from contextlib import contextmanager
+from os import path as fp
+import datetime
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from .balance import (past_telemetry)
+from .loop import (ClusterStage)
+from .path import (attelo_doc_model_paths,
+                   attelo_sent_model_paths,
+                   decode_output_path,
+                   telemetry_path)
+from .sample import (show_duration)
+from .selection import (learners, needs_intra)
+from .telemetry import (RUN_ID)
+
+# pylint: disable=too-few-public-methods
+
+PRINT_SECS = 30
+"Least interval between two progress lines on stderr"
+
+_POLL_SECS = 2
+"Interval between reads of the telemetry log"
+
+_PARTIAL_CAP = 0.9
+"Most of a task done in parts (decoding, fold report) we count early"
+
+_REPORT_PHASES = frozenset(['score', 'report', 'discr'])
+"Phases of the fold report tasks"
+
+# pylint: disable=pointless-string-statement
+Planned = namedtuple('Planned', ['phase', 'fold', 'key', 'cost'])
+"""
+A task we plan to run (decoding and reassembly tasks are for a whole
+evaluation, the fold report for all of its tasks), with its expected
+cost in seconds
+"""
+# pylint: enable=pointless-string-statement
+
+
+def _learn_keys(lconf, rconf, fold, intra):
+    "keys of the learning tasks for models we have yet to build"
+    teams = [('doc', attelo_doc_model_paths(lconf, rconf, fold))]
+    if intra:
+        teams.append(('sent', attelo_sent_model_paths(lconf, rconf, fold)))
+    keys = []
+    for grain, paths in teams:
+        for task, path in [('attach', paths.attach),
+                           ('relate', paths.relate)]:
+            if path != 'oracle' and not fp.exists(path):
+                keys.append('{}-{}-{}'.format(rconf.key, grain, task))
+    return keys
+
+
+def plan_tasks(lconf, folds, combined=False, fold_reports=True):
+    """
+    The tasks we have left to do over the given folds (and/or the
+    combined models, and/or the fold reports), without costs
+
+    :rtype: [(string, int, string)]
+    """
+    evaluations = lconf.evaluations
+    tasks = []
+    for fold in folds:
+        for rconf in learners(evaluations):
+            tasks.extend(('learn', fold, k) for k in
+                         _learn_keys(lconf, rconf, fold,
+                                     needs_intra(evaluations, rconf)))
+        for econf in evaluations:
+            if not fp.exists(decode_output_path(lconf, econf, fold)):
+                tasks.append(('decode', fold, econf.key))
+            tasks.append(('reassembly', fold, econf.key))
+        if fold_reports:
+            tasks.append(('report', fold, 'fold-report'))
+    if combined:
+        for rconf in learners(evaluations):
+            tasks.extend(('learn', None, k) for k in
+                         _learn_keys(lconf, rconf, None,
+                                     needs_intra(evaluations, rconf)))
+    return tasks
+
+
+def _task_id(rec):
+    """
+    The planned task a telemetry record is (part of), as
+    (phase, fold, key)
+    """
+    phase = rec['phase']
+    if phase == 'decode':
+        return phase, rec['fold'], rec['key'].rsplit('-', 1)[0]
+    elif phase in _REPORT_PHASES and rec['fold'] is not None:
+        return 'report', rec['fold'], 'fold-report'
+    return phase, rec['fold'], rec['key']
+
+
+def _median(values):
+    "median of a non-empty list"
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else\
+        (values[mid - 1] + values[mid]) / 2.
+
+
+def expected_costs(records):
+    """
+    Median time of each type of task, as {(phase, key): secs}, in
+    some past telemetry records
+    """
+    per_task = defaultdict(float)
+    for rec in records:
+        per_task[_task_id(rec)] += rec['end'] - rec['start']
+    samples = defaultdict(list)
+    for (phase, _, key), secs in per_task.items():
+        samples[(phase, key)].append(secs)
+    return {k: _median(v) for k, v in samples.items()}
+
+
+def cost_tasks(tasks, costs):
+    """
+    Planned tasks with their expected costs (for tasks of a type
+    we have never seen, the median over the phase; failing that,
+    one second)
+
+    :rtype: [Planned]
+    """
+    by_phase = defaultdict(list)
+    for (phase, _), secs in costs.items():
+        by_phase[phase].append(secs)
+    res = []
+    for phase, fold, key in tasks:
+        cost = costs.get((phase, key))
+        if cost is None:
+            cost = _median(by_phase[phase]) if by_phase[phase] else 1.
+        res.append(Planned(phase, fold, key, max(cost, 0.01)))
+    return res
+
+
+class Progress(object):
+    """
+    How far we have got through the planned tasks (of the given
+    run, if any)
+    """
+    def __init__(self, planned, run=None):
+        self.planned = {(p.phase, p.fold, p.key): p for p in planned}
+        self.run = run
+        self.start = time.time()
+        self._done = defaultdict(float)
+
+    def update(self, rec):
+        """
+        Take a telemetry record into account (ignoring anything we
+        did not plan, or that some other run did)
+        """
+        if self.run is not None and rec.get('run') != self.run:
+            return
+        tid = _task_id(rec)
+        if tid not in self.planned:
+            return
+        phase, fold, key = tid
+        cost = self.planned[tid].cost
+        fold_over = phase == 'report' and rec['key'] == 'summary'
+        if phase == 'decode' or phase == 'report' and not fold_over:
+            # decoding is done a group at a time and the fold report
+            # a part at a time; they are only over once we have
+            # reassembled the decoding, and summarised the fold
+            self._done[tid] = min(self._done[tid] +
+                                  rec['end'] - rec['start'],
+                                  cost * _PARTIAL_CAP)
+        else:
+            self._done[tid] = cost
+        if phase == 'reassembly' and ('decode', fold, key) in self.planned:
+            self._done[('decode', fold, key)] =\
+                self.planned[('decode', fold, key)].cost
+        if fold_over:
+            # including whatever we gave up on (see `supervise`)
+            for other, planned in self.planned.items():
+                if other[1] == fold:
+                    self._done[other] = planned.cost
+
+    def fraction(self, fold=False):
+        """
+        Fraction of the expected cost done (for the given fold; for
+        everything by default)
+        """
+        ids = [t for t in self.planned if fold is False or t[1] == fold]
+        total = sum(self.planned[t].cost for t in ids)
+        return sum(self._done[t] for t in ids) / total if total else 1.
+
+    def _rate(self, now):
+        "expected cost done per second so far (None if unknown)"
+        done = sum(self._done.values())
+        elapsed = now - self.start
+        return done / elapsed if done and elapsed > 0 else None
+
+    def eta(self, now=None):
+        """
+        Seconds left (None if we cannot tell yet)
+        """
+        now = now or time.time()
+        rate = self._rate(now)
+        if rate is None:
+            return None
+        left = sum(p.cost for p in self.planned.values()) -\
+            sum(self._done.values())
+        return max(left, 0.) / rate
+
+    def fold_finish(self, now=None):
+        """
+        Projected finish time of each fold (None for the combined
+        models), assuming they are done in order, as
+        {fold: timestamp or None if we cannot tell}
+        """
+        now = now or time.time()
+        rate = self._rate(now)
+        folds = sorted(frozenset(t[1] for t in self.planned),
+                       key=lambda f: (f is None, f))
+        res = {}
+        left = 0.
+        for fold in folds:
+            left += sum(p.cost - self._done[t]
+                        for t, p in self.planned.items() if t[1] == fold)
+            res[fold] = None if rate is None else now + left / rate
+        return res
+
+
+def _show_time(tstamp):
+    "a clock time (with the date if it is not today)"
+    when = datetime.datetime.fromtimestamp(tstamp)
+    if when.date() == datetime.date.today():
+        return when.strftime('%H:%M')
+    return when.strftime('%Y-%m-%d %H:%M')
+
+
+def show_progress(progress, now=None):
+    "one-line summary of our progress"
+    now = now or time.time()
+    eta = progress.eta(now)
+    line = '[progress] {:.0%} done, elapsed {}'\
+        ''.format(progress.fraction(), show_duration(now - progress.start))
+    if eta is not None:
+        line += ', ETA {} (~{})'.format(show_duration(eta),
+                                        _show_time(now + eta))
+    return line
+
+
+def show_status(progress, label, now=None):
+    "contents of the status file"
+    now = now or time.time()
+    lines = ['{} on {} (pid {})'.format(label, socket.gethostname(),
+                                        os.getpid()),
+             'started ' + _show_time(progress.start),
+             show_progress(progress, now),
+             '',
+             '\t'.join(['fold', 'done', 'finish'])]
+    for fold, finish in sorted(progress.fold_finish(now).items(),
+                               key=lambda x: (x[0] is None, x[0])):
+        frac = progress.fraction(fold)
+        lines.append('\t'.join([
+            'combined' if fold is None else str(fold),
+            '{:.0%}'.format(frac),
+            'done' if frac >= 1 else
+            '?' if finish is None else '~' + _show_time(finish)]))
+    lines.append('')
+    lines.append('updated ' + _show_time(now))
+    return '\n'.join(lines)
+
+
+def status_label(lconf):
+    """
+    What this job is doing, for the status file name
+    """
+    if lconf.stage == ClusterStage.combined_models:
+        label = 'combined'
+    elif lconf.stage == ClusterStage.main:
+        label = 'folds-' + '-'.join(str(f) for f in sorted(lconf.folds))
+    else:
+        label = 'standalone'
+    job_id = os.environ.get('SLURM_JOB_ID')
+    return label if job_id is None else '{}-{}'.format(label, job_id)
+
+
+def status_path(lconf):
+    """
+    Path to the status file for this job
+    """
+    return fp.join(lconf.eval_dir,
+                   'status-{}.txt'.format(status_label(lconf)))
+
+
+class _Watcher(threading.Thread):
+    """
+    Thread following the telemetry log, and reporting our progress
+    """
+    def __init__(self, lconf, progress):
+        super(_Watcher, self).__init__()
+        self.daemon = True
+        self._lconf = lconf
+        self._progress = progress
+        self._path = telemetry_path(lconf)
+        self._offset = fp.getsize(self._path) if fp.exists(self._path)\
+            else 0
+        self._buffer = ''
+        self._printed = 0.
+        self._halt = threading.Event()
+
+    def _read(self):
+        "take in any new telemetry records"
+        if not fp.exists(self._path):
+            return
+        with open(self._path) as stream:
+            stream.seek(self._offset)
+            chunk = stream.read()
+            self._offset = stream.tell()
+        lines = (self._buffer + chunk).split('\n')
+        self._buffer = lines.pop()  # incomplete (or empty) last line
+        for line in lines:
+            try:
+                self._progress.update(json.loads(line))
+            except (ValueError, KeyError):
+                continue
+
+    def report(self, force=False):
+        "print a progress line (if it is time) and update the status"
+        now = time.time()
+        if force or now - self._printed >= PRINT_SECS:
+            print(show_progress(self._progress, now), file=sys.stderr)
+            self._printed = now
+        path = status_path(self._lconf)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as stream:
+            print(show_status(self._progress, status_label(self._lconf),
+                              now), file=stream)
+        os.rename(tmp_path, path)
+
+    def run(self):
+        while not self._halt.wait(_POLL_SECS):
+            self._read()
+            self.report()
+
+    def stop(self):
+        "stop following the log, and give a final report"
+        self._halt.set()
+        self.join()
+        self._read()
+        self.report(force=True)
+
+
+@contextmanager
+def tracking(lconf, folds, fold_reports=True):
+    """
+    Report our progress through the folds and/or combined models
+    this run is doing (according to its stage; the fold reports
+    unless we are leaving them to the end stage) ::
+
+        with tracking(lconf, foldset):
+            ...
+    """
+    if lconf.stage not in [None, ClusterStage.main,
+                           ClusterStage.combined_models]:
+        yield
+        return
+    if lconf.stage == ClusterStage.combined_models:
+        folds = []
+    tasks = plan_tasks(lconf, sorted(folds),
+                       combined=lconf.stage != ClusterStage.main,
+                       fold_reports=fold_reports)
+    records, _ = past_telemetry(lconf)
+    planned = cost_tasks(tasks, expected_costs(records or []))
+    watcher = _Watcher(lconf, Progress(planned, RUN_ID))
+    watcher.start()
+    try:
+        yield
+    finally:
+        watcher.stop()
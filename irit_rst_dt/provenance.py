@@ -0,0 +1,111 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Incremental file digests
+
+A manifest records the digest of each file we have hashed along
+with the (size, mtime, device, inode) it had at the time. Files
+that have not changed since are not read again; hard links to a
+file we have already hashed are not read either.
+
+Manifests are only ever a cache: two processes saving the same
+manifest at once may lose each other's entries, but never corrupt
+the file (we save through an atomic rename). For that reason, the
+resume logic (which models and decodings we still need) does not
+rely on them; it only checks whether the outputs exist.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import json
+import os
+
+from joblib import (Parallel, delayed)
+
+from .util import (digest_file)
+
+
+def _stamp(path):
+    "what we expect to stay the same if a file has not changed"
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime, stat.st_dev, stat.st_ino]
+
+
+class Manifest(object):
+    """
+    Digests (and stat info) for a set of files, persisted as JSON
+    """
+    def __init__(self, path, algo='md5'):
+        self.path = path
+        self.algo = algo
+        self._entries = {}
+        if fp.exists(path):
+            with open(path) as stream:
+                self._entries = json.load(stream)
+
+    def _lookup(self, apath, stamp, by_inode):
+        """
+        Digest for a file if we already know it (either from the
+        same path or from a hard link to it), else None
+        """
+        entry = self._entries.get(apath)
+        if entry is None or entry['stamp'] != stamp:
+            entry = by_inode.get(tuple(stamp))
+        if entry is not None and entry['algo'] == self.algo:
+            return entry['digest']
+        else:
+            return None
+
+    def update(self, paths, n_jobs=-1):
+        """
+        Return the digest of each path, hashing only the files
+        that have changed since we last saw them (in parallel
+        threads; digesting releases the GIL)
+
+        :rtype: dict(string, string)
+        """
+        by_inode = {tuple(e['stamp']): e for e in self._entries.values()}
+        digests = {}
+        stale = []
+        for path in paths:
+            apath = fp.abspath(path)
+            stamp = _stamp(apath)
+            digest = self._lookup(apath, stamp, by_inode)
+            if digest is None:
+                stale.append((path, apath, stamp))
+            else:
+                digests[path] = digest
+                self._entries[apath] = {'stamp': stamp,
+                                        'algo': self.algo,
+                                        'digest': digest}
+
+        if stale:
+            # hard links among the stale files only need hashing once
+            todo = {}
+            for _, apath, stamp in stale:
+                todo.setdefault(tuple(stamp), apath)
+            keys = list(todo)
+            fresh = Parallel(n_jobs=n_jobs or 1, backend='threading')(
+                delayed(digest_file)(todo[k], self.algo) for k in keys)
+            fresh = dict(zip(keys, fresh))
+            for path, apath, stamp in stale:
+                digest = fresh[tuple(stamp)]
+                digests[path] = digest
+                self._entries[apath] = {'stamp': stamp,
+                                        'algo': self.algo,
+                                        'digest': digest}
+        return digests
+
+    def save(self):
+        """
+        Write the manifest back to disk
+        """
+        parent = fp.dirname(self.path)
+        if parent and not fp.exists(parent):
+            os.makedirs(parent)
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as stream:
+            json.dump(self._entries, stream, indent=0, sort_keys=True)
+        os.rename(tmp_path, self.path)
@@ -8,88 +8,162 @@ Scoring and formatting results
 
 from __future__ import print_function
 from os import path as fp
-import codecs
 import glob
 import itertools as itr
 import shutil
 import sys
 
-from attelo.io import (load_model,
-                       load_predictions,
-                       load_vocab)
+from attelo.io import (load_predictions)
 from attelo.harness.report import (Slice, full_report)
 from attelo.harness.util import (makedirs)
-import attelo.score
-import attelo.report
 
+from .discr import (delayed_model_summaries)
 from .graph import (mk_graphs)
-from .learn import (LEARNERS)
-from .local import (DETAILED_EVALUATIONS,
-                    EVALUATIONS)
-from .path import (attelo_doc_model_paths,
-                   attelo_sent_model_paths,
-                   decode_output_path,
+from .local import (PROVENANCE_DIGEST)
+from .path import (decode_output_path,
                    eval_model_path,
                    features_path,
-                   model_info_path,
+                   manifest_path,
                    report_dir_basename,
-                   report_dir_path,
-                   vocab_path)
-from .util import (md5sum_file)
+                   report_dir_path)
+from .perf import (save_perf)
+from .precision import (mk_precision_report)
+from .profiling import (mk_profile_summary)
+from .provenance import (Manifest)
+from .selection import (detailed, learners)
+from .score import (confusion_matrix,
+                    doc_counts,
+                    gold_columns,
+                    load_columns)
+from .significance import (paired_bootstrap,
+                           show_matrix,
+                           stack_counts)
+from .stats import (load_confusion,
+                    load_stats,
+                    merge_confusion,
+                    merge_counts,
+                    save_stats,
+                    show_confusion,
+                    show_summary)
+from .supervise import (is_missing,
+                        load_missing)
+from .telemetry import (mk_telemetry_report,
+                        task,
+                        task_info)
+from .util import (parallel)
+
+
+def _econf_config(econf):
+    """
+    Configuration tuple by which an evaluation is reported
+    """
+    stripped_decoder_key = econf.decoder.key[len(econf.settings.key) + 1:]
+    return (econf.learner.key,
+            stripped_decoder_key,
+            econf.settings.key)
+
+
+def _is_missing(lconf, econf, fold):
+    "True if we gave up on decoding (or learning for) an evaluation"
+    return is_missing(decode_output_path(lconf, econf, fold))
 
 
 def _fold_report_slices(lconf, fold):
     """
     Report slices for a given fold
+
+    Only the detailed evaluations go through the full attelo
+    report (which needs the predictions as tuples); everything
+    is summarised from the per-fold statistics (see `_mk_summary`)
     """
-    print('Scoring fold {}...'.format(fold),
-          file=sys.stderr)
-    dkeys = [econf.key for econf in DETAILED_EVALUATIONS]
-    for econf in EVALUATIONS:
+    for econf in detailed(lconf.evaluations):
+        if _is_missing(lconf, econf, fold):
+            continue
         p_path = decode_output_path(lconf, econf, fold)
-        enable_details = econf.key in dkeys
-        stripped_decoder_key = econf.decoder.key[len(econf.settings.key) + 1:]
-        config = (econf.learner.key,
-                  stripped_decoder_key,
-                  econf.settings.key)
-        yield Slice(fold, config,
+        yield Slice(fold, _econf_config(econf),
                     load_predictions(p_path),
-                    enable_details)
-
-
-def _mk_model_summary(lconf, dconf, rconf, fold):
-    "generate summary of best model features"
-    _top_n = 3
-
-    def _write_discr(discr, intra):
-        "write discriminating features to disk"
-        if discr is None:
-            print(('No discriminating features for {name} {grain} model'
-                   '').format(name=rconf.key,
-                              grain='sent' if intra else 'doc'),
-                  file=sys.stderr)
-            return
-        output = model_info_path(lconf, rconf, fold, intra)
-        with codecs.open(output, 'wb', 'utf-8') as fout:
-            print(attelo.report.show_discriminating_features(discr),
-                  file=fout)
-
-    labels = dconf.pack.labels
-    vocab = load_vocab(vocab_path(lconf))
-    # doc level discriminating features
-    if True:
-        models = attelo_doc_model_paths(lconf, rconf, fold).fmap(load_model)
-        discr = attelo.score.discriminating_features(models, labels, vocab,
-                                                     _top_n)
-        _write_discr(discr, False)
-
-    # sentence-level
-    spaths = attelo_sent_model_paths(lconf, rconf, fold)
-    if fp.exists(spaths.attach) and fp.exists(spaths.relate):
-        models = spaths.fmap(load_model)
-        discr = attelo.score.discriminating_features(models, labels, vocab,
-                                                     _top_n)
-        _write_discr(discr, True)
+                    True)
+
+
+def _mk_fold_stats(lconf, dconf, fold):
+    """
+    Score every configuration in a fold, saving the per-document
+    counts and the confusion matrix for later merging
+    """
+    print('Scoring fold {}...'.format(fold),
+          file=sys.stderr)
+    gold = gold_columns(dconf.pack.testing(dconf.folds, fold))
+    for econf in lconf.evaluations:
+        if _is_missing(lconf, econf, fold):
+            continue
+        pred = load_columns(gold, decode_output_path(lconf, econf, fold))
+        save_stats(lconf, econf, fold, _econf_config(econf),
+                   doc_counts(gold, pred),
+                   (gold.labels, confusion_matrix(gold, pred)))
+
+
+def _mk_summary(lconf, dconf, fold):
+    """
+    Merge the per-fold statistics for all configurations into
+    a summary of attachment/labelling scores (across all folds
+    if fold is None); configurations we gave up on in any of the
+    folds are listed as missing
+    """
+    if fold is None:
+        folds = sorted(frozenset(dconf.folds.values()))
+    else:
+        folds = [fold]
+    for sfold in folds:
+        # eg. fold reports from an older harness
+        if any(load_confusion(lconf, e, sfold) is None
+               for e in lconf.evaluations
+               if not _is_missing(lconf, e, sfold)):
+            _mk_fold_stats(lconf, dconf, sfold)
+
+    rows = []
+    report_dir = report_dir_path(lconf, fold)
+    confusion_dir = fp.join(report_dir, 'confusion')
+    makedirs(confusion_dir)
+    for econf in lconf.evaluations:
+        if any(_is_missing(lconf, econf, f) for f in folds):
+            rows.append((_econf_config(econf), None))
+            continue
+        rows.append((_econf_config(econf),
+                     merge_counts(load_stats(lconf, econf, f)
+                                  for f in folds)))
+        labels, matrix = merge_confusion(load_confusion(lconf, econf, f)
+                                         for f in folds)
+        ofile = fp.join(confusion_dir, econf.key + '.txt')
+        with open(ofile, 'w') as stream:
+            print(show_confusion(labels, matrix), file=stream)
+    with open(fp.join(report_dir, 'scores-summary.txt'), 'w') as stream:
+        print(show_summary(rows), file=stream)
+
+
+def _mk_significance(lconf, dconf):
+    """
+    Paired bootstrap p-values between all configurations (over the
+    documents in all folds), for attachment and labelling; we leave
+    out the configurations that are missing in any of the folds
+    """
+    folds = sorted(frozenset(dconf.folds.values()))
+    names = []
+    per_config = []
+    for econf in lconf.evaluations:
+        if any(_is_missing(lconf, econf, f) for f in folds):
+            continue
+        counts = {}
+        for fold in folds:
+            counts.update(load_stats(lconf, econf, fold))
+        names.append(econf.key)
+        per_config.append(counts)
+    stats = stack_counts(per_config)
+    report_dir = report_dir_path(lconf, None)
+    for tpos_col, grain in [(0, 'attach'), (1, 'label')]:
+        observed, pvalues = paired_bootstrap(stats, tpos_col=tpos_col)
+        ofile = fp.join(report_dir, 'significance-{}.txt'.format(grain))
+        with open(ofile, 'w') as stream:
+            print(show_matrix(names, observed, pvalues), file=stream)
 
 
 def _mk_hashfile(lconf, dconf):
@@ -97,9 +171,12 @@ def _mk_hashfile(lconf, dconf):
 
     hash_me = [features_path(lconf)]
     for fold in sorted(frozenset(dconf.folds.values())):
-        for rconf in LEARNERS:
+        for rconf in learners(lconf.evaluations):
             models_path = eval_model_path(lconf, rconf, fold, '*')
             hash_me.extend(sorted(glob.glob(models_path + '*')))
+    manifest = Manifest(manifest_path(lconf), PROVENANCE_DIGEST)
+    digests = manifest.update(hash_me, n_jobs=lconf.n_jobs)
+    manifest.save()
     provenance_dir = fp.join(report_dir_path(lconf, None),
                              'provenance')
     makedirs(provenance_dir)
@@ -110,10 +187,35 @@ def _mk_hashfile(lconf, dconf):
                 nice_path = fp.join(fold_basename, fp.basename(path))
             else:
                 nice_path = fp.basename(path)
-            print('\t'.join([nice_path, md5sum_file(path)]),
+            digest = digests[path]
+            if PROVENANCE_DIGEST != 'md5':
+                digest = PROVENANCE_DIGEST + ':' + digest
+            print('\t'.join([nice_path, digest]),
                   file=stream)
 
 
+def _mk_missing_report(lconf, dconf):
+    """
+    List the evaluations we gave up on in some fold (and why), if
+    there are any
+    """
+    lines = []
+    for econf in lconf.evaluations:
+        for fold in sorted(frozenset(dconf.folds.values())):
+            missing = load_missing(decode_output_path(lconf, econf, fold))
+            if missing is not None:
+                lines.append('\t'.join([econf.key, str(fold),
+                                        missing['reason']]))
+    if not lines:
+        return
+    print('{} missing evaluation/fold cells (see missing.txt in the '
+          'report)'.format(len(lines)), file=sys.stderr)
+    ofile = fp.join(report_dir_path(lconf, None), 'missing.txt')
+    with open(ofile, 'w') as stream:
+        print('\t'.join(['key', 'fold', 'reason']), file=stream)
+        print('\n'.join(lines), file=stream)
+
+
 def _copy_version_files(lconf):
     "Hash the features and models files for long term archiving"
     provenance_dir = fp.join(report_dir_path(lconf, None),
@@ -124,40 +226,72 @@ def _copy_version_files(lconf):
         shutil.copy(vpath, provenance_dir)
 
 
-def _mk_report(lconf, dconf, slices, fold):
-    """helper for report generation
-
-    :type fold: int or None
+def _mk_model_summaries(lconf, dconf, fold):
     """
-    rpack = full_report(dconf.pack, dconf.folds, slices)
-    rpack.dump(report_dir_path(lconf, fold))
-    for rconf in LEARNERS:
+    Generate summaries of the best model features for all of
+    our (non-oracle) learners
+    """
+    rconfs = []
+    for rconf in learners(lconf.evaluations):
         if rconf.attach.payload == 'oracle':
             pass
         elif rconf.relate is not None and rconf.relate.payload == 'oracle':
             pass
         else:
-            _mk_model_summary(lconf, dconf, rconf, fold)
+            rconfs.append(rconf)
+    jobs = delayed_model_summaries(lconf, rconfs, fold, dconf.pack.labels)
+    parallel(lconf)(jobs)
+
+
+def _mk_report(lconf, dconf, slices, fold):
+    """helper for report generation
+
+    :type fold: int or None
+    """
+    slices = list(slices)
+    if slices:
+        with task(lconf, task_info('report', 'full-report', fold)):
+            rpack = full_report(dconf.pack, dconf.folds, slices)
+            rpack.dump(report_dir_path(lconf, fold))
+    with task(lconf, task_info('discr', 'model-summaries', fold)):
+        _mk_model_summaries(lconf, dconf, fold)
 
 
 def mk_fold_report(lconf, dconf, fold):
     "Generate reports for the given fold"
-    slices = _fold_report_slices(lconf, fold)
-    _mk_report(lconf, dconf, slices, fold)
+    with task(lconf, task_info('score', 'fold-stats', fold)):
+        _mk_fold_stats(lconf, dconf, fold)
+    _mk_report(lconf, dconf, _fold_report_slices(lconf, fold), fold)
+    with task(lconf, task_info('report', 'summary', fold)):
+        _mk_summary(lconf, dconf, fold)
 
 
 def mk_global_report(lconf, dconf):
-    "Generate reports for all folds"
+    """
+    Generate reports for all folds (merging the per-fold statistics;
+    only the detailed evaluations have their predictions reloaded)
+    """
     slices = itr.chain.from_iterable(_fold_report_slices(lconf, f)
                                      for f in frozenset(dconf.folds.values()))
     _mk_report(lconf, dconf, slices, None)
+    with task(lconf, task_info('report', 'summary')):
+        _mk_summary(lconf, dconf, None)
+    with task(lconf, task_info('report', 'significance')):
+        _mk_significance(lconf, dconf)
+    _mk_missing_report(lconf, dconf)
+    mk_precision_report(lconf, report_dir_path(lconf, None))
     _copy_version_files(lconf)
 
     report_dir = report_dir_path(lconf, None)
     final_report_dir = fp.join(lconf.eval_dir,
                                report_dir_basename(lconf))
-    mk_graphs(lconf, dconf)
-    _mk_hashfile(lconf, dconf)
+    with task(lconf, task_info('graph', 'graphs')):
+        mk_graphs(lconf, dconf)
+    with task(lconf, task_info('provenance', 'hashes')):
+        _mk_hashfile(lconf, dconf)
+    mk_telemetry_report(lconf, fp.join(report_dir, 'telemetry.txt'))
+    save_perf(lconf, fp.join(report_dir, 'perf.json'))
+    mk_profile_summary(lconf, fp.join(report_dir, 'profile-summary.txt'))
     if fp.exists(final_report_dir):
         shutil.rmtree(final_report_dir)
     shutil.copytree(report_dir, final_report_dir)
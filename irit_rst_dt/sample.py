@@ -0,0 +1,240 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Representative document samples (for quick iterations)
+
+A sample is drawn in equal-count strata of document size (number
+of EDUs), in proportion to the size of each stratum. Within a
+stratum we pick documents in a seeded random order, but prefer
+(among a handful of random candidates) whichever keeps the
+relation label distribution of the sample closest to that of the
+whole corpus.
+
+Runtime estimates for the full corpus assume that learning and
+decoding costs are linear in the number of instances (EDU pairs)
+involved; they are meant as a rough guide, not a promise.
+"""
+
+from __future__ import print_function
+from collections import (Counter, namedtuple)
+from os import path as fp
+import codecs
+import glob
+import json
+import os
+import random
+import re
+
+# pylint: disable=too-few-public-methods
+
+_N_BINS = 4
+"Number of document size strata"
+
+_N_CANDIDATES = 5
+"Number of random candidates to weigh against each other at each step"
+
+_REL2PAR = re.compile(r'\(rel2par ([^\s)]+)\)')
+
+SampleConfig = namedtuple('SampleConfig', ['size', 'seed', 'folds'])
+"How big a sample to draw, with what seed, over how many folds"
+
+DocProfile = namedtuple('DocProfile', ['doc', 'size', 'labels'])
+"""
+What we stratify a document on: its number of EDUs, and its
+relation label counts (a `Counter`)
+"""
+
+
+# ---------------------------------------------------------------------
+# profiles
+# ---------------------------------------------------------------------
+
+
+def _count_lines(path):
+    "number of non-blank lines in a file"
+    with codecs.open(path, 'r', 'utf-8') as stream:
+        return sum(1 for line in stream if line.strip())
+
+
+def corpus_profiles(corpus_dir):
+    """
+    Document profiles for an RST-DT style corpus directory
+    (`.dis` trees, with `.edus` files next to them)
+
+    :rtype: [DocProfile]
+    """
+    profiles = []
+    for dis_path in sorted(glob.glob(fp.join(corpus_dir, '*.dis'))):
+        doc = fp.splitext(fp.basename(dis_path))[0]
+        with codecs.open(dis_path, 'r', 'utf-8') as stream:
+            text = stream.read()
+        labels = Counter(l for l in _REL2PAR.findall(text) if l != 'span')
+        edus_path = fp.splitext(dis_path)[0] + '.edus'
+        size = _count_lines(edus_path) if fp.exists(edus_path)\
+            else text.count('(leaf ')
+        profiles.append(DocProfile(doc, size, labels))
+    return profiles
+
+
+def pack_profiles(dpack, unrelated):
+    """
+    Document profiles for a data pack (only needs the gold
+    structure)
+
+    :param unrelated: label for unattached pairs
+    :rtype: [DocProfile]
+    """
+    sizes = Counter(e.grouping for e in dpack.edus
+                    if e.grouping is not None)
+    labels = {doc: Counter() for doc in sizes}
+    for (_, edu2), tgt in zip(dpack.pairings, dpack.target):
+        label = dpack.get_label(tgt)
+        if label != unrelated and edu2.grouping in labels:
+            labels[edu2.grouping][label] += 1
+    return [DocProfile(d, sizes[d], labels[d]) for d in sorted(sizes)]
+
+
+# ---------------------------------------------------------------------
+# sampling
+# ---------------------------------------------------------------------
+
+
+def _distribution(counts):
+    "normalised version of a label counter"
+    total = float(sum(counts.values())) or 1.
+    return {k: v / total for k, v in counts.items()}
+
+
+def _distance(counts, target):
+    "L1 distance between label counts and a target distribution"
+    dist = _distribution(counts)
+    return sum(abs(dist.get(k, 0.) - target.get(k, 0.))
+               for k in set(dist) | set(target))
+
+
+def _allocate(size, bin_sizes):
+    """
+    Split a sample size across strata in proportion to their
+    sizes (largest remainder)
+    """
+    total = float(sum(bin_sizes))
+    exact = [size * n / total for n in bin_sizes]
+    quotas = [int(x) for x in exact]
+    by_remainder = sorted(range(len(exact)),
+                          key=lambda i: quotas[i] - exact[i])
+    for i in by_remainder[:size - sum(quotas)]:
+        quotas[i] += 1
+    return quotas
+
+
+def stratified_sample(profiles, size, seed):
+    """
+    Names of a stratified sample of documents
+
+    :type profiles: [DocProfile]
+    :rtype: [string]
+    """
+    if size >= len(profiles):
+        return sorted(p.doc for p in profiles)
+    rng = random.Random(seed)
+    profiles = sorted(profiles, key=lambda p: (p.size, p.doc))
+    n_bins = max(1, min(_N_BINS, size))
+    bins = [profiles[i * len(profiles) // n_bins:
+                     (i + 1) * len(profiles) // n_bins]
+            for i in range(n_bins)]
+    target = _distribution(sum((p.labels for p in profiles), Counter()))
+    chosen = []
+    counts = Counter()
+    for pool, quota in zip(bins, _allocate(size, [len(b) for b in bins])):
+        pool = list(pool)
+        rng.shuffle(pool)
+        for _ in range(quota):
+            best = min(pool[:_N_CANDIDATES],
+                       key=lambda p: _distance(counts + p.labels, target))
+            pool.remove(best)
+            chosen.append(best.doc)
+            counts += best.labels
+    return sorted(chosen)
+
+
+def link_corpus(corpus_dir, docs, sample_dir):
+    """
+    Populate a sample corpus directory with symlinks to the files
+    for the given documents
+    """
+    if not fp.exists(sample_dir):
+        os.makedirs(sample_dir)
+    for doc in docs:
+        doc_files = glob.glob(fp.join(corpus_dir, doc)) +\
+            glob.glob(fp.join(corpus_dir, doc + '.*'))
+        for path in doc_files:
+            link = fp.join(sample_dir, fp.basename(path))
+            if not fp.lexists(link):
+                os.symlink(fp.abspath(path), link)
+
+
+def sample_pack(dpack, docs):
+    """
+    The part of a data pack that concerns the given documents
+    """
+    docs = frozenset(docs)
+    idxes = [i for i, (_, edu2) in enumerate(dpack.pairings)
+             if edu2.grouping in docs]
+    return dpack.selected(idxes)
+
+
+def save_sample(path, blob):
+    "Save a description of a sample (a dictionary) as JSON"
+    with open(path, 'w') as stream:
+        json.dump(blob, stream, indent=2, sort_keys=True)
+
+
+def load_sample(path):
+    "Load a sample description (None if there isn't one)"
+    if not fp.exists(path):
+        return None
+    with open(path) as stream:
+        return json.load(stream)
+
+
+# ---------------------------------------------------------------------
+# estimates
+# ---------------------------------------------------------------------
+
+
+def estimate_runtime(timings, full_instances, full_folds):
+    """
+    Estimated learning and decoding time (seconds) for a full
+    evaluation (cross-validation plus combined models), given
+    the timings measured on a sample
+
+    :param timings: per-fold dictionaries with the `learn` and
+                    `decode` time, and the number of `training`
+                    and `testing` instances
+    :rtype: (float, float)
+    """
+    def _rate(secs_key, n_key):
+        "seconds per instance"
+        total = sum(t[n_key] for t in timings)
+        return sum(t[secs_key] for t in timings) / total if total else 0.
+
+    # n-fold training sees each instance n-1 times, plus once more
+    # for the combined models; decoding sees each instance once
+    learn = _rate('learn', 'training') * full_instances * full_folds
+    decode = _rate('decode', 'testing') * full_instances
+    return learn, decode
+
+
+def show_duration(secs):
+    "human-friendly rendering of a duration"
+    secs = int(round(secs))
+    hours, rest = divmod(secs, 3600)
+    mins, secs = divmod(rest, 60)
+    if hours:
+        return '{}h{:02d}m'.format(hours, mins)
+    elif mins:
+        return '{}m{:02d}s'.format(mins, secs)
+    else:
+        return '{}s'.format(secs)
@@ -0,0 +1,208 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Vectorised scoring over columnar predictions
+
+Rather than comparing lists of `(id1, id2, label)` tuples, we
+line the predictions up against the gold pairings of a fold as
+integer arrays (one row per candidate pair, label codes as
+values) and do the counting with numpy. The counts are those of
+`attelo.score.score_edges`, and the confusion matrices those of
+`attelo.score.build_confusion_matrix`.
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+import codecs
+
+import numpy as np
+
+from attelo.table import (UNRELATED)
+
+from .stats import (Counts)
+
+# pylint: disable=too-few-public-methods
+
+
+GoldColumns = namedtuple('GoldColumns',
+                         ['index',
+                          'edu_docs',
+                          'docs',
+                          'doc',
+                          'target',
+                          'labels',
+                          'unrelated'])
+"""
+Gold standard for a datapack in columnar form
+
+* index: dict from (id1, id2) to row number
+* edu_docs: dict from EDU id to document number
+* docs: document names (`docs[doc[i]]` is the doc of row i)
+* doc: document number for each row
+* target: gold label code for each row
+* labels: label names (`labels[target[i]]` is the label of row i)
+* unrelated: code for the unrelated label
+"""
+
+
+PredColumns = namedtuple('PredColumns',
+                         ['target',
+                          'extra_docs'])
+"""
+Predictions aligned against some `GoldColumns`
+
+* target: predicted label code for each gold row (unrelated
+  if the row was not predicted)
+* extra_docs: document numbers for any predicted attachments
+  which were not among the candidate pairings
+"""
+
+
+def gold_columns(dpack):
+    """
+    Line up the gold standard for a datapack as columns
+
+    :rtype: GoldColumns
+    """
+    labels = list(dpack.labels)
+    if UNRELATED not in labels:
+        labels.append(UNRELATED)
+    codes = {l: i for i, l in enumerate(labels)}
+
+    index = {}
+    edu_docs = {}
+    doc_codes = {}
+    doc = np.empty(len(dpack.pairings), dtype=np.int32)
+    for i, (edu1, edu2) in enumerate(dpack.pairings):
+        index[(edu1.id, edu2.id)] = i
+        dnum = doc_codes.setdefault(edu2.grouping, len(doc_codes))
+        edu_docs[edu2.id] = dnum
+        edu_docs.setdefault(edu1.id, dnum)
+        doc[i] = dnum
+    docs = [None] * len(doc_codes)
+    for name, dnum in doc_codes.items():
+        docs[dnum] = name
+
+    # only look up the label names for distinct target values
+    uniq, inverse = np.unique(np.asarray(dpack.target), return_inverse=True)
+    lookup = np.array([codes[dpack.get_label(t)] for t in uniq],
+                      dtype=np.int32)
+    target = lookup[inverse] if len(uniq) else np.empty(0, dtype=np.int32)
+    return GoldColumns(index=index,
+                       edu_docs=edu_docs,
+                       docs=docs,
+                       doc=doc,
+                       target=target,
+                       labels=labels,
+                       unrelated=codes[UNRELATED])
+
+
+def align_predictions(gold, predictions):
+    """
+    Line up predictions (an iterable of `(id1, id2, label)`)
+    against the gold columns
+
+    :rtype: PredColumns
+    """
+    codes = {l: i for i, l in enumerate(gold.labels)}
+    target = np.empty_like(gold.target)
+    target.fill(gold.unrelated)
+    rows = []
+    row_codes = []
+    extra_docs = []
+    for id1, id2, label in predictions:
+        if label == UNRELATED:
+            continue
+        row = gold.index.get((id1, id2))
+        if row is None:
+            dnum = gold.edu_docs.get(id2)
+            if dnum is not None:
+                extra_docs.append(dnum)
+            continue
+        rows.append(row)
+        # labels we've never seen before can never be right,
+        # so any code other than unrelated and the gold ones will do
+        row_codes.append(codes.get(label, len(codes)))
+    if rows:
+        target[np.array(rows)] = np.array(row_codes, dtype=target.dtype)
+    return PredColumns(target=target,
+                       extra_docs=np.array(extra_docs, dtype=np.int32))
+
+
+def _read_predictions(path):
+    """
+    Stream `(id1, id2, label)` triples from an attelo output file
+    """
+    with codecs.open(path, 'r', 'utf-8') as stream:
+        for line in stream:
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) >= 3:
+                yield fields[0], fields[1], fields[2]
+
+
+def load_columns(gold, path):
+    """
+    Read an attelo output file straight into columns
+
+    :rtype: PredColumns
+    """
+    return align_predictions(gold, _read_predictions(path))
+
+
+def _count_arrays(gold, pred):
+    """
+    Per-document counts as four integer arrays (tpos_attach,
+    tpos_label, predicted, gold), indexed by document number
+    """
+    ndocs = len(gold.docs)
+    is_gold = gold.target != gold.unrelated
+    is_pred = pred.target != gold.unrelated
+    tpos_attach = is_gold & is_pred
+    tpos_label = tpos_attach & (gold.target == pred.target)
+
+    def _per_doc(mask):
+        "count of true values in each document"
+        return np.bincount(gold.doc[mask], minlength=ndocs)
+
+    n_pred = _per_doc(is_pred)
+    if len(pred.extra_docs):
+        n_pred = n_pred + np.bincount(pred.extra_docs, minlength=ndocs)
+    return (_per_doc(tpos_attach),
+            _per_doc(tpos_label),
+            n_pred,
+            _per_doc(is_gold))
+
+
+def doc_counts(gold, pred):
+    """
+    Per-document counts for the predictions
+
+    :rtype: dict(string, Counts)
+    """
+    arrays = _count_arrays(gold, pred)
+    return {name: Counts(*[int(a[i]) for a in arrays])
+            for i, name in enumerate(gold.docs)}
+
+
+def total_counts(gold, pred):
+    """
+    Counts over all documents
+
+    :rtype: Counts
+    """
+    return Counts(*[int(a.sum()) for a in _count_arrays(gold, pred)])
+
+
+def confusion_matrix(gold, pred):
+    """
+    Label confusion matrix over all candidate pairs (rows are gold
+    labels, columns predicted labels, in the order of `gold.labels`;
+    predicted labels we have never seen are left out)
+    """
+    nlabels = len(gold.labels)
+    mask = pred.target < nlabels
+    flat = gold.target[mask] * nlabels + pred.target[mask]
+    return np.bincount(flat, minlength=nlabels * nlabels)\
+        .reshape(nlabels, nlabels)
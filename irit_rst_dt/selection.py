@@ -0,0 +1,171 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Selecting a subset of the evaluations to run
+
+Patterns are of the form `FIELD:GLOB` where the field is one of
+`learner`, `decoder` (the core decoder, eg. `mst`), `settings` or
+`key` (the whole evaluation key); a bare `GLOB` is matched against
+the evaluation key. An evaluation is selected if, for each field
+that has include patterns, it matches at least one of them, and it
+matches none of the exclude patterns.
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+from fnmatch import fnmatch
+from os import path as fp
+import json
+import sys
+
+from .local import (DETAILED_EVALUATIONS,
+                    EVALUATIONS)
+from .path import (attelo_doc_model_paths,
+                   attelo_sent_model_paths,
+                   decode_output_path)
+
+FIELDS = ['learner', 'decoder', 'settings', 'key']
+
+Selection = namedtuple('Selection', ['include', 'exclude'])
+"include and exclude patterns"
+
+
+def _parse(pattern):
+    "(field, glob) for a pattern"
+    field, sep, glob = pattern.partition(':')
+    if sep and field in FIELDS:
+        return field, glob
+    else:
+        return 'key', pattern
+
+
+def check_pattern(pattern):
+    """
+    Return the pattern if it is well-formed (for use as an
+    argparse type)
+    """
+    field, sep, _ = pattern.partition(':')
+    if sep and field not in FIELDS:
+        raise ValueError('Unknown field {} (should be one of {})'
+                         ''.format(field, ', '.join(FIELDS)))
+    return pattern
+
+
+def _fields(econf):
+    "the fields of an evaluation that patterns can refer to"
+    return {'learner': econf.learner.key,
+            'decoder': econf.decoder.key[len(econf.settings.key) + 1:],
+            'settings': econf.settings.key,
+            'key': econf.key}
+
+
+def _matches(econf, selection):
+    "true if the evaluation is selected"
+    fields = _fields(econf)
+    by_field = {}
+    for field, glob in (_parse(p) for p in selection.include):
+        by_field.setdefault(field, []).append(glob)
+    for field, globs in by_field.items():
+        if not any(fnmatch(fields[field], g) for g in globs):
+            return False
+    for field, glob in (_parse(p) for p in selection.exclude):
+        if fnmatch(fields[field], glob):
+            return False
+    return True
+
+
+def select_evaluations(selection):
+    """
+    The evaluations picked out by a selection (all of them
+    if the selection is None or empty)
+    """
+    if selection is None:
+        return list(EVALUATIONS)
+    return [e for e in EVALUATIONS if _matches(e, selection)]
+
+
+def save_selection(path, selection):
+    "Save a selection to disk (so that later stages can reuse it)"
+    with open(path, 'w') as stream:
+        json.dump(selection._asdict(), stream, indent=2)
+
+
+def load_selection(path):
+    "Load a selection from disk (None if there isn't one)"
+    if not fp.exists(path):
+        return None
+    with open(path) as stream:
+        blob = json.load(stream)
+    return Selection(include=blob['include'], exclude=blob['exclude'])
+
+
+# ---------------------------------------------------------------------
+# what the selected evaluations need
+# ---------------------------------------------------------------------
+
+
+def learners(evaluations):
+    """
+    The learners used by a set of evaluations (without repeats)
+    """
+    res = {}
+    for econf in evaluations:
+        res.setdefault(econf.learner.key, econf.learner)
+    return [res[k] for k in sorted(res)]
+
+
+def needs_intra(evaluations, rconf=None):
+    """
+    True if any of the evaluations (for the given learner, if
+    any) need sentence-level models
+    """
+    return any(e.settings.intra is not None for e in evaluations
+               if rconf is None or e.learner.key == rconf.key)
+
+
+def detailed(evaluations):
+    """
+    The detailed evaluations among a set of evaluations
+    """
+    keys = frozenset(e.key for e in evaluations)
+    return [e for e in DETAILED_EVALUATIONS if e.key in keys]
+
+
+def _missing_models(lconf, rconf, fold, intra):
+    "number of (non-oracle) model files we have yet to learn"
+    paths = [attelo_doc_model_paths(lconf, rconf, fold)]
+    if intra:
+        paths.append(attelo_sent_model_paths(lconf, rconf, fold))
+    return sum(1 for team in paths for path in team
+               if path != 'oracle' and not fp.exists(path))
+
+
+def show_plan(lconf, folds, combined=False):
+    """
+    Summarise the work we need to do for the selected evaluations
+    over the given folds (and/or the combined models)
+    """
+    evaluations = lconf.evaluations
+    rconfs = learners(evaluations)
+    n_models = 0
+    n_decodes = 0
+    for fold in folds:
+        for rconf in rconfs:
+            n_models += _missing_models(lconf, rconf, fold,
+                                        needs_intra(evaluations, rconf))
+        n_decodes += sum(1 for e in evaluations
+                         if not fp.exists(decode_output_path(lconf, e,
+                                                             fold)))
+    if combined:
+        for rconf in rconfs:
+            n_models += _missing_models(lconf, rconf, None,
+                                        needs_intra(evaluations, rconf))
+    lines = ['Plan: {} of {} evaluations, {} learners'
+             ''.format(len(evaluations), len(EVALUATIONS), len(rconfs)),
+             '      {} models to learn, {} decodes to run '
+             '(over {} folds{})'
+             ''.format(n_models, n_decodes, len(folds),
+                       ' and combined models' if combined else '')]
+    print('\n'.join(lines), file=sys.stderr)
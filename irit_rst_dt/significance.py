@@ -0,0 +1,125 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Paired bootstrap significance tests between configurations
+
+We resample documents (with replacement) and recompute the
+f-scores of every configuration on each resample. Rather than
+looping over resamples in Python, we draw all resamples at once
+as a matrix of document multiplicities, so that the sufficient
+statistics for every resample and configuration come out of a
+single matrix product.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+# pylint: disable=too-few-public-methods
+
+DEFAULT_SAMPLES = 1000
+"Number of bootstrap resamples"
+
+DEFAULT_SEED = 20150401
+"Fixed seed for resampling, so reports are reproducible"
+
+_CHUNK_SIZE = 250
+"Number of resamples to hold in memory at any one time"
+
+
+def stack_counts(per_config_counts):
+    """
+    Arrange per-document counts for several configurations into a
+    single array of shape (configs, docs, 4), lining up documents
+    across configurations (missing documents count as zero)
+
+    :type per_config_counts: [dict(string, Counts)]
+    """
+    docs = sorted(frozenset(d for c in per_config_counts for d in c))
+    doc_index = {d: i for i, d in enumerate(docs)}
+    stats = np.zeros((len(per_config_counts), len(docs), 4),
+                     dtype=np.int64)
+    for cnum, counts in enumerate(per_config_counts):
+        for doc, dcounts in counts.items():
+            stats[cnum, doc_index[doc]] = dcounts
+    return stats
+
+
+def _fscores(sums, tpos_col):
+    """
+    F-scores from summed counts of shape (..., 4), using
+    2 tp / (predicted + gold), zero where undefined
+    """
+    tpos = sums[..., tpos_col].astype(np.float64)
+    denom = (sums[..., 2] + sums[..., 3]).astype(np.float64)
+    res = np.zeros_like(denom)
+    np.divide(2 * tpos, denom, out=res, where=denom > 0)
+    return res
+
+
+def _resample_weights(rng, n_samples, n_docs):
+    """
+    A (n_samples, n_docs) matrix whose rows give the number of
+    times each document is drawn in a resample
+    """
+    draws = rng.randint(0, n_docs, size=(n_samples, n_docs))
+    draws += (np.arange(n_samples) * n_docs)[:, np.newaxis]
+    return np.bincount(draws.ravel(), minlength=n_samples * n_docs)\
+        .reshape(n_samples, n_docs)
+
+
+def paired_bootstrap(stats, tpos_col=0,
+                     n_samples=DEFAULT_SAMPLES,
+                     seed=DEFAULT_SEED):
+    """
+    Two-sided p-values for the difference in f-score between all
+    pairs of configurations
+
+    `p[i, j]` estimates the probability of seeing a difference at
+    least as large as the observed `f[i] - f[j]` if the two configs
+    were equally good. We use the usual shifted-distribution trick
+    (count resamples where the difference strays from the observed
+    one by at least as much as the observed one strays from zero).
+
+    :param stats: per-document counts (see `stack_counts`)
+    :param tpos_col: 0 for attachment, 1 for labelling
+    :rtype: (array, array) -- observed f-scores, p-value matrix
+    """
+    n_configs, n_docs = stats.shape[:2]
+    observed = _fscores(stats.sum(axis=1), tpos_col)
+    obs_delta = observed[:, np.newaxis] - observed[np.newaxis, :]
+    if n_docs == 0:
+        return observed, np.ones((n_configs, n_configs))
+
+    rng = np.random.RandomState(seed)
+    # (docs, configs * 4) so we can sum all configs in one product
+    flat_stats = stats.transpose(1, 0, 2).reshape(n_docs, n_configs * 4)
+    exceed = np.zeros((n_configs, n_configs), dtype=np.int64)
+    done = 0
+    while done < n_samples:
+        chunk = min(_CHUNK_SIZE, n_samples - done)
+        weights = _resample_weights(rng, chunk, n_docs)
+        sums = weights.dot(flat_stats).reshape(chunk, n_configs, 4)
+        fscores = _fscores(sums, tpos_col)
+        deltas = fscores[:, :, np.newaxis] - fscores[:, np.newaxis, :]
+        exceed += (np.abs(deltas - obs_delta) >=
+                   np.abs(obs_delta) - 1e-12).sum(axis=0)
+        done += chunk
+    pvalues = (exceed + 1.) / (n_samples + 1.)
+    np.fill_diagonal(pvalues, 1.)
+    return observed, pvalues
+
+
+def show_matrix(names, observed, pvalues):
+    """
+    Tab-separated p-value matrix, one row/column per configuration
+    (rows also give the observed f-score)
+    """
+    lines = ['\t'.join(['config', 'fscore'] + list(names))]
+    for name, fscore, row in zip(names, observed, pvalues):
+        fields = [name, '{:.4f}'.format(fscore)]
+        fields.extend('{:.4f}'.format(p) for p in row)
+        lines.append('\t'.join(fields))
+    return '\n'.join(lines)
@@ -0,0 +1,202 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Sufficient statistics for scoring
+
+Each fold report saves, for each configuration, a small set of
+per-document counts (correct/predicted/gold attachments and labels).
+These are all we need to recompute attachment and labelling scores
+over any set of folds, so the global report can merge them instead
+of reloading and rescoring every prediction file. Label confusion
+matrices are saved along with them, and merge by adding up.
+"""
+
+from __future__ import print_function
+from collections import (namedtuple)
+from os import path as fp
+import json
+import os
+
+from attelo.harness.util import (makedirs)
+import numpy as np
+
+from .path import (fold_stats_path)
+
+# pylint: disable=too-few-public-methods
+
+
+class Counts(namedtuple('Counts',
+                        ['tpos_attach',
+                         'tpos_label',
+                         'predicted',
+                         'gold'])):
+    """
+    Edge counts for a document (or a set of documents)
+
+    * tpos_attach: predicted attachments that are in the gold
+    * tpos_label: as above, with the right label too
+    * predicted: number of predicted attachments
+    * gold: number of gold attachments
+    """
+    def __add__(self, other):
+        return Counts(*[a + b for a, b in zip(self, other)])
+
+    @classmethod
+    def zero(cls):
+        "counts for the empty set of documents"
+        return cls(0, 0, 0, 0)
+
+
+Scores = namedtuple('Scores',
+                    ['precision', 'recall', 'fscore'])
+"precision/recall/f-score triple"
+
+
+def _prf(tpos, predicted, gold):
+    "precision, recall, f-score from raw counts"
+    precision = float(tpos) / predicted if predicted else 0.
+    recall = float(tpos) / gold if gold else 0.
+    denom = precision + recall
+    fscore = 2 * precision * recall / denom if denom else 0.
+    return Scores(precision, recall, fscore)
+
+
+def attach_scores(counts):
+    "attachment scores for a set of counts"
+    return _prf(counts.tpos_attach, counts.predicted, counts.gold)
+
+
+def label_scores(counts):
+    "labelling scores for a set of counts"
+    return _prf(counts.tpos_label, counts.predicted, counts.gold)
+
+
+def save_stats(lconf, econf, fold, config, counts, confusion):
+    """
+    Save the per-document counts and the label confusion matrix
+    (a pair of label names and matrix) for a configuration within
+    a fold
+    """
+    path = fold_stats_path(lconf, econf, fold)
+    makedirs(fp.dirname(path))
+    tmp_path = path + '.tmp'
+    labels, matrix = confusion
+    with open(tmp_path, 'w') as stream:
+        json.dump({'fold': fold,
+                   'config': list(config),
+                   'docs': {k: list(v) for k, v in counts.items()},
+                   'labels': list(labels),
+                   'confusion': np.asarray(matrix).tolist()},
+                  stream)
+    os.rename(tmp_path, path)
+
+
+def _load_blob(lconf, econf, fold):
+    "the saved statistics for a configuration in a fold (or None)"
+    path = fold_stats_path(lconf, econf, fold)
+    if not fp.exists(path):
+        return None
+    with open(path) as stream:
+        return json.load(stream)
+
+
+def load_stats(lconf, econf, fold):
+    """
+    Return the per-document counts for a configuration within a
+    fold, or None if we don't have any saved
+
+    :rtype: dict(string, Counts) or None
+    """
+    blob = _load_blob(lconf, econf, fold)
+    if blob is None:
+        return None
+    return {k: Counts(*v) for k, v in blob['docs'].items()}
+
+
+def load_confusion(lconf, econf, fold):
+    """
+    Return the label confusion matrix for a configuration within a
+    fold, or None if we don't have one saved (eg. statistics from an
+    older harness)
+
+    :rtype: ([string], 2D int array) or None
+    """
+    blob = _load_blob(lconf, econf, fold)
+    if blob is None or 'confusion' not in blob:
+        return None
+    return blob['labels'], np.array(blob['confusion'], dtype=np.int64)
+
+
+def merge_confusion(confusions):
+    """
+    Add up an iterable of label confusion matrices over the same
+    labels
+
+    :type confusions: iterable(([string], 2D int array))
+    :rtype: ([string], 2D int array)
+    """
+    labels = None
+    total = None
+    for clabels, matrix in confusions:
+        if labels is None:
+            labels, total = clabels, matrix.copy()
+        elif clabels != labels:
+            raise ValueError('Cannot merge confusion matrices over '
+                             'different labels')
+        else:
+            total += matrix
+    return labels, total
+
+
+def merge_counts(per_doc_counts):
+    """
+    Merge an iterable of per-document count dictionaries into
+    a single total
+
+    :type per_doc_counts: iterable(dict(string, Counts))
+    :rtype: Counts
+    """
+    total = Counts.zero()
+    for counts in per_doc_counts:
+        for dcounts in counts.values():
+            total += dcounts
+    return total
+
+
+def show_summary(rows):
+    """
+    Return a tab-separated summary table for merged counts
+    (None for configurations that are missing)
+
+    :type rows: [((string, string, string), Counts)]
+    """
+    header = ['learner', 'decoder', 'settings',
+              'attach-P', 'attach-R', 'attach-F',
+              'label-P', 'label-R', 'label-F',
+              'n-predicted', 'n-gold']
+    lines = ['\t'.join(header)]
+    for config, counts in sorted(rows, key=lambda r: r[0]):
+        if counts is None:
+            lines.append('\t'.join(list(config) +
+                                   ['missing'] * (len(header) - 3)))
+            continue
+        ascores = attach_scores(counts)
+        lscores = label_scores(counts)
+        fields = list(config)
+        fields.extend('{:.4f}'.format(x) for x in ascores + lscores)
+        fields.extend([str(counts.predicted), str(counts.gold)])
+        lines.append('\t'.join(fields))
+    return '\n'.join(lines)
+
+
+def show_confusion(labels, matrix):
+    """
+    Return a tab-separated label confusion matrix (rows are the gold
+    labels, columns the predicted ones)
+    """
+    lines = ['\t'.join(['gold/predicted'] + list(labels))]
+    for label, row in zip(labels, matrix):
+        lines.append('\t'.join([label] + [str(x) for x in row]))
+    return '\n'.join(lines)
@@ -0,0 +1,159 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Document-indexed prediction store
+
+The decoder output files are plain text with no particular
+structure beyond one edge per line, so reading any one document
+means scanning the whole file. A prediction store holds the same
+edges as a sequence of compressed per-document blocks, along with
+a small JSON index giving the offset and size of each block. We
+can then pull out the edges for a single document with one seek
+and one read, or stream through the whole store a block at a time.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import codecs
+import json
+import os
+import zlib
+
+STORE_VERSION = 1
+
+
+def index_path(path):
+    "Path to the index for a prediction store"
+    return path + '.idx'
+
+
+def _encode(edges):
+    "compressed block for a list of edges"
+    text = u''.join(u'\t'.join(e) + u'\n' for e in edges)
+    return zlib.compress(text.encode('utf-8'))
+
+
+def _decode(block):
+    "edges in a compressed block"
+    text = zlib.decompress(block).decode('utf-8')
+    return [tuple(l.split(u'\t')) for l in text.split(u'\n') if l]
+
+
+def write_store(path, doc_edges):
+    """
+    Write a prediction store from an iterable of `(doc, edges)`
+    (a document may appear more than once; its blocks are read
+    back in the order they were written)
+
+    :type doc_edges: iterable((string, [(string, string, string)]))
+    """
+    index = {}
+    order = []
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as stream:
+        for doc, edges in doc_edges:
+            block = _encode(edges)
+            if doc not in index:
+                index[doc] = []
+                order.append(doc)
+            index[doc].append([stream.tell(), len(block), len(edges)])
+            stream.write(block)
+    with open(index_path(tmp_path), 'w') as stream:
+        json.dump({'version': STORE_VERSION,
+                   'order': order,
+                   'docs': index}, stream)
+    os.rename(index_path(tmp_path), index_path(path))
+    os.rename(tmp_path, path)
+
+
+def _grouped(lines, doc_of):
+    """
+    Group a stream of attelo output lines into runs of edges for
+    the same document
+    """
+    current = None
+    edges = []
+    for line in lines:
+        fields = line.rstrip(u'\r\n').split(u'\t')
+        if len(fields) < 3:
+            continue
+        doc = doc_of.get(fields[1])
+        if doc != current and edges:
+            yield current, edges
+            edges = []
+        current = doc
+        edges.append(tuple(fields[:3]))
+    if edges:
+        yield current, edges
+
+
+def convert_output(output_path, path, doc_of):
+    """
+    Convert an attelo output file into a prediction store,
+    streaming through it one document at a time
+
+    :param doc_of: document for each EDU id
+    :type doc_of: dict(string, string)
+    """
+    with codecs.open(output_path, 'r', 'utf-8') as lines:
+        write_store(path, _grouped(lines, doc_of))
+
+
+def load_index(path):
+    """
+    Read the index of a prediction store
+
+    :rtype: dict
+    """
+    with open(index_path(path)) as stream:
+        return json.load(stream)
+
+
+def has_store(path):
+    "True if there is a complete prediction store at this path"
+    return fp.exists(path) and fp.exists(index_path(path))
+
+
+def load_doc(path, doc, index=None):
+    """
+    Edges for a single document (empty if the store has none)
+
+    :rtype: [(string, string, string)]
+    """
+    index = index or load_index(path)
+    edges = []
+    with open(path, 'rb') as stream:
+        for offset, size, _ in index['docs'].get(doc, []):
+            stream.seek(offset)
+            edges.extend(_decode(stream.read(size)))
+    return edges
+
+
+def load_docs(path, docs):
+    """
+    Edges for a set of documents
+
+    :rtype: [(string, string, string)]
+    """
+    index = load_index(path)
+    edges = []
+    for doc in docs:
+        edges.extend(load_doc(path, doc, index))
+    return edges
+
+
+def iter_store(path):
+    """
+    Stream `(doc, edges)` for all documents in the store, one
+    block at a time (in the order they were written)
+    """
+    index = load_index(path)
+    blocks = sorted((offset, size, doc)
+                    for doc, entries in index['docs'].items()
+                    for offset, size, _ in entries)
+    with open(path, 'rb') as stream:
+        for offset, size, doc in blocks:
+            stream.seek(offset)
+            yield doc, _decode(stream.read(size))
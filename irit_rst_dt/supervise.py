@@ -0,0 +1,195 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Wall-clock and memory limits on learning and decoding tasks
+
+Tasks with limits (see `TASK_LIMITS` in `irit_rst_dt.local`) are
+run in a child process forked off whichever process would have run
+them (the main process, or a joblib worker). That process watches
+over the child, polling its resident memory, and kills it if it
+takes too long or grows too big. A killed task is retried a few
+times (`TASK_RETRIES`); if it keeps getting killed, we give up on it
+and leave a `.missing` marker next to its output (with the reason),
+so that the harness can carry on without it and report the
+evaluations that needed it as missing. Tasks that fail with an
+error still abort the run, as they would without limits.
+
+Memory is the resident set size of the child, which includes any
+data it shares with the process it was forked from.
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+from fnmatch import fnmatch
+from os import path as fp
+import json
+import os
+import signal
+import sys
+import time
+import traceback
+
+from .local import (TASK_LIMITS,
+                    TASK_RETRIES)
+
+# pylint: disable=too-few-public-methods
+
+MISSING_EXT = '.missing'
+"Suffix for the marker left by a task we gave up on"
+
+_FIELDS = ['phase', 'learner', 'decoder', 'key']
+
+_POLL_MIN = 0.01
+_POLL_MAX = 0.5
+"Bounds on the interval between checks on a running task (seconds)"
+
+# pylint: disable=pointless-string-statement
+TaskLimit = namedtuple('TaskLimit', ['secs', 'rss_mb', 'retries'])
+"""
+Limits on a task: wall-clock seconds and resident megabytes (either
+may be None), and number of retries after it is killed
+"""
+
+Outcome = namedtuple('Outcome', ['failure', 'pid', 'end', 'usage'])
+"""
+How an attempt at running a task went: the failure (None if it
+succeeded; else 'timeout', 'memory', 'killed' or 'error'), the
+process that ran it, when it ended, and its resource usage (as
+returned by `os.wait4`)
+"""
+# pylint: enable=pointless-string-statement
+
+
+def task_limit(info):
+    """
+    Limits for a task (None if it has none, or if we cannot enforce
+    them on this platform)
+
+    :type info: TaskInfo
+    """
+    if not hasattr(os, 'fork'):
+        return None
+    for pattern, secs, rss_mb in TASK_LIMITS:
+        field, sep, glob = pattern.partition(':')
+        if not sep or field not in _FIELDS:
+            field, glob = 'key', pattern
+        value = getattr(info, field)
+        if value is not None and fnmatch(value, glob):
+            if secs is None and rss_mb is None:
+                return None
+            return TaskLimit(secs, rss_mb, TASK_RETRIES)
+    return None
+
+
+def _rss_mb(pid):
+    "resident memory of a process in megabytes (None if unknown)"
+    try:
+        with open('/proc/{}/statm'.format(pid)) as stream:
+            pages = int(stream.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1048576.
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def _over_limit(limit, pid, start):
+    "the limit a running task has gone over, if any"
+    if limit.secs is not None and time.time() - start > limit.secs:
+        return 'timeout'
+    if limit.rss_mb is not None and (_rss_mb(pid) or 0) > limit.rss_mb:
+        return 'memory'
+    return None
+
+
+def _run_child(func, args):
+    "run a task in the child process (never returns)"
+    status = 1
+    try:
+        func(*args)  # pylint: disable=star-args
+        status = 0
+    except BaseException:  # pylint: disable=broad-except
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)  # pylint: disable=protected-access
+
+
+def run_limited(limit, func, args):
+    """
+    Run `func(*args)` in a child process, killing it if it goes
+    over the limits (the return value is lost)
+
+    :rtype: Outcome
+    """
+    start = time.time()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        _run_child(func, args)
+    failure = None
+    delay = _POLL_MIN
+    try:
+        while True:
+            wpid, status, usage = os.wait4(pid, os.WNOHANG)
+            if wpid:
+                break
+            if failure is None:
+                failure = _over_limit(limit, pid, start)
+                if failure is not None:
+                    os.kill(pid, signal.SIGKILL)
+            time.sleep(delay)
+            delay = min(delay * 2, _POLL_MAX)
+    except BaseException:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        raise
+    if failure is None and os.WIFSIGNALED(status):
+        failure = 'killed'  # eg. by the kernel, for want of memory
+    elif failure is None and os.WEXITSTATUS(status) != 0:
+        failure = 'error'
+    return Outcome(failure, pid, time.time(), usage)
+
+
+# ---------------------------------------------------------------------
+# missing outputs
+# ---------------------------------------------------------------------
+
+
+def is_missing(path):
+    """
+    True if we gave up on the task that writes the given output
+    """
+    return fp.exists(path + MISSING_EXT)
+
+
+def load_missing(path):
+    """
+    Why we gave up on the task that writes the given output (a dict
+    with the `reason`, and the `limit` it went over), or None
+    """
+    if not is_missing(path):
+        return None
+    with open(path + MISSING_EXT) as stream:
+        return json.load(stream)
+
+
+def mark_missing(path, reason, limit=None):
+    """
+    Record that we gave up on the task that writes the given output
+    """
+    blob = {'reason': reason,
+            'limit': None if limit is None else limit._asdict()}
+    with open(path + MISSING_EXT, 'w') as stream:
+        json.dump(blob, stream)
+
+
+def clear_missing(path):
+    """
+    Forget that we gave up on the task that writes the given output
+    (eg. because we are trying it again)
+    """
+    if is_missing(path):
+        os.remove(path + MISSING_EXT)
@@ -0,0 +1,454 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+
+"""
+Run telemetry
+
+Each learn, decode, reassembly, report and graph task appends a
+JSON record to a telemetry log in the evaluation directory: what
+the task was (phase, fold, learner, decoder), when it started and
+ended, which process ran it, and the CPU time, memory and I/O it
+used. Tasks run through joblib are wrapped so that the record is
+made inside the worker process.
+
+Every record also says which run of the harness it came from (the
+`run` field; see `RUN_ID`), since concurrent cluster jobs and resumed
+runs all append to the same log.
+
+Memory is the peak resident set size of the process that ran the
+task, as of the end of the task (so for a long-lived worker it may
+reflect an earlier, hungrier task). I/O counts come from
+`/proc/self/io`, and are missing where that is not available.
+
+Tasks with limits (see `irit_rst_dt.supervise`) run in a child
+process of their own; each attempt at running one gets a record
+(with the CPU, memory and block I/O of that process, and `isolated`
+set to say so), and attempts that were killed say why in their
+`failure` field.
+"""
+
+from __future__ import print_function
+from collections import (defaultdict, namedtuple)
+from contextlib import contextmanager
+from os import path as fp
+import json
+import os
+import socket
+import sys
+import time
+
+from joblib import (delayed)
+
+from .path import (telemetry_path)
+from .profiling import (profile_prefix, profiled)
+from .supervise import (mark_missing,
+                        run_limited,
+                        task_limit)
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# pylint: disable=too-few-public-methods
+
+_TOP_N = 15
+"Number of slowest tasks to list in the report"
+
+TaskInfo = namedtuple('TaskInfo', ['phase', 'key', 'fold', 'learner',
+                                   'decoder', 'run'])
+"What a task is (and which run it is part of), for the telemetry record"
+
+
+def _mk_run_id():
+    "an id for this run of the harness (and cluster job, if any)"
+    parts = [socket.gethostname(), str(os.getpid()),
+             '{:.0f}'.format(time.time())]
+    job_id = os.environ.get('SLURM_JOB_ID')
+    if job_id is not None:
+        parts.insert(0, 'job' + job_id)
+    return '-'.join(parts)
+
+
+RUN_ID = _mk_run_id()
+"""
+Id of this run of the harness (task descriptions are made in the
+process driving the run, so the tasks it farms out to workers get
+its id, not theirs)
+"""
+
+
+def task_info(phase, key, fold=None, learner=None, decoder=None):
+    """
+    Description of a task in this run (fields other than phase and
+    key are optional)
+    """
+    return TaskInfo(phase, key, fold, learner, decoder, RUN_ID)
+
+
+def _proc_io():
+    "(bytes read, bytes written) for this process, or (None, None)"
+    try:
+        with open('/proc/self/io') as stream:
+            fields = dict(l.split(':', 1) for l in stream if ':' in l)
+        return int(fields['read_bytes']), int(fields['write_bytes'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None, None
+
+
+def _snapshot():
+    "resource usage for this process so far"
+    if resource is None:
+        cpu_user = cpu_sys = maxrss = None
+    else:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_user = usage.ru_utime
+        cpu_sys = usage.ru_stime
+        # kilobytes on Linux, bytes on OS X
+        maxrss = usage.ru_maxrss // 1024 if sys.platform == 'darwin'\
+            else usage.ru_maxrss
+    read_bytes, write_bytes = _proc_io()
+    return {'time': time.time(),
+            'cpu_user': cpu_user,
+            'cpu_sys': cpu_sys,
+            'maxrss': maxrss,
+            'read': read_bytes,
+            'write': write_bytes}
+
+
+def _delta(before, after, field):
+    "difference between two snapshots (None if unknown)"
+    if before[field] is None or after[field] is None:
+        return None
+    return after[field] - before[field]
+
+
+def _record(info, before, after, ok, pid=None, failure=None,
+            isolated=False):
+    """
+    telemetry record for a task (run in this process by default;
+    isolated if it ran in a process of its own)
+    """
+    blob = dict(info._asdict())
+    blob.update({'start': before['time'],
+                 'end': after['time'],
+                 'pid': pid or os.getpid(),
+                 'peak_rss_kb': after['maxrss'],
+                 'cpu_user': _delta(before, after, 'cpu_user'),
+                 'cpu_sys': _delta(before, after, 'cpu_sys'),
+                 'read_bytes': _delta(before, after, 'read'),
+                 'write_bytes': _delta(before, after, 'write'),
+                 'ok': ok,
+                 'failure': failure,
+                 'isolated': isolated})
+    return blob
+
+
+def _child_record(info, start, outcome):
+    "telemetry record for an attempt at a task in a child process"
+    usage = outcome.usage
+    before = {'time': start, 'cpu_user': 0., 'cpu_sys': 0.,
+              'read': 0, 'write': 0}
+    after = {'time': outcome.end,
+             'cpu_user': usage.ru_utime,
+             'cpu_sys': usage.ru_stime,
+             'maxrss': usage.ru_maxrss // 1024 if sys.platform == 'darwin'
+                       else usage.ru_maxrss,
+             'read': usage.ru_inblock * 512,
+             'write': usage.ru_oublock * 512}
+    return _record(info, before, after, outcome.failure is None,
+                   pid=outcome.pid, failure=outcome.failure,
+                   isolated=True)
+
+
+def _append(path, blob):
+    """
+    Append a record to a telemetry log (a single write on a file
+    opened for appending, so records from concurrent processes do
+    not get mixed up)
+    """
+    line = (json.dumps(blob, sort_keys=True) + '\n').encode('utf-8')
+    fdesc = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fdesc, line)
+    finally:
+        os.close(fdesc)
+
+
+def _profiled_call(prefix, func, args, kwargs):
+    "run a job, profiling it if there is a profile prefix"
+    with profiled(prefix):
+        return func(*args, **kwargs)  # pylint: disable=star-args
+
+
+def _run_limited(path, info, prefix, limit, output, written,
+                 func, args, kwargs):
+    """
+    run a job in a child process under some limits, retrying it
+    if it is killed (deleting whatever file it was writing), and
+    marking its output as missing if we have to give up on it
+    """
+    for attempt in range(limit.retries + 1):
+        start = time.time()
+        outcome = run_limited(limit, _profiled_call,
+                              (prefix, func, args, kwargs))
+        _append(path, _child_record(info, start, outcome))
+        if outcome.failure is None:
+            return
+        elif outcome.failure == 'error':
+            raise RuntimeError('{} task {} failed (see above)'
+                               ''.format(info.phase, info.key))
+        if written is not None and fp.exists(written):
+            os.remove(written)  # may be incomplete
+        print('{} task {} (fold {}) was killed ({}, attempt {} of {})'
+              ''.format(info.phase, info.key, info.fold, outcome.failure,
+                        attempt + 1, limit.retries + 1),
+              file=sys.stderr)
+    if output is not None:
+        mark_missing(output, outcome.failure, limit)
+
+
+def _run_traced(path, info, prefix, limit, output, written,
+                func, args, kwargs):
+    """
+    run a job, appending its telemetry record, and profiling it
+    if there is a profile prefix (in the worker); jobs with limits
+    are supervised (see `irit_rst_dt.supervise`)
+    """
+    if limit is not None:
+        return _run_limited(path, info, prefix, limit, output, written,
+                            func, args, kwargs)
+    before = _snapshot()
+    ok = False
+    try:
+        res = _profiled_call(prefix, func, args, kwargs)
+        ok = True
+        return res
+    finally:
+        _append(path, _record(info, before, _snapshot(), ok))
+
+
+def traced(lconf, info, job, output=None, written=None):
+    """
+    Wrap a delayed job so that it records its telemetry when run,
+    and is profiled if we asked for it (None stays None)
+
+    If the task has limits (see `irit_rst_dt.supervise`), it runs
+    under them and returns nothing; the output path (if given) is
+    what we mark as missing if we give up on it (it is up to the
+    caller to clear old markers before trying again; see
+    `clear_missing`). If the task is killed, we delete the file it
+    was writing: `written` if given (eg. one group's part of an
+    output that is put together later), else the output path.
+    """
+    if job is None:
+        return None
+    func, args, kwargs = job
+    return delayed(_run_traced)(telemetry_path(lconf), info,
+                                profile_prefix(lconf, info),
+                                task_limit(info), output,
+                                written if written is not None else output,
+                                func, args, kwargs)
+
+
+@contextmanager
+def task(lconf, info):
+    """
+    Record telemetry for a task run in this process (and profile
+    it if we asked for it) ::
+
+        with task(lconf, task_info('report', 'fold-report', fold)):
+            ...
+    """
+    before = _snapshot()
+    ok = False
+    try:
+        with profiled(profile_prefix(lconf, info)):
+            yield
+        ok = True
+    finally:
+        _append(telemetry_path(lconf),
+                _record(info, before, _snapshot(), ok))
+
+
+# ---------------------------------------------------------------------
+# reporting
+# ---------------------------------------------------------------------
+
+
+def load_telemetry(lconf):
+    """
+    All telemetry records for an evaluation (in order of starting
+    time)
+    """
+    path = telemetry_path(lconf)
+    if not fp.exists(path):
+        return []
+    records = []
+    with open(path) as stream:
+        for line in stream:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue  # eg. a truncated line from a killed run
+    return sorted(records, key=lambda r: r['start'])
+
+
+def _by_run(records):
+    """
+    Records grouped by the run they came from (in order of each
+    run's first task; records from before we had run ids count as
+    a single run)
+
+    :rtype: [(string, [dict])]
+    """
+    runs = {}
+    order = []
+    for rec in records:
+        run = rec.get('run')
+        if run not in runs:
+            runs[run] = []
+            order.append(run)
+        runs[run].append(rec)
+    return [(r, runs[r]) for r in order]
+
+
+def _stages(records):
+    """
+    Group records into stages: within each run, sequences of tasks
+    of the same phase and fold, which the harness runs as a batch
+    before moving on (runs that overlap, eg. cluster jobs sharing
+    the log, do not break up each other's stages)
+
+    :rtype: [((string, string, int), [dict])]
+    """
+    stages = []
+    for run, recs in _by_run(records):
+        for rec in recs:
+            sid = (run, rec['phase'], rec['fold'])
+            if stages and stages[-1][0] == sid:
+                stages[-1][1].append(rec)
+            else:
+                stages.append((sid, [rec]))
+    return stages
+
+
+def _secs(rec):
+    "duration of a task"
+    return rec['end'] - rec['start']
+
+
+def _mb(nbytes):
+    "bytes as megabytes (blank if unknown)"
+    return '' if nbytes is None else '{:.1f}'.format(nbytes / 1048576.)
+
+
+def _sum(records, field):
+    "sum of a field (None if any of the values is unknown)"
+    values = [r[field] for r in records]
+    return None if any(v is None for v in values) else sum(values)
+
+
+def show_phase_totals(records):
+    """
+    Per-phase totals: wall time (over the stages of that phase,
+    summed over the runs), task time, CPU time, peak memory and I/O
+    """
+    walls = defaultdict(float)
+    for (_, phase, _), recs in _stages(records):
+        walls[phase] += max(r['end'] for r in recs) -\
+            min(r['start'] for r in recs)
+    by_phase = defaultdict(list)
+    for rec in records:
+        by_phase[rec['phase']].append(rec)
+    header = ['phase', 'tasks', 'wall-secs', 'task-secs', 'cpu-secs',
+              'peak-rss-mb', 'read-mb', 'written-mb', 'failed']
+    lines = ['\t'.join(header)]
+    for phase, recs in sorted(by_phase.items()):
+        cpu = _sum(recs, 'cpu_user')
+        if cpu is not None:
+            cpu += _sum(recs, 'cpu_sys') or 0
+        rss = [r['peak_rss_kb'] for r in recs
+               if r['peak_rss_kb'] is not None]
+        lines.append('\t'.join([
+            phase,
+            str(len(recs)),
+            '{:.1f}'.format(walls[phase]),
+            '{:.1f}'.format(sum(_secs(r) for r in recs)),
+            '' if cpu is None else '{:.1f}'.format(cpu),
+            _mb(max(rss) * 1024) if rss else '',
+            _mb(_sum(recs, 'read_bytes')),
+            _mb(_sum(recs, 'write_bytes')),
+            str(sum(1 for r in recs if not r['ok']))]))
+    return '\n'.join(lines)
+
+
+def show_critical_path(records):
+    """
+    The critical path through each run: for each stage, the task
+    that finished last (the one everything after it waited for),
+    along with the stage's wall time and how well its tasks were
+    spread over the workers
+    """
+    header = ['run', 'phase', 'fold', 'wall-secs', 'task-secs',
+              'parallelism', 'critical-task', 'critical-secs']
+    lines = ['\t'.join(header)]
+    totals = []
+    for (run, phase, fold), recs in _stages(records):
+        wall = max(r['end'] for r in recs) - min(r['start'] for r in recs)
+        busy = sum(_secs(r) for r in recs)
+        last = max(recs, key=lambda r: r['end'])
+        if not totals or totals[-1][0] != run:
+            totals.append((run, 0.))
+        totals[-1] = (run, totals[-1][1] + wall)
+        lines.append('\t'.join([
+            run or '',
+            phase,
+            '' if fold is None else str(fold),
+            '{:.1f}'.format(wall),
+            '{:.1f}'.format(busy),
+            '{:.1f}'.format(busy / wall) if wall else '',
+            last['key'],
+            '{:.1f}'.format(_secs(last))]))
+    for run, total in totals:
+        lines.append('total wall time on the critical path{}: {:.1f}s'
+                     ''.format('' if run is None else ' of ' + run, total))
+    return '\n'.join(lines)
+
+
+def show_slowest(records, top_n=_TOP_N):
+    """
+    The slowest tasks in the run
+    """
+    header = ['secs', 'phase', 'fold', 'key', 'pid', 'peak-rss-mb']
+    lines = ['\t'.join(header)]
+    for rec in sorted(records, key=_secs, reverse=True)[:top_n]:
+        lines.append('\t'.join([
+            '{:.1f}'.format(_secs(rec)),
+            rec['phase'],
+            '' if rec['fold'] is None else str(rec['fold']),
+            rec['key'],
+            str(rec['pid']),
+            _mb(rec['peak_rss_kb'] * 1024)
+            if rec['peak_rss_kb'] is not None else '']))
+    return '\n'.join(lines)
+
+
+def mk_telemetry_report(lconf, output_path):
+    """
+    Write the telemetry section of the report (nothing if we have
+    no telemetry)
+    """
+    records = load_telemetry(lconf)
+    if not records:
+        return
+    sections = [('Phase totals', show_phase_totals(records)),
+                ('Critical path', show_critical_path(records)),
+                ('Slowest tasks', show_slowest(records))]
+    with open(output_path, 'w') as stream:
+        for title, body in sections:
+            print(title, file=stream)
+            print('=' * len(title), file=stream)
+            print(body, file=stream)
+            print(file=stream)
@@ -9,6 +9,7 @@ Miscellaneous utility functions
 from collections import (Counter)
 import hashlib
 import itertools
+import multiprocessing
 import os
 import sys
 
@@ -40,11 +41,30 @@ def concat_i(itr):
     return itertools.chain.from_iterable(itr)
 
 
-def md5sum_file(path, blocksize=65536):
+def _mk_hasher(algo):
     """
-    Read a file and return its md5 sum
+    Return a fresh hash object for the given digest algorithm
+
+    Aside from the hashlib algorithms, we accept 'xxh64' if the
+    (optional) xxhash package is installed; it is a good deal
+    faster than md5 on large model files
     """
-    hasher = hashlib.md5()
+    if algo == 'xxh64':
+        try:
+            import xxhash
+        except ImportError:
+            raise ValueError('The xxh64 digest needs the xxhash package '
+                             '(pip install xxhash)')
+        return xxhash.xxh64()
+    else:
+        return hashlib.new(algo)
+
+
+def digest_file(path, algo='md5', blocksize=1 << 20):
+    """
+    Read a file and return its hex digest
+    """
+    hasher = _mk_hasher(algo)
     with open(path, 'rb') as afile:
         buf = afile.read(blocksize)
         while len(buf) > 0:
@@ -52,6 +72,13 @@ def md5sum_file(path, blocksize=65536):
             buf = afile.read(blocksize)
     return hasher.hexdigest()
 
+
+def md5sum_file(path, blocksize=65536):
+    """
+    Read a file and return its md5 sum
+    """
+    return digest_file(path, 'md5', blocksize)
+
 # ---------------------------------------------------------------------
 # config
 # ---------------------------------------------------------------------
@@ -85,6 +112,17 @@ def sanity_check_config():
 # ---------------------------------------------------------------------
 
 
+def n_workers(n_jobs):
+    """
+    Number of worker processes for an `n_jobs` setting, as joblib
+    reads it: positive is that many, -1 is all of the CPUs, -2 all
+    but one, and so on (at least one); 0 (sequential) stays 0
+    """
+    if n_jobs >= 0:
+        return n_jobs
+    return max(1, multiprocessing.cpu_count() + 1 + n_jobs)
+
+
 def parallel(lconf, n_jobs=None, verbose=None):
     """
     Run some delayed jobs in parallel (or sequentially